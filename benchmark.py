@@ -0,0 +1,232 @@
+"""
+Benchmark headless di streamlit_app.py: l'app gira con AppTest contro fake_github (latenza ed errori 403/409
+configurabili) e si misurano avvio a freddo, cambio mese, rerun dopo la modifica di una cella e salvataggio,
+al variare del numero di medici e dei mesi visualizzati. I risultati sono JSON confrontabili tra versioni.
+
+Uso:
+    python benchmark.py --medici 10 50 200 500 --mesi 1 3 --ripetizioni 5 --output risultati.json
+    python benchmark.py --latenza-ms 80 --prob-403 0.05 --prob-409 0.1 --output rete_lenta.json
+    python benchmark.py --confronta base.json risultati.json --soglia 0.2 # exit 1 se un p50 peggiora oltre il 20%
+L'app scrive log, journal, cache e backup in una directory temporanea: il benchmark non tocca quelli reali.
+"""
+import argparse
+import calendar
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+import fake_github
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+# AppTest non ha un'API per st.data_editor: l'app gira con l'editor avvolto da questa funzione, che applica al suo
+# risultato le celle messe in st.session_state["benchmark_celle"] (come farebbe la modifica dal browser)
+EDITOR_BENCHMARK = """import streamlit as st
+def data_editor_benchmark(data, *args, **kwargs):
+    modificato = st.data_editor(data, *args, **kwargs)
+    for riga, colonna, valore in st.session_state.pop("benchmark_celle", []): modificato.loc[modificato.index[riga], colonna] = valore
+    return modificato
+"""
+TIPI_ASSENZA = ["Ferie", "Malattia", "Congresso", "Lezione", "Altro"]
+SCENARI = ["avvio_a_freddo", "modifica_cella", "salvataggio", "cambio_mese", "cambio_mese_in_cache"]
+
+
+def nome_medico(i):
+    """Nomi accettati dall'app (solo lettere) e distinti: Medico Ba, Medico Bb, ..."""
+    lettere, i = "", i + 26
+    while i: i, resto = divmod(i, 26); lettere = chr(97 + resto) + lettere
+    return f"Medico {lettere.capitalize()}"
+
+
+def file_assenze(medici, anno, mese, casuale, quota=0.3):
+    """File assenze v2 con un intervallo di 1-5 giorni per circa `quota` dei medici."""
+    giorni = calendar.monthrange(anno, mese)[1]; assenze = {}
+    for medico in medici:
+        if casuale.random() >= quota: continue
+        inizio = casuale.randint(1, giorni); fine = min(giorni, inizio + casuale.randint(0, 4))
+        assenze[medico] = [{"start": date(anno, mese, inizio).isoformat(), "end": date(anno, mese, fine).isoformat(), "tipo": casuale.choice(TIPI_ASSENZA)}]
+    return {"versione": 2, "anno": anno, "mese": mese, "medici": assenze}
+
+
+def prepara_server(n_medici, anno, args):
+    """Server GitHub finto con `n_medici` medici e assenze per tutti i mesi di `anno` e dell'anno successivo."""
+    server = fake_github.avvia_in_background(latenza=args.latenza_ms / 1000, seme=args.seme)
+    casuale = random.Random(args.seme); medici = [nome_medico(i) for i in range(n_medici)]
+    server.repo.scrivi_file("medici.json", json.dumps(medici, ensure_ascii=False).encode("utf-8"))
+    for a in (anno, anno + 1):
+        for mese in range(1, 13):
+            server.repo.scrivi_file(f"assenze_medici_{a}_{mese:02d}.json", json.dumps(file_assenze(medici, a, mese, casuale), separators=(',', ':')).encode("utf-8"))
+    if args.prob_403: fake_github.inietta_guasto(server, 403, ("GET", "PUT", "POST", "PATCH"), volte=None, probabilita=args.prob_403)
+    if args.prob_409: fake_github.inietta_guasto(server, 409, ("PUT",), volte=None, probabilita=args.prob_409)
+    return server
+
+
+def periodo(anno, n_mesi, k):
+    """Mese iniziale del k-esimo periodo di `n_mesi` mesi a partire da gennaio di `anno`."""
+    indice = k * n_mesi; return anno + indice // 12, indice % 12 + 1
+
+
+def crea_app(server, anno, n_mesi, timeout):
+    from streamlit.testing.v1 import AppTest
+    with open(APP_PATH, encoding="utf-8") as f: sorgente = f.read()
+    if sorgente.count("st.data_editor(") != 1: raise RuntimeError("streamlit_app.py deve avere una sola chiamata a st.data_editor")
+    at = AppTest.from_string(EDITOR_BENCHMARK + sorgente.replace("st.data_editor(", "data_editor_benchmark("), default_timeout=timeout)
+    at.secrets.update({"GITHUB_USER": "benchmark", "REPO_NAME": "benchmark", "GITHUB_TOKEN": "benchmark", "GITHUB_API_URL": f"http://127.0.0.1:{server.server_port}",
+                       "GITHUB_RATE_BURST": "100000", "RETRY_DELAY_SECONDS": "1"})
+    at.session_state["sel_anno"] = anno; at.session_state["sel_mese"] = 1
+    if n_mesi == 3: at.session_state["sel_vista"] = "Trimestre"
+    elif n_mesi > 1: at.session_state["sel_vista"] = "Più mesi"; at.session_state["sel_n_mesi"] = n_mesi
+    return at
+
+
+def svuota_cache():
+    """Avvio a freddo: cache Streamlit del processo e cache locale dei contenuti GitHub vuote."""
+    import streamlit as st
+    st.cache_data.clear(); st.cache_resource.clear()
+    shutil.rmtree(os.path.join(tempfile.gettempdir(), "medical_shifts_app_cache"), ignore_errors=True)
+
+
+def attendi_operazioni(at, timeout):
+    """Come il frammento di monitoraggio dell'app: attende le operazioni GitHub in background e rilancia lo script per applicarne l'esito."""
+    scadenza = time.monotonic() + timeout
+    while any(not op.conclusa for op in at.session_state["operazioni_github"].values()):
+        if time.monotonic() > scadenza: raise TimeoutError(f"Operazioni GitHub non concluse entro {timeout}s")
+        time.sleep(0.005)
+    return at.run()
+
+
+def errori_app(at):
+    return [str(e.value) for e in at.exception] + [str(e.value) for e in at.error]
+
+
+def modifica_cella(at, riga, tipo):
+    """Simula la modifica di una cella dell'editor (vedi EDITOR_BENCHMARK) e il rerun che ne segue."""
+    editor = next(e for e in at.dataframe if e.proto.id) # st.data_editor: elemento dataframe con id di widget
+    medico = editor.value.columns[2] # Prima colonna medico dopo Data e Giorno
+    at.session_state["benchmark_celle"] = [(riga, medico, tipo)]; at.run()
+
+
+def attendi_commit(server, ref_iniziale, timeout):
+    """Attende che il salvataggio in background aggiorni il branch; False se non succede entro `timeout` secondi."""
+    scadenza = time.monotonic() + timeout
+    while server.repo.refs[server.repo.default_branch] == ref_iniziale:
+        if time.monotonic() > scadenza: return False
+        time.sleep(0.005)
+    return True
+
+
+def misura(server, campioni, scenario, azione):
+    """Esegue `azione` e ne registra durata, richieste GitHub ed eventuale errore sotto `scenario`."""
+    richieste_prima = sum(server.richieste.values()); inizio = time.perf_counter()
+    try: errore = azione()
+    except Exception as e: errore = f"{type(e).__name__}: {e}"
+    campioni.setdefault(scenario, []).append({"secondi": time.perf_counter() - inizio, "richieste_github": sum(server.richieste.values()) - richieste_prima, "errore": errore})
+
+
+def esegui_configurazione(n_medici, n_mesi, args):
+    anno = date.today().year # Primo anno selezionabile nell'app oltre al precedente
+    server = prepara_server(n_medici, anno, args); campioni = {}
+    try:
+        at = None
+        for _ in range(args.ripetizioni):
+            svuota_cache(); at = crea_app(server, anno, n_mesi, args.timeout)
+            misura(server, campioni, "avvio_a_freddo", lambda: "; ".join(errori_app(attendi_operazioni(at.run(), args.timeout))) or None)
+        for k in range(args.ripetizioni):
+            tipo = TIPI_ASSENZA[k % len(TIPI_ASSENZA)]
+            misura(server, campioni, "modifica_cella", lambda: modifica_cella(at, k, tipo) or "; ".join(errori_app(at)) or None)
+            ref_iniziale = server.repo.refs[server.repo.default_branch]
+            def salva():
+                at.button(key="btn_salva_json_github").click().run()
+                return None if attendi_commit(server, ref_iniziale, args.timeout) else f"Nessun commit entro {args.timeout}s"
+            misura(server, campioni, "salvataggio", salva)
+            at.run() # Raccoglie l'esito del salvataggio (non misurato)
+        for k in range(1, args.ripetizioni + 1):
+            for scenario, (anno_k, mese_k) in (("cambio_mese", periodo(anno, n_mesi, k)), ("cambio_mese_in_cache", periodo(anno, n_mesi, 0))):
+                def cambia():
+                    at.selectbox(key="sel_anno").select(anno_k); at.selectbox(key="sel_mese").select(mese_k)
+                    return "; ".join(errori_app(at.run())) or None
+                misura(server, campioni, scenario, cambia)
+    finally: server.shutdown(); server.server_close()
+    return [riepiloga(scenario, n_medici, n_mesi, campioni[scenario]) for scenario in SCENARI if scenario in campioni]
+
+
+def riepiloga(scenario, n_medici, n_mesi, campioni):
+    durate = np.array([c["secondi"] for c in campioni]); errori = [c["errore"] for c in campioni if c["errore"]]
+    return {"scenario": scenario, "medici": n_medici, "mesi": n_mesi, "ripetizioni": len(campioni),
+            "p50": float(np.percentile(durate, 50)), "p95": float(np.percentile(durate, 95)), "media": float(durate.mean()),
+            "min": float(durate.min()), "max": float(durate.max()),
+            "richieste_github": float(np.mean([c["richieste_github"] for c in campioni])), "errori": len(errori), "esempi_errori": errori[:3]}
+
+
+def metadati(args):
+    import pandas as pd
+    import streamlit as st
+    try: commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(APP_PATH), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError): commit = None
+    return {"data": datetime.now().isoformat(timespec="seconds"), "commit": commit, "python": platform.python_version(), "streamlit": st.__version__, "pandas": pd.__version__,
+            "piattaforma": platform.platform(), "parametri": {k: v for k, v in vars(args).items() if k not in ("output", "confronta")}}
+
+
+def stampa_tabella(risultati):
+    print(f"{'scenario':<22}{'medici':>7}{'mesi':>5}{'p50 s':>9}{'p95 s':>9}{'max s':>9}{'req GH':>8}{'errori':>8}")
+    for r in risultati:
+        print(f"{r['scenario']:<22}{r['medici']:>7}{r['mesi']:>5}{r['p50']:>9.3f}{r['p95']:>9.3f}{r['max']:>9.3f}{r['richieste_github']:>8.1f}{r['errori']:>8}")
+
+
+def confronta(file_base, file_nuovo, soglia):
+    """Confronta i p50 di due esecuzioni per scenario/medici/mesi; restituisce il numero di regressioni oltre `soglia`."""
+    with open(file_base, encoding="utf-8") as f: base = {(r["scenario"], r["medici"], r["mesi"]): r for r in json.load(f)["risultati"]}
+    with open(file_nuovo, encoding="utf-8") as f: nuovo = json.load(f)["risultati"]
+    regressioni = 0
+    print(f"{'scenario':<22}{'medici':>7}{'mesi':>5}{'p50 base':>10}{'p50 nuovo':>11}{'variazione':>12}")
+    for r in nuovo:
+        b = base.get((r["scenario"], r["medici"], r["mesi"]))
+        if b is None: continue
+        variazione = r["p50"] / b["p50"] - 1 if b["p50"] else 0.0; peggiorato = variazione > soglia; regressioni += peggiorato
+        print(f"{r['scenario']:<22}{r['medici']:>7}{r['mesi']:>5}{b['p50']:>10.3f}{r['p50']:>11.3f}{variazione:>+11.0%}{'  ⚠️' if peggiorato else ''}")
+    return regressioni
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark headless di streamlit_app.py contro un GitHub finto")
+    parser.add_argument("--medici", type=int, nargs="+", default=[10, 50, 200, 500], help="Dimensioni dell'elenco medici")
+    parser.add_argument("--mesi", type=int, nargs="+", default=[1, 3], help="Mesi visualizzati (1, 3 = trimestre, altrimenti 'Più mesi')")
+    parser.add_argument("--ripetizioni", type=int, default=3)
+    parser.add_argument("--latenza-ms", type=float, default=0, help="Latenza aggiunta dal GitHub finto a ogni richiesta")
+    parser.add_argument("--prob-403", type=float, default=0, help="Probabilità di un 403 (rate limit secondario) su ogni richiesta")
+    parser.add_argument("--prob-409", type=float, default=0, help="Probabilità di un 409 su ogni PUT")
+    parser.add_argument("--seme", type=int, default=0, help="Seme per assenze generate ed errori iniettati")
+    parser.add_argument("--timeout", type=float, default=120, help="Secondi massimi per un rerun o un salvataggio")
+    parser.add_argument("--output", help="File JSON dei risultati (default: stdout)")
+    parser.add_argument("--confronta", nargs=2, metavar=("BASE", "NUOVO"), help="Confronta due file di risultati invece di eseguire il benchmark")
+    parser.add_argument("--soglia", type=float, default=0.2, help="Peggioramento relativo del p50 considerato regressione (--confronta)")
+    args = parser.parse_args()
+    if args.confronta: sys.exit(1 if confronta(*args.confronta, args.soglia) else 0)
+    if max(args.mesi) * (args.ripetizioni + 1) > 24: parser.error("mesi x (ripetizioni + 1) non può superare 24: i file assenze generati coprono due anni.")
+
+    directory_lavoro = tempfile.mkdtemp(prefix="benchmark_turni_"); cwd = os.getcwd()
+    os.chdir(directory_lavoro); tempfile.tempdir = directory_lavoro # Log, journal, cache e backup dell'app restano qui
+    try:
+        risultati = []
+        for n_medici in args.medici:
+            for n_mesi in args.mesi:
+                print(f"▶ {n_medici} medici, {n_mesi} mesi...", file=sys.stderr, flush=True)
+                risultati += esegui_configurazione(n_medici, n_mesi, args)
+    finally: os.chdir(cwd); tempfile.tempdir = None; shutil.rmtree(directory_lavoro, ignore_errors=True)
+    documento = {"meta": metadati(args), "risultati": risultati}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: json.dump(documento, f, indent=2, ensure_ascii=False)
+        stampa_tabella(risultati)
+    else: json.dump(documento, sys.stdout, indent=2, ensure_ascii=False); print()
+
+
+if __name__ == "__main__":
+    main()
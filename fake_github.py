@@ -0,0 +1,216 @@
+"""
+Server HTTP locale che simula le API GitHub usate da streamlit_app.py (contents API e Git Data API),
+per provare l'app senza toccare un repository reale.
+
+Uso:
+    python fake_github.py --port 8765 --seed medici.json assenze_medici_2025_06.json
+    python fake_github.py --latenza-ms 80 --prob-403 0.05 --prob-409 0.1 # rete lenta, rate limit secondario e conflitti
+e nelle secrets dell'app:
+    GITHUB_API_URL = "http://127.0.0.1:8765"
+Qualsiasi GITHUB_USER/REPO_NAME/GITHUB_TOKEN è accettato: il server gestisce un solo repository in memoria.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+def sha_blob_git(contenuto):
+    """SHA di un blob calcolato come fa git, così gli SHA coincidono con quelli di GitHub."""
+    return hashlib.sha1(b"blob %d\0" % len(contenuto) + contenuto).hexdigest()
+
+
+class RepoFinto:
+    """Repository in memoria: blob, alberi (path completo -> SHA blob), commit e ref dei branch."""
+    def __init__(self, branch="main"):
+        self.lock = threading.RLock(); self.default_branch = branch
+        self.blobs = {}; self.trees = {}; self.commits = {}; self.refs = {}
+        self.refs[branch] = self._crea_commit(self._crea_tree({}), [], "Commit iniziale")
+
+    def _crea_blob(self, contenuto):
+        sha = sha_blob_git(contenuto); self.blobs[sha] = contenuto; return sha
+    def _crea_tree(self, voci):
+        sha = hashlib.sha1(json.dumps(sorted(voci.items())).encode()).hexdigest(); self.trees[sha] = dict(voci); return sha
+    def _crea_commit(self, tree_sha, parents, messaggio):
+        sha = hashlib.sha1(json.dumps([tree_sha, parents, messaggio, len(self.commits)]).encode()).hexdigest()
+        self.commits[sha] = {"tree": tree_sha, "parents": parents, "message": messaggio}; return sha
+    def voci_branch(self, branch=None):
+        """Voci dell'albero di un branch o, come il parametro `ref` di GitHub, di un commit indicato per SHA."""
+        ref = branch or self.default_branch
+        return self.trees[self.commits[self.refs.get(ref, ref)]["tree"]]
+    def leggi_file(self, path, branch=None):
+        with self.lock:
+            sha = self.voci_branch(branch).get(path)
+            return (self.blobs[sha], sha) if sha else (None, None)
+    def scrivi_file(self, path, contenuto, branch=None, messaggio="Aggiornamento"):
+        """Scrittura diretta (contents API o seed): un commit per file. Restituisce lo SHA del blob."""
+        with self.lock:
+            branch = branch or self.default_branch; voci = dict(self.voci_branch(branch))
+            voci[path] = self._crea_blob(contenuto)
+            self.refs[branch] = self._crea_commit(self._crea_tree(voci), [self.refs[branch]], messaggio)
+            return voci[path]
+
+
+class GitHubFintoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, come GitHub
+    repo = None # RepoFinto, impostato da crea_server
+    latenza = 0.0 # Secondi di attesa aggiunti a ogni richiesta (rete simulata)
+    guasti = None # Errori da iniettare (vedi inietta_guasto), condivisi dal server
+    richieste = None # Counter delle richieste ricevute per metodo
+    casuale = None # random.Random con seme fisso: iniezioni riproducibili
+    max_voci_albero = None # Voci massime di un albero restituito (None: tutte), per simulare un albero troncato
+
+    def log_message(self, format, *args): pass
+    def _invia(self, status, corpo=None, headers=None):
+        dati = json.dumps(corpo).encode() if corpo is not None else b""
+        self.send_response(status)
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.send_header("Content-Type", "application/json"); self.send_header("Content-Length", str(len(dati))); self.end_headers()
+        self.wfile.write(dati)
+    def _leggi_corpo(self):
+        lunghezza = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(lunghezza)) if lunghezza else {}
+    def _instrada(self, metodo):
+        parti = urlsplit(self.path); query = parse_qs(parti.query)
+        m = re.match(r"^/repos/[^/]+/[^/]+(?P<resto>/.*)?$", parti.path)
+        if not m: return self._invia(404, {"message": "Not Found"})
+        resto = m.group("resto") or ""
+        if self.latenza: time.sleep(self.latenza)
+        try: corpo = self._leggi_corpo() if metodo in ("PUT", "POST", "PATCH") else {}
+        except ValueError: return self._invia(400, {"message": "Problems parsing JSON"})
+        with self.repo.lock:
+            self.richieste[metodo] += 1; guasto = self._guasto(metodo) # Il corpo è già letto: la connessione keep-alive resta pulita
+            if guasto == 403:
+                return self._invia(403, {"message": "You have exceeded a secondary rate limit."}, {"Retry-After": "1", "X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 1)})
+            if guasto: return self._invia(guasto, {"message": f"Errore iniettato {guasto}"})
+            if resto == "" and metodo == "GET": return self._invia(200, {"full_name": "fake/repo", "default_branch": self.repo.default_branch})
+            if resto.startswith("/contents/"): return self._contents(metodo, resto[len("/contents/"):], query, corpo)
+            if resto.startswith("/git/"): return self._git(metodo, resto[len("/git/"):], query, corpo)
+        return self._invia(404, {"message": "Not Found"})
+
+    def _guasto(self, metodo):
+        """Status da restituire al posto della risposta reale, se un guasto iniettato si applica a questa richiesta."""
+        for guasto in self.guasti:
+            if metodo not in guasto["metodi"] or guasto["rimanenti"] == 0 or self.casuale.random() >= guasto["probabilita"]: continue
+            if guasto["rimanenti"] is not None: guasto["rimanenti"] -= 1
+            return guasto["status"]
+        return None
+
+    def _contents(self, metodo, path, query, corpo):
+        branch = (query.get("ref") or [None])[0] if metodo == "GET" else corpo.get("branch")
+        if branch and branch not in self.repo.refs and not (metodo == "GET" and branch in self.repo.commits): return self._invia(404, {"message": "No commit found for the ref"})
+        contenuto, sha = self.repo.leggi_file(path, branch)
+        if metodo == "GET":
+            if sha is None: return self._invia(404, {"message": "Not Found"})
+            etag = f'"{sha}"'
+            if self.headers.get("If-None-Match") == etag: return self._invia(304, None, {"ETag": etag})
+            return self._invia(200, {"path": path, "sha": sha, "size": len(contenuto), "encoding": "base64", "content": base64.b64encode(contenuto).decode()}, {"ETag": etag})
+        if metodo == "PUT":
+            if sha is not None and corpo.get("sha") != sha:
+                return self._invia(409 if corpo.get("sha") else 422, {"message": f"{path} does not match {corpo.get('sha')}"})
+            nuovo_sha = self.repo.scrivi_file(path, base64.b64decode(corpo.get("content", "")), branch, corpo.get("message", ""))
+            return self._invia(201 if sha is None else 200, {"content": {"path": path, "sha": nuovo_sha}, "commit": {"sha": self.repo.refs[branch or self.repo.default_branch]}})
+        return self._invia(405, {"message": "Method Not Allowed"})
+
+    def _git(self, metodo, resto, query, corpo):
+        repo = self.repo
+        if metodo == "GET" and resto.startswith("ref/heads/"):
+            branch = resto[len("ref/heads/"):]
+            if branch not in repo.refs: return self._invia(404, {"message": "Not Found"})
+            return self._invia(200, {"ref": f"refs/heads/{branch}", "object": {"sha": repo.refs[branch], "type": "commit"}})
+        if metodo == "GET" and resto.startswith("commits/"):
+            commit = repo.commits.get(resto[len("commits/"):])
+            if commit is None: return self._invia(404, {"message": "Not Found"})
+            return self._invia(200, {"sha": resto[len("commits/"):], "tree": {"sha": commit["tree"]}, "parents": [{"sha": p} for p in commit["parents"]], "message": commit["message"]})
+        if metodo == "GET" and resto.startswith("trees/"):
+            voci = repo.trees.get(resto[len("trees/"):])
+            if voci is None: return self._invia(404, {"message": "Not Found"})
+            elencate = sorted(voci.items())[:self.max_voci_albero] # Come GitHub oltre il suo limite: elenco parziale e truncated
+            return self._invia(200, {"sha": resto[len("trees/"):], "truncated": len(elencate) < len(voci), "tree": [
+                {"path": p, "mode": "100644", "type": "blob", "sha": s, "size": len(repo.blobs[s])} for p, s in elencate]})
+        if metodo == "POST" and resto == "blobs":
+            contenuto = corpo.get("content", "")
+            dati = base64.b64decode(contenuto) if corpo.get("encoding") == "base64" else contenuto.encode("utf-8")
+            return self._invia(201, {"sha": repo._crea_blob(dati)})
+        if metodo == "POST" and resto == "trees":
+            voci = dict(repo.trees.get(corpo.get("base_tree"), {})) if corpo.get("base_tree") else {}
+            for voce in corpo.get("tree", []):
+                if "content" in voce: voci[voce["path"]] = repo._crea_blob(voce["content"].encode("utf-8"))
+                elif voce.get("sha") is None: voci.pop(voce["path"], None)
+                elif voce["sha"] in repo.blobs: voci[voce["path"]] = voce["sha"]
+                else: return self._invia(422, {"message": f"Invalid tree entry {voce['path']}"})
+            tree_sha = repo._crea_tree(voci)
+            return self._invia(201, {"sha": tree_sha, "tree": [{"path": p, "mode": "100644", "type": "blob", "sha": s} for p, s in sorted(voci.items())]})
+        if metodo == "POST" and resto == "commits":
+            if corpo.get("tree") not in repo.trees or any(p not in repo.commits for p in corpo.get("parents", [])): return self._invia(422, {"message": "Invalid tree or parents"})
+            sha = repo._crea_commit(corpo["tree"], corpo.get("parents", []), corpo.get("message", ""))
+            return self._invia(201, {"sha": sha, "tree": {"sha": corpo["tree"]}})
+        if metodo == "PATCH" and resto.startswith("refs/heads/"):
+            branch = resto[len("refs/heads/"):]
+            if branch not in repo.refs: return self._invia(422, {"message": "Reference does not exist"})
+            nuovo = corpo.get("sha"); commit = repo.commits.get(nuovo)
+            if commit is None: return self._invia(422, {"message": "Object does not exist"})
+            if not corpo.get("force") and repo.refs[branch] not in commit["parents"]: return self._invia(422, {"message": "Update is not a fast forward"})
+            repo.refs[branch] = nuovo
+            return self._invia(200, {"ref": f"refs/heads/{branch}", "object": {"sha": nuovo, "type": "commit"}})
+        return self._invia(404, {"message": "Not Found"})
+
+    def do_GET(self): self._instrada("GET")
+    def do_PUT(self): self._instrada("PUT")
+    def do_POST(self): self._instrada("POST")
+    def do_PATCH(self): self._instrada("PATCH")
+
+
+def crea_server(host="127.0.0.1", port=0, repo=None, latenza=0.0, seme=0, max_voci_albero=None):
+    """
+    Crea (senza avviarlo) un server GitHub finto; `server.repo` espone il repository in memoria, `server.richieste`
+    il conteggio delle richieste per metodo. `latenza` (secondi) si aggiunge a ogni richiesta; con `max_voci_albero`
+    gli alberi più grandi vengono restituiti troncati.
+    """
+    handler = type("Handler", (GitHubFintoHandler,), {"repo": repo or RepoFinto(), "latenza": latenza, "guasti": [], "richieste": Counter(), "casuale": random.Random(seme),
+                                                      "max_voci_albero": max_voci_albero})
+    server = ThreadingHTTPServer((host, port), handler); server.daemon_threads = True; server.repo = handler.repo
+    server.richieste = handler.richieste; server.handler = handler
+    return server
+
+
+def inietta_guasto(server, status, metodi=("PUT", "POST", "PATCH"), volte=1, probabilita=1.0):
+    """
+    Fa rispondere `status` alle prossime `volte` richieste con metodo in `metodi` (volte=None: senza limite),
+    ciascuna con probabilità `probabilita`. 403 simula il rate limit secondario (Retry-After: 1), gli altri status
+    (es. 409) sono restituiti così come sono.
+    """
+    with server.repo.lock: server.handler.guasti.append({"status": status, "metodi": set(metodi), "rimanenti": volte, "probabilita": probabilita})
+
+
+def avvia_in_background(**kwargs):
+    server = crea_server(**kwargs)
+    threading.Thread(target=server.serve_forever, name="fake-github", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GitHub finto locale per streamlit_app.py")
+    parser.add_argument("--host", default="127.0.0.1"); parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--branch", default="main")
+    parser.add_argument("--seed", nargs="*", default=[], help="File locali da caricare nel repository (stesso nome)")
+    parser.add_argument("--latenza-ms", type=float, default=0, help="Latenza aggiunta a ogni richiesta")
+    parser.add_argument("--prob-403", type=float, default=0, help="Probabilità di un 403 (rate limit secondario) su ogni richiesta")
+    parser.add_argument("--prob-409", type=float, default=0, help="Probabilità di un 409 su ogni PUT")
+    args = parser.parse_args()
+    server = crea_server(args.host, args.port, RepoFinto(args.branch), latenza=args.latenza_ms / 1000)
+    if args.prob_403: inietta_guasto(server, 403, ("GET", "PUT", "POST", "PATCH"), volte=None, probabilita=args.prob_403)
+    if args.prob_409: inietta_guasto(server, 409, ("PUT",), volte=None, probabilita=args.prob_409)
+    for file_seed in args.seed:
+        with open(file_seed, "rb") as f: server.repo.scrivi_file(os.path.basename(file_seed), f.read(), messaggio=f"Seed {file_seed}")
+    print(f"GitHub finto in ascolto su http://{args.host}:{server.server_port} (branch '{args.branch}')")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
@@ -0,0 +1,145 @@
+"""
+Motore di pianificazione turni: dalla matrice assenze (giorni × medici) e dai giorni festivi/weekend produce
+un'assegnazione che rispetta la copertura giornaliera e il massimo di turni consecutivi, distribuendo in modo equo
+i turni totali e quelli di weekend/festivi.
+
+Il modulo non dipende da Streamlit: l'app lo esegue come script in un processo separato (`python pianificatore_turni.py`,
+vedi `main`), quindi argomenti e risultato sono solo array numpy e tipi built-in serializzabili con pickle.
+
+Algoritmo: costruzione greedy giorno per giorno (i disponibili più lontani dal proprio obiettivo, preferendo
+l'assegnazione precedente se c'è un warm start), poi ricerca locale a scambi (un medico di turno cede il giorno a uno
+libero) finché l'obiettivo migliora o scade il tempo. Obiettivo: scarti quadratici di turni e festivi dagli obiettivi
+proporzionali alla disponibilità di ciascun medico, più una penalità per ogni cella cambiata rispetto al warm start.
+"""
+import pickle
+import sys
+import time
+
+import numpy as np
+
+
+class RegolePianificazione:
+    """Regole di copertura e pesi dell'obiettivo: solo attributi semplici, così l'oggetto passa al processo di calcolo."""
+    def __init__(self, minimo_feriale=2, minimo_festivo=1, max_consecutivi=5, peso_festivi=2.0, peso_stabilita=0.5, secondi_max=5.0):
+        self.minimo_feriale = int(minimo_feriale) # Medici di turno nei giorni feriali
+        self.minimo_festivo = int(minimo_festivo) # Medici di turno nei weekend e nei festivi
+        self.max_consecutivi = int(max_consecutivi) # Giorni di turno consecutivi al massimo per medico
+        self.peso_festivi = float(peso_festivi) # Peso dell'equità dei turni di weekend/festivi rispetto a quella dei turni totali
+        self.peso_stabilita = float(peso_stabilita) # Costo di ogni cella cambiata rispetto al warm start
+        self.secondi_max = float(secondi_max) # Tempo massimo della ricerca locale
+    def richiesti(self, festivi): return np.where(festivi, self.minimo_festivo, self.minimo_feriale)
+
+
+def corse_consecutive(turni):
+    """(sinistra, destra): per ogni cella, giorni di turno consecutivi che finiscono / iniziano in quel giorno (inclusi)."""
+    sinistra = np.zeros(turni.shape, dtype=np.int32); destra = np.zeros(turni.shape, dtype=np.int32)
+    for d in range(len(turni)): sinistra[d] = (sinistra[d - 1] + 1) * turni[d] if d else turni[d]
+    for d in range(len(turni) - 1, -1, -1): destra[d] = (destra[d + 1] + 1) * turni[d] if d < len(turni) - 1 else turni[d]
+    return sinistra, destra
+
+
+def obiettivi(assenti, festivi, richiesti):
+    """Turni e turni festivi attesi per medico: il fabbisogno del periodo ripartito in proporzione ai giorni disponibili."""
+    disponibili = ~assenti
+    giorni = disponibili.sum(axis=0); giorni_festivi = disponibili[festivi].sum(axis=0)
+    obiettivo = richiesti.sum() * giorni / max(giorni.sum(), 1)
+    obiettivo_festivi = richiesti[festivi].sum() * giorni_festivi / max(giorni_festivi.sum(), 1)
+    return obiettivo, obiettivo_festivi
+
+
+def valore_obiettivo(turni, festivi, obiettivo, obiettivo_festivi, regole, iniziale):
+    scarti = turni.sum(axis=0) - obiettivo; scarti_festivi = turni[festivi].sum(axis=0) - obiettivo_festivi
+    valore = float((scarti ** 2).sum() + regole.peso_festivi * (scarti_festivi ** 2).sum())
+    return valore + (regole.peso_stabilita * float((turni != iniziale).sum()) if iniziale is not None else 0.0)
+
+
+def costruisci(assenti, festivi, richiesti, obiettivo, obiettivo_festivi, regole, iniziale, casuale):
+    """Assegnazione greedy giorno per giorno; restituisce (turni, scoperture per giorno)."""
+    n_giorni, n_medici = assenti.shape
+    turni = np.zeros((n_giorni, n_medici), dtype=bool); scoperture = np.zeros(n_giorni, dtype=np.int32)
+    conteggio = np.zeros(n_medici); conteggio_festivi = np.zeros(n_medici); corsa = np.zeros(n_medici, dtype=np.int32)
+    rumore = casuale.random((n_giorni, n_medici)) * 1e-3 # Spareggio deterministico (dato il seme) tra medici equivalenti
+    for d in range(n_giorni):
+        candidati = np.flatnonzero(~assenti[d] & (corsa < regole.max_consecutivi))
+        k = min(int(richiesti[d]), len(candidati)); scoperture[d] = int(richiesti[d]) - k
+        if k:
+            costo = (conteggio - obiettivo * (d + 1) / n_giorni)[candidati] + rumore[d, candidati]
+            if festivi[d]: costo = costo + regole.peso_festivi * (conteggio_festivi - obiettivo_festivi)[candidati]
+            if iniziale is not None: costo = costo - 1e3 * iniziale[d, candidati] # Il warm start prevale finché è ammissibile
+            scelti = candidati[np.argpartition(costo, k - 1)[:k]] if k < len(candidati) else candidati
+            turni[d, scelti] = True; conteggio[scelti] += 1
+            if festivi[d]: conteggio_festivi[scelti] += 1
+        corsa = np.where(turni[d], corsa + 1, 0)
+    return turni, scoperture
+
+
+def migliora(turni, assenti, festivi, obiettivo, obiettivo_festivi, regole, iniziale, casuale, scadenza):
+    """Ricerca locale a scambi (primo miglioramento per giorno, giorni in ordine casuale); restituisce (passate, mosse)."""
+    n_giorni, n_medici = turni.shape
+    conteggio = turni.sum(axis=0).astype(float); conteggio_festivi = turni[festivi].sum(axis=0).astype(float)
+    sinistra, destra = corse_consecutive(turni); passate = mosse = 0
+    while time.perf_counter() < scadenza:
+        passate += 1; migliorato = False
+        for d in casuale.permutation(n_giorni):
+            di_turno = np.flatnonzero(turni[d])
+            corsa_prima = sinistra[d - 1] if d else np.zeros(n_medici, dtype=np.int32)
+            corsa_dopo = destra[d + 1] if d < n_giorni - 1 else np.zeros(n_medici, dtype=np.int32)
+            liberi = np.flatnonzero(~turni[d] & ~assenti[d] & (corsa_prima + 1 + corsa_dopo <= regole.max_consecutivi))
+            if not len(di_turno) or not len(liberi): continue
+            # Variazione dell'obiettivo se `a` (di turno) cede il giorno `d` a `b` (libero): termini separabili per a e per b
+            delta_a = -2 * (conteggio[di_turno] - obiettivo[di_turno]) + 1
+            delta_b = 2 * (conteggio[liberi] - obiettivo[liberi]) + 1
+            if festivi[d]:
+                delta_a = delta_a + regole.peso_festivi * (-2 * (conteggio_festivi[di_turno] - obiettivo_festivi[di_turno]) + 1)
+                delta_b = delta_b + regole.peso_festivi * (2 * (conteggio_festivi[liberi] - obiettivo_festivi[liberi]) + 1)
+            if iniziale is not None:
+                delta_a = delta_a + regole.peso_stabilita * np.where(iniziale[d, di_turno], 1, -1)
+                delta_b = delta_b + regole.peso_stabilita * np.where(iniziale[d, liberi], -1, 1)
+            delta = delta_a[:, None] + delta_b[None, :]
+            i, j = np.unravel_index(np.argmin(delta), delta.shape)
+            if delta[i, j] >= -1e-9: continue
+            a, b = di_turno[i], liberi[j]
+            turni[d, a] = False; turni[d, b] = True; conteggio[a] -= 1; conteggio[b] += 1
+            if festivi[d]: conteggio_festivi[a] -= 1; conteggio_festivi[b] += 1
+            for medico in (a, b): # Corse consecutive ricalcolate solo per le due colonne cambiate
+                sinistra_m, destra_m = corse_consecutive(turni[:, medico:medico + 1]); sinistra[:, medico] = sinistra_m[:, 0]; destra[:, medico] = destra_m[:, 0]
+            mosse += 1; migliorato = True
+        if not migliorato: break
+    return passate, mosse
+
+
+def pianifica(assenti, festivi, regole, iniziale=None, seme=0):
+    """
+    Assegnazione dei turni per il periodo. `assenti`: matrice booleana giorni × medici (True = assente),
+    `festivi`: vettore booleano dei giorni di weekend/festivi, `iniziale`: assegnazione precedente della stessa forma
+    (warm start, None per partire da zero). Restituisce un dict con `turni` (matrice booleana), `scoperture`
+    (medici mancanti per giorno) e `statistiche` (tempi di costruzione e ricerca, mosse, obiettivo, equità).
+    """
+    inizio = time.perf_counter()
+    assenti = np.asarray(assenti, dtype=bool); festivi = np.asarray(festivi, dtype=bool)
+    iniziale = np.asarray(iniziale, dtype=bool) if iniziale is not None else None
+    if iniziale is not None and iniziale.shape != assenti.shape: raise ValueError(f"Warm start {iniziale.shape} incompatibile con le assenze {assenti.shape}.")
+    casuale = np.random.default_rng(seme); richiesti = regole.richiesti(festivi)
+    obiettivo, obiettivo_festivi = obiettivi(assenti, festivi, richiesti)
+    turni, scoperture = costruisci(assenti, festivi, richiesti, obiettivo, obiettivo_festivi, regole, iniziale, casuale)
+    fine_costruzione = time.perf_counter(); valore_iniziale = valore_obiettivo(turni, festivi, obiettivo, obiettivo_festivi, regole, iniziale)
+    passate, mosse = migliora(turni, assenti, festivi, obiettivo, obiettivo_festivi, regole, iniziale, casuale, fine_costruzione + regole.secondi_max)
+    fine = time.perf_counter(); conteggio = turni.sum(axis=0); conteggio_festivi = turni[festivi].sum(axis=0)
+    statistiche = {
+        "secondi_costruzione": fine_costruzione - inizio, "secondi_ricerca": fine - fine_costruzione, "secondi_totali": fine - inizio,
+        "passate": passate, "mosse": mosse, "interrotta": fine >= fine_costruzione + regole.secondi_max, "warm_start": iniziale is not None,
+        "obiettivo_iniziale": valore_iniziale, "obiettivo_finale": valore_obiettivo(turni, festivi, obiettivo, obiettivo_festivi, regole, iniziale),
+        "celle_cambiate": int((turni != iniziale).sum()) if iniziale is not None else None, "scoperture": int(scoperture.sum()),
+        "scarto_max_turni": float(np.abs(conteggio - obiettivo).max()) if turni.shape[1] else 0.0,
+        "scarto_max_festivi": float(np.abs(conteggio_festivi - obiettivo_festivi).max()) if turni.shape[1] else 0.0,
+        "max_consecutivi": int(corse_consecutive(turni)[0].max()) if turni.size else 0}
+    return {"turni": turni, "scoperture": scoperture, "obiettivo": obiettivo, "obiettivo_festivi": obiettivo_festivi, "statistiche": statistiche}
+
+
+def main():
+    """Processo di calcolo dell'app: argomenti di `pianifica` da stdin e risultato su stdout, serializzati con pickle."""
+    argomenti = pickle.load(sys.stdin.buffer); pickle.dump(pianifica(*argomenti), sys.stdout.buffer)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,13 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import pandas as pd
+import numpy as np
 import calendar
-from datetime import datetime, date # IMPORT ESPLICITO
+from datetime import datetime, date, timedelta # IMPORT ESPLICITO
 # holidays non è più strettamente necessario se non visualizziamo festivi, ma lo tengo per ora per la generazione base
 import holidays 
-# from io import BytesIO # Non più necessario per Excel
+import io
+import csv
 import requests
 import json
 import base64
@@ -13,13 +16,25 @@ import logging
 import tempfile
 import os
 from functools import wraps
-# from openpyxl.styles import PatternFill, Font, Alignment # Non più necessario per Excel
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+import pickle
+import hmac
+import openpyxl # Solo lettura (importazione assenze da Excel)
 import unicodedata 
 import re
 import hashlib
+import itertools
+import sqlite3
+import zlib
 import regex
+import threading
+import sys
+from collections import deque, OrderedDict
+import pianificatore_turni # Motore di pianificazione turni (eseguito in un processo separato)
 
-# --- CONFIGURAZIONE LOGGING --- (come prima)
+# --- CONFIGURAZIONE LOGGING --- (una volta per processo: i rerun non chiudono e riaprono gli handler)
+@st.cache_resource(show_spinner=False)
 def setup_logging():
     root_logger = logging.getLogger()
     for handler in root_logger.handlers[:]: root_logger.removeHandler(handler); handler.close()
@@ -30,10 +45,10 @@ def setup_logging():
         log_handlers.append(logging.FileHandler(log_file_path, mode='a', encoding='utf-8'))
     except Exception as e: print(f"Attenzione: Errore logging su file ({log_file_path}): {e}. Logging su file disabilitato.")
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', handlers=log_handlers)
-    return logging.getLogger(__name__)
+    logger = logging.getLogger(__name__); logger.info("--- Applicazione Gestione Turni Medici (Solo Input Assenze) AVVIATA ---")
+    return logger
 
 logger = setup_logging()
-logger.info("--- Applicazione Gestione Turni Medici (Solo Input Assenze) AVVIATA ---")
 
 # --- CONFIGURAZIONE INIZIALE STREAMLIT ---
 st.set_page_config(page_title="Input Assenze Medici", layout="wide", initial_sidebar_state="expanded")
@@ -43,11 +58,17 @@ COL_DATA = "Data"
 COL_GIORNO = "Giorno"
 COL_FESTIVO = "Festivo"       # <-- DECOMMENTA QUESTA
 COL_NOME_FESTIVO = "Nome Festivo" # <-- DECOMMENTA QUESTA
+COLONNE_CALENDARIO = [COL_DATA, COL_GIORNO, COL_FESTIVO, COL_NOME_FESTIVO] # Colonne non-medico del calendario
 TIPI_ASSENZA = ["Presente", "Ferie", "Malattia", "Congresso", "Lezione", "Altro"]
-MEDICI_BACKUP_FILE = "medici_backup.json"
+TIPO_ASSENZA_DTYPE = pd.CategoricalDtype(TIPI_ASSENZA) # Colonne medico: codici int8 (0 = "Presente") invece di stringhe
 ASSENZE_FILE_PREFIX = "assenze_medici"
+FORMATO_ASSENZE_VERSIONE = 2 # v1 (senza campo "versione"): un record per giorno; v2: intervalli start/end/tipo
+NOME_MEDICO_REGEX = regex.compile(r"^[\p{L}\p{M}\s.'-]+$")
+ASSENZE_FILE_REGEX = re.compile(rf"^{ASSENZE_FILE_PREFIX}_(\d{{4}})_(\d{{2}})\.json$")
+AUTOSAVE_JOURNAL_FILE = "medical_shifts_journal.jsonl" # Journal modifiche non ancora salvate, accanto a medical_shifts.log
 
 ROW_HEIGHT_PX = 35
+RIGHE_EDITOR_VISIBILI = 31 # Oltre un mese l'editor scorre al suo interno invece di allungare la pagina
 TABLE_PADDING_PX = 3
 MIN_COLUMN_WIDTH_EXCEL = 12 # Non più usato se non c'è export Excel
 MAX_COLUMN_WIDTH_EXCEL = 45 # Non più usato se non c'è export Excel
@@ -68,6 +89,25 @@ class AppConfig:
             'MAX_RETRY_ATTEMPTS': int(st.secrets.get("MAX_RETRY_ATTEMPTS", "2")),
             'RETRY_DELAY_SECONDS': int(st.secrets.get("RETRY_DELAY_SECONDS", "3")),
             'REQUEST_TIMEOUT': int(st.secrets.get("REQUEST_TIMEOUT", "15")),
+            'GITHUB_API_URL': st.secrets.get("GITHUB_API_URL", "https://api.github.com").rstrip("/"),
+            'GITHUB_POOL_SIZE': int(st.secrets.get("GITHUB_POOL_SIZE", "10")), # Connessioni keep-alive nel pool del client GitHub
+            'GITHUB_WORKERS': int(st.secrets.get("GITHUB_WORKERS", "4")), # Thread per operazioni GitHub in background
+            'GITHUB_RATE_LIMIT_ORA': int(st.secrets.get("GITHUB_RATE_LIMIT_ORA", "5000")), # Budget richieste/ora condiviso dal processo
+            'GITHUB_RATE_BURST': int(st.secrets.get("GITHUB_RATE_BURST", "100")),
+            'CACHE_MAX_MB': float(st.secrets.get("CACHE_MAX_MB", "50")), # Dimensione massima (compressa) dell'archivio snapshot locale
+            'SNAPSHOT_DIR': st.secrets.get("SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "medical_shifts_app_cache")), # Cartella dell'archivio snapshot (SQLite)
+            'SNAPSHOT_RITENZIONE_GIORNI': float(st.secrets.get("SNAPSHOT_RITENZIONE_GIORNI", "30")), # Versioni non correnti conservate per questo periodo
+            'SNAPSHOT_MEMORIA_VOCI': int(st.secrets.get("SNAPSHOT_MEMORIA_VOCI", "128")), # Contenuti decodificati tenuti in RAM (LRU) davanti all'archivio SQLite
+            'ASSENZE_REVALIDA_SECONDI': int(st.secrets.get("ASSENZE_REVALIDA_SECONDI", "60")), # Oltre questo intervallo un cambio mese rivalida il file su GitHub
+            'AUTOSAVE_DEBOUNCE_SECONDI': float(st.secrets.get("AUTOSAVE_DEBOUNCE_SECONDI", "5")), # Pausa senza modifiche prima del salvataggio automatico
+            'MEDICI_PER_PAGINA': int(st.secrets.get("MEDICI_PER_PAGINA", "12")), # Oltre questo numero l'editor mostra i medici a blocchi
+            'MINIMO_MEDICI_PRESENTI': int(st.secrets.get("MINIMO_MEDICI_PRESENTI", "2")), # Organico minimo proposto nella consultazione multi-mese
+            'PIANIFICAZIONE_SECONDI_MAX': float(st.secrets.get("PIANIFICAZIONE_SECONDI_MAX", "5")), # Tempo massimo della ricerca locale del pianificatore turni
+            'PIANIFICAZIONE_TIMEOUT_SECONDI': float(st.secrets.get("PIANIFICAZIONE_TIMEOUT_SECONDI", "60")), # Oltre, il calcolo viene interrotto e il suo processo terminato
+            'PERFORMANCE_THRESHOLD_WARN': float(st.secrets.get("PERFORMANCE_THRESHOLD_WARN", "3")), # Secondi oltre i quali una funzione monitorata è segnalata in sidebar
+            'METRICHE_FILE': st.secrets.get("METRICHE_FILE", os.path.join(tempfile.gettempdir(), "medical_shifts_metrics.prom")), # File testuale Prometheus (textfile collector)
+            'METRICHE_INTERVALLO_SECONDI': float(st.secrets.get("METRICHE_INTERVALLO_SECONDI", "15")), # Intervallo minimo tra due scritture del file metriche
+            'DIAGNOSTICA_TOKEN': st.secrets.get("DIAGNOSTICA_TOKEN"), # La pagina ?pagina=diagnostica richiede &token=<valore>; senza, è disattivata
             'ASSENZE_BRANCH': st.secrets.get("ASSENZE_BRANCH", "main") # Branch per salvare le assenze
         }
     def _validate_config(self):
@@ -76,13 +116,18 @@ class AppConfig:
         if missing: raise ValueError(f"Configurazione mancante: {', '.join(missing)}")
     def get(self, key, default=None): return self.config.get(key, default)
     @property
-    def medici_api_url(self): return f"https://api.github.com/repos/{self.get('GITHUB_USER')}/{self.get('REPO_NAME')}/contents/{self.get('FILE_PATH_MEDICI')}"
-    def assenze_api_url(self, file_path_assenze): return f"https://api.github.com/repos/{self.get('GITHUB_USER')}/{self.get('REPO_NAME')}/contents/{file_path_assenze}"
+    def repo_api_url(self): return f"{self.get('GITHUB_API_URL')}/repos/{self.get('GITHUB_USER')}/{self.get('REPO_NAME')}"
+    @property
+    def medici_api_url(self): return f"{self.repo_api_url}/contents/{self.get('FILE_PATH_MEDICI')}"
+    def assenze_api_url(self, file_path_assenze): return f"{self.repo_api_url}/contents/{file_path_assenze}"
     @property
     def headers(self): return {"Authorization": f"token {self.get('GITHUB_TOKEN')}", "Accept": "application/vnd.github.v3+json"}
 
+@st.cache_resource(show_spinner=False)
+def get_app_config(): return AppConfig() # Le secrets si leggono una volta per processo (un errore non viene memorizzato)
+
 try:
-    app_config = AppConfig()
+    app_config = get_app_config()
 except ValueError as e_config:
     st.error(f"❌ Errore Critico di Configurazione: {e_config}"); st.error("Verifica le secrets."); st.stop()
 
@@ -93,12 +138,18 @@ class SessionManager:
         defaults = {
             'elenco_medici_completo': [], 'medici_pianificati': [], 'df_turni': None, 
             'sha_medici': None, 'sha_assenze': {}, # SHA per file assenze, indicizzato per file_path
+            'base_assenze': {}, 'conflitto_assenze': None, # Versione base per file_path (merge a tre vie) e conflitto da risolvere
+            'assenze_verificate': {}, # Ultima verifica su GitHub (timestamp) per file_path
+            'medici_da_archivio': False, # Elenco medici mostrato dall'archivio snapshot locale in attesa di quello di GitHub
             'selected_mese_val': datetime.now().month, 'selected_anno_val': datetime.now().year,
-            'github_connection_checked': False, 'config_checked': False, 'last_calendar_key': None
+            'github_connection_checked': False, 'config_checked': False, 'last_calendar_key': None,
+            'operazioni_github': {}, # Operazioni GitHub in background per chiave ('salva_medici', 'salva_assenze')
+            'piani_turni': {}, # Ultimo piano turni per periodo: mostrato e usato come warm start della pianificazione successiva
+            'pianificazione': None # Calcolo turni in corso nel processo di pianificazione: {'future', 'avviata', 'contesto'}
         }
-        for key, val in defaults.items():
-            if key not in st.session_state: st.session_state[key] = val
-        logger.info("Variabili di sessione inizializzate/verificate.")
+        mancanti = [key for key in defaults if key not in st.session_state]
+        for key in mancanti: st.session_state[key] = defaults[key]
+        if mancanti: logger.info("Variabili di sessione inizializzate/verificate.")
     @staticmethod
     def get_safe(key, default=None): return st.session_state.get(key, default)
     @staticmethod
@@ -113,67 +164,362 @@ class SessionManager:
 
 SessionManager.init_session_vars()
 
-# --- DECORATORS (monitor_performance, retry_github_api) --- (come prima, li ometto per brevità)
+# --- METRICHE DI PROCESSO (latenze per funzione, chiamate GitHub, cache, memoria sessioni) ---
+class RegistroMetriche:
+    """
+    Metriche condivise da tutte le sessioni del processo: ultimi campioni di latenza per funzione (p50/p95/p99),
+    contatori con etichette (richieste e byte GitHub, hit/miss delle cache), chiamate e tempo GitHub per rerun
+    e memoria stimata di ogni `st.session_state`. `testo_prometheus` le esporta nel formato testuale di Prometheus.
+    """
+    SESSIONE_SCADUTA_SECONDI = 3600 # Sessioni senza rerun da più di un'ora escono dalla tabella memoria
+    def __init__(self, max_campioni=1000):
+        self._lock = threading.Lock(); self.max_campioni = max_campioni; self.avvio = time.time()
+        self._campioni = {} # nome -> deque degli ultimi valori
+        self._totali = {} # nome -> [conteggio, somma] da avvio processo
+        self._contatori = {} # (nome, etichette ordinate) -> valore
+        self._sessioni = {} # session_id -> {"chiamate_github", "secondi_github", "memoria", "aggiornata"}
+
+    def osserva(self, nome, valore):
+        with self._lock:
+            self._campioni.setdefault(nome, deque(maxlen=self.max_campioni)).append(valore)
+            totale = self._totali.setdefault(nome, [0, 0.0]); totale[0] += 1; totale[1] += valore
+    def incrementa(self, nome, valore=1, **etichette):
+        chiave = (nome, tuple(sorted(etichette.items())))
+        with self._lock: self._contatori[chiave] = self._contatori.get(chiave, 0) + valore
+    def registra_richiesta_github(self, metodo, status, byte_inviati, byte_ricevuti, durata, sessione):
+        self.osserva(f"GitHub {metodo}", durata)
+        self.incrementa("github_richieste_totali", metodo=metodo, status=str(status), origine="sessione" if sessione else "background")
+        self.incrementa("github_byte_inviati_totali", byte_inviati); self.incrementa("github_byte_ricevuti_totali", byte_ricevuti)
+        if sessione:
+            with self._lock:
+                voce = self._sessioni.setdefault(sessione, {"chiamate_github": 0, "secondi_github": 0.0, "memoria": 0, "aggiornata": time.time()})
+                voce["chiamate_github"] += 1; voce["secondi_github"] += durata
+    def registra_cache(self, nome, hit): self.incrementa("cache_richieste_totali", cache=nome, esito="hit" if hit else "miss")
+    def chiudi_rerun(self, sessione, durata, memoria):
+        """Fine di un rerun: registra durata, chiamate/tempo GitHub del rerun e memoria della sessione, poi azzera i contatori del rerun."""
+        with self._lock:
+            voce = self._sessioni.setdefault(sessione, {"chiamate_github": 0, "secondi_github": 0.0, "memoria": 0, "aggiornata": 0})
+            chiamate, secondi = voce["chiamate_github"], voce["secondi_github"]
+            voce.update(chiamate_github=0, secondi_github=0.0, memoria=memoria, aggiornata=time.time())
+            limite = time.time() - self.SESSIONE_SCADUTA_SECONDI
+            for sid in [sid for sid, v in self._sessioni.items() if v["aggiornata"] < limite]: del self._sessioni[sid]
+        self.osserva("Rerun completo", durata); self.osserva("Chiamate GitHub per rerun", chiamate); self.osserva("Tempo GitHub per rerun", secondi)
+
+    def riepilogo_campioni(self):
+        """DataFrame con chiamate totali, media e percentili degli ultimi campioni per ogni serie osservata."""
+        with self._lock: dati = {nome: (np.array(c, dtype=float), *self._totali[nome]) for nome, c in self._campioni.items()}
+        righe = [{"Serie": nome, "Chiamate": n, "Totale": somma, "Media": somma / n, **dict(zip(("p50", "p95", "p99"), np.percentile(valori, [50, 95, 99]))), "Max": valori.max()}
+                 for nome, (valori, n, somma) in dati.items()]
+        return pd.DataFrame(righe, columns=["Serie", "Chiamate", "Totale", "Media", "p50", "p95", "p99", "Max"])
+    def contatori(self):
+        with self._lock: return dict(self._contatori)
+    def tasso_hit_cache(self):
+        """{nome cache: (hit, miss)} dai contatori delle cache Streamlit misurate con `misura_cache`."""
+        esiti = {}
+        for (nome, etichette), valore in self.contatori().items():
+            if nome != "cache_richieste_totali": continue
+            etichette = dict(etichette); hit, miss = esiti.get(etichette["cache"], (0, 0))
+            esiti[etichette["cache"]] = (hit + valore, miss) if etichette["esito"] == "hit" else (hit, miss + valore)
+        return esiti
+    def sessioni(self):
+        with self._lock: return {sid: dict(v) for sid, v in self._sessioni.items()}
+
+    def testo_prometheus(self, metriche_extra=None):
+        """Metriche nel formato testuale Prometheus (summary per le serie, counter per i contatori, gauge per memoria ed extra)."""
+        def nome_metrica(testo): return re.sub(r"[^a-zA-Z0-9_]", "_", unicodedata.normalize('NFKD', testo).encode('ascii', 'ignore').decode()).strip("_").lower()
+        def etichette_testo(etichette): return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in etichette) + "}" if etichette else ""
+        righe = [f"# TYPE medical_shifts_serie summary"]
+        for _, r in self.riepilogo_campioni().iterrows():
+            serie = etichette_testo([("serie", r["Serie"])])[1:-1]
+            righe += [f'medical_shifts_serie{{{serie},quantile="{q}"}} {r[f"p{int(q * 100)}"]:.6f}' for q in (0.5, 0.95, 0.99)]
+            righe += [f"medical_shifts_serie_sum{{{serie}}} {r['Totale']:.6f}", f"medical_shifts_serie_count{{{serie}}} {r['Chiamate']}"]
+        per_nome = {}
+        for (nome, etichette), valore in self.contatori().items(): per_nome.setdefault(nome, []).append((etichette, valore))
+        for nome, valori in sorted(per_nome.items()):
+            righe.append(f"# TYPE medical_shifts_{nome} counter"); righe += [f"medical_shifts_{nome}{etichette_testo(e)} {v}" for e, v in valori]
+        sessioni = self.sessioni()
+        memorie = [v["memoria"] for v in sessioni.values()] # Aggregati: un'etichetta per sessione farebbe crescere senza limite le serie
+        righe += ["# TYPE medical_shifts_sessioni_attive gauge", f"medical_shifts_sessioni_attive {len(sessioni)}",
+                  "# TYPE medical_shifts_memoria_sessioni_byte gauge", f"medical_shifts_memoria_sessioni_byte {sum(memorie)}",
+                  "# TYPE medical_shifts_memoria_sessione_max_byte gauge", f"medical_shifts_memoria_sessione_max_byte {max(memorie, default=0)}"]
+        for nome, valore in (metriche_extra or {}).items(): righe += [f"# TYPE medical_shifts_{nome_metrica(nome)} gauge", f"medical_shifts_{nome_metrica(nome)} {valore}"]
+        righe += ["# TYPE medical_shifts_uptime_secondi gauge", f"medical_shifts_uptime_secondi {time.time() - self.avvio:.0f}"]
+        return "\n".join(righe) + "\n"
+    def scrivi_prometheus(self, path, metriche_extra=None):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f: f.write(self.testo_prometheus(metriche_extra))
+            os.replace(tmp_path, path) # Chi legge il file (node_exporter textfile) non vede mai un file a metà
+        except OSError as e: logger.warning(f"Impossibile scrivere le metriche in '{path}': {e}")
+
+@st.cache_resource(show_spinner=False)
+def get_registro_metriche(): return RegistroMetriche()
+
+metriche = get_registro_metriche()
+inizio_rerun = time.perf_counter(); rerun_registrato = [False] # Per rerun: `chiudi_rerun_metriche` registra una volta sola
+
+def stima_memoria(valore):
+    """Byte occupati (stima) da un valore di session_state: memoria profonda per pandas/numpy, ricorsiva per i contenitori."""
+    if isinstance(valore, pd.DataFrame): return int(valore.memory_usage(deep=True).sum())
+    if isinstance(valore, (pd.Series, pd.Index)): return int(valore.memory_usage(deep=True))
+    if isinstance(valore, np.ndarray): return valore.nbytes
+    if isinstance(valore, dict): return sys.getsizeof(valore) + sum(stima_memoria(k) + stima_memoria(v) for k, v in valore.items())
+    if isinstance(valore, (list, tuple, set, frozenset)): return sys.getsizeof(valore) + sum(stima_memoria(v) for v in valore)
+    return sys.getsizeof(valore)
+
+# --- DECORATORS (monitor_performance) --- (come prima, li ometto per brevità)
+_esecuzioni_monitorate = threading.local() # Flag per thread: una funzione monitorata è stata eseguita (vedi misura_cache)
+
 def monitor_performance(func_name_override=None):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             start_time = time.perf_counter(); result = func(*args, **kwargs); execution_time = time.perf_counter() - start_time
             name = func_name_override or func.__name__; logger.info(f"⏱️ {name}: {execution_time:.4f}s")
-            if execution_time > app_config.get('PERFORMANCE_THRESHOLD_WARN', 3): st.sidebar.caption(f"⚡ {name} lento: {execution_time:.1f}s")
+            metriche.osserva(name, execution_time); _esecuzioni_monitorate.eseguita = True
+            if execution_time > app_config.get('PERFORMANCE_THRESHOLD_WARN') and get_script_run_ctx() is not None: st.sidebar.caption(f"⚡ {name} lento: {execution_time:.1f}s")
             return result
         return wrapper
     return decorator
 
-def retry_github_api(max_retries_override=None, delay_seconds_override=None):
-    actual_max_retries = max_retries_override if max_retries_override is not None else app_config.get('MAX_RETRY_ATTEMPTS')
-    actual_delay_seconds = delay_seconds_override if delay_seconds_override is not None else app_config.get('RETRY_DELAY_SECONDS')
+def misura_cache(nome):
+    """
+    Da applicare sopra `st.cache_data` (con `monitor_performance` sotto): conta hit e miss della cache.
+    È un miss se durante la chiamata è stata eseguita la funzione monitorata, cioè il corpo della funzione in cache.
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            last_exception = None
-            for attempt in range(actual_max_retries):
-                try: return func(*args, **kwargs)
-                except requests.exceptions.HTTPError as e:
-                    last_exception = e
-                    if e.response.status_code in [404, 401]: logger.error(f"Errore HTTP GitHub non recuperabile ({e.response.status_code}) per {func.__name__}."); raise 
-                    retry_after = int(e.response.headers.get("Retry-After", actual_delay_seconds * (2 ** attempt)))
-                    log_msg = f"Rate limit" if e.response.status_code == 403 else f"Errore server ({e.response.status_code})"
-                    if attempt < actual_max_retries - 1:
-                        logger.warning(f"{log_msg} GitHub per {func.__name__}. Tentativo {attempt + 1}/{actual_max_retries}. Riprovo tra {retry_after}s...")
-                        st.sidebar.caption(f"⏳ {log_msg}. Riprovo tra {retry_after}s...")
-                        time.sleep(retry_after)
-                    else: logger.error(f"Errore HTTP GitHub finale ({e.response.status_code}) per {func.__name__}: {e.response.text}"); raise
-                except requests.exceptions.RequestException as e:
-                    last_exception = e
-                    if attempt < actual_max_retries - 1:
-                        wait_time = actual_delay_seconds * (2 ** attempt)
-                        logger.warning(f"Errore connessione per {func.__name__}. Tentativo {attempt + 1}/{actual_max_retries}. Riprovo tra {wait_time}s... Errore: {e}")
-                        st.sidebar.caption(f"⏳ Errore connessione. Riprovo tra {wait_time}s...")
-                        time.sleep(wait_time)
-                    else: logger.error(f"Errore connessione finale per {func.__name__} dopo {actual_max_retries} tentativi: {e}"); raise
-            if last_exception: raise last_exception
-            return None
+            precedente = getattr(_esecuzioni_monitorate, "eseguita", False); _esecuzioni_monitorate.eseguita = False
+            try: return func(*args, **kwargs)
+            finally:
+                eseguita = _esecuzioni_monitorate.eseguita; _esecuzioni_monitorate.eseguita = precedente or eseguita
+                metriche.registra_cache(nome, hit=not eseguita)
+        wrapper.clear = func.clear
         return wrapper
     return decorator
 
+# --- CLIENT HTTP GITHUB (connessioni persistenti, budget richieste, retry in background) ---
+class GitHubBudgetEsaurito(requests.exceptions.RequestException):
+    """Il budget locale/GitHub di richieste è esaurito: riprovare tra `retry_after` secondi."""
+    def __init__(self, retry_after):
+        super().__init__(f"Budget richieste GitHub esaurito, disponibile tra {retry_after:.0f}s"); self.retry_after = retry_after
+
+class GitHubRateLimiter:
+    """
+    Token bucket condiviso da tutte le sessioni del processo (il token GitHub è unico), allineato agli header
+    X-RateLimit-Remaining/X-RateLimit-Reset di ogni risposta: le chiamate vengono frenate prima che GitHub le rifiuti.
+    """
+    def __init__(self, richieste_ora, burst):
+        self.ritmo = richieste_ora / 3600.0; self.capacita = float(burst); self.tokens = float(burst); self.ultimo = time.monotonic()
+        self.remaining_server = None; self.reset_server = None; self._lock = threading.Lock()
+    def _ricarica(self):
+        adesso = time.monotonic(); self.tokens = min(self.capacita, self.tokens + (adesso - self.ultimo) * self.ritmo); self.ultimo = adesso
+    def prenota(self):
+        """Consuma un token e restituisce 0, oppure restituisce i secondi di attesa necessari senza consumare nulla."""
+        with self._lock:
+            self._ricarica(); adesso = time.time()
+            if self.remaining_server is not None and self.remaining_server <= 0 and self.reset_server and self.reset_server > adesso: return self.reset_server - adesso
+            if self.tokens < 1: return (1 - self.tokens) / self.ritmo
+            self.tokens -= 1
+            if self.remaining_server is not None: self.remaining_server -= 1
+            return 0.0
+    def aggiorna_da_risposta(self, res):
+        with self._lock:
+            try:
+                if "X-RateLimit-Remaining" in res.headers: self.remaining_server = int(res.headers["X-RateLimit-Remaining"])
+                if "X-RateLimit-Reset" in res.headers: self.reset_server = int(res.headers["X-RateLimit-Reset"])
+                if res.status_code in (403, 429) and "Retry-After" in res.headers: self.remaining_server = 0; self.reset_server = time.time() + int(res.headers["Retry-After"])
+            except ValueError: logger.debug(f"Header rate limit non numerici: {dict(res.headers)}")
+    def stato(self):
+        with self._lock: self._ricarica(); return {"tokens": self.tokens, "remaining_server": self.remaining_server, "reset_server": self.reset_server}
+
+class GitHubClient:
+    """
+    Client HTTP unico di processo per le API GitHub: sessione `requests` con pool keep-alive, gzip,
+    header di autenticazione comuni, budget richieste condiviso e tempi per richiesta.
+    Ogni chiamata è un singolo tentativo che non attende mai: i retry con backoff sono affidati a `GitHubRetryScheduler`.
+    Restituisce sempre la risposta: la gestione degli status (raise_for_status, 404, 409) resta ai chiamanti.
+    """
+    RETRY_STATUS = {403, 429, 500, 502, 503, 504}
+    def __init__(self, config):
+        self.timeout = config.get('REQUEST_TIMEOUT'); self.delay_seconds = config.get('RETRY_DELAY_SECONDS')
+        self.limiter = GitHubRateLimiter(config.get('GITHUB_RATE_LIMIT_ORA'), config.get('GITHUB_RATE_BURST'))
+        self.session = requests.Session()
+        pool_size = config.get('GITHUB_POOL_SIZE')
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0, pool_block=False)
+        self.session.mount("https://", adapter); self.session.mount("http://", adapter)
+        self.session.headers.update({**config.headers, "Accept-Encoding": "gzip, deflate"})
+        logger.info(f"Client GitHub inizializzato (pool {pool_size} connessioni).")
+    def e_ritentabile(self, res):
+        if res is None or res.status_code not in self.RETRY_STATUS: return False
+        if res.status_code == 403: return res.headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in res.headers # 403 senza rate limit = permessi
+        return True
+    def secondi_prima_di_riprovare(self, res, attempt):
+        if res is not None and "Retry-After" in res.headers: return int(res.headers["Retry-After"])
+        if res is not None and res.headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Reset" in res.headers:
+            return max(1, int(res.headers["X-RateLimit-Reset"]) - int(time.time()))
+        return self.delay_seconds * (2 ** attempt)
+    def richiesta(self, metodo, url, **kwargs):
+        attesa = self.limiter.prenota()
+        if attesa > 0: logger.warning(f"Budget GitHub esaurito per {metodo} {url}: disponibile tra {attesa:.1f}s"); raise GitHubBudgetEsaurito(attesa)
+        kwargs.setdefault('timeout', self.timeout); start_time = time.perf_counter(); res = None
+        try: res = self.session.request(metodo, url, **kwargs)
+        finally: self._registra_tempo(metodo, url, time.perf_counter() - start_time, res)
+        self.limiter.aggiorna_da_risposta(res)
+        if res.status_code >= 400 and res.status_code != 404: logger.error(f"Risposta GitHub {res.status_code} per {metodo} {url}: {res.text[:200]}")
+        return res
+    def _registra_tempo(self, metodo, url, durata, res):
+        ctx = get_script_run_ctx()
+        byte_inviati = len(res.request.body or b"") if res is not None else 0; byte_ricevuti = len(res.content) if res is not None else 0
+        metriche.registra_richiesta_github(metodo, res.status_code if res is not None else "errore", byte_inviati, byte_ricevuti, durata, ctx.session_id if ctx else None)
+        logger.info(f"🌐 {metodo} {url.split('/repos/', 1)[-1]}: {durata:.4f}s")
+    def get(self, url, **kwargs): return self.richiesta("GET", url, **kwargs)
+    def put(self, url, **kwargs): return self.richiesta("PUT", url, **kwargs)
+    def post(self, url, **kwargs): return self.richiesta("POST", url, **kwargs)
+    def patch(self, url, **kwargs): return self.richiesta("PATCH", url, **kwargs)
+
+class OperazioneGitHub:
+    """Stato di un'operazione GitHub eseguita in background, letto dalla UI per mostrare l'avanzamento."""
+    def __init__(self, tipo, descrizione, contesto=None):
+        self.tipo = tipo; self.descrizione = descrizione; self.contesto = contesto or {}
+        self.stato = "in_coda"; self.tentativo = 0; self.messaggio = "In coda..."; self.riprova_alle = None
+        self.risultato = None; self.errore = None; self.future = None
+    @property
+    def conclusa(self): return self.stato in ("completata", "fallita")
+
+class GitHubRetryScheduler:
+    """
+    Esegue le operazioni GitHub su un pool di thread del processo, con retry e backoff (Retry-After, X-RateLimit-Reset)
+    e attese per il budget richieste: il thread dello script Streamlit non viene mai bloccato da `time.sleep`.
+    Le funzioni eseguite non devono usare `st.*` né `st.session_state`: il risultato viene applicato dalla UI.
+    """
+    def __init__(self, client, max_workers, max_tentativi):
+        self.client = client; self.max_tentativi = max(1, max_tentativi)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="github-retry")
+    def sottometti(self, tipo, descrizione, funzione, *args, contesto=None, **kwargs):
+        op = OperazioneGitHub(tipo, descrizione, contesto); op.future = self.executor.submit(self._esegui, op, funzione, args, kwargs)
+        logger.info(f"Operazione GitHub in background: {descrizione}"); return op
+    def _attendi(self, op, secondi, motivo):
+        op.stato = "in_attesa"; op.riprova_alle = time.time() + secondi; op.messaggio = f"{motivo}. Riprovo tra {secondi:.0f}s..."
+        logger.warning(f"{op.descrizione}: {op.messaggio}"); time.sleep(secondi)
+    def _esegui(self, op, funzione, args, kwargs):
+        while True:
+            op.stato = "in_corso"; op.tentativo += 1; op.riprova_alle = None; op.messaggio = f"Tentativo {op.tentativo}/{self.max_tentativi}..."
+            try:
+                op.risultato = funzione(*args, **kwargs); op.stato = "completata"; op.messaggio = "Completata."; return op.risultato
+            except GitHubBudgetEsaurito as e: op.tentativo -= 1; self._attendi(op, e.retry_after, "Budget richieste GitHub esaurito") # non consuma tentativi
+            except requests.exceptions.HTTPError as e:
+                if not self.client.e_ritentabile(e.response) or op.tentativo >= self.max_tentativi: return self._fallita(op, e)
+                log_msg = "Rate limit" if e.response.status_code in (403, 429) else f"Errore server ({e.response.status_code})"
+                self._attendi(op, self.client.secondi_prima_di_riprovare(e.response, op.tentativo - 1), log_msg)
+            except requests.exceptions.RequestException as e:
+                if op.tentativo >= self.max_tentativi: return self._fallita(op, e)
+                self._attendi(op, self.client.secondi_prima_di_riprovare(None, op.tentativo - 1), "Errore connessione")
+            except Exception as e: return self._fallita(op, e)
+    def _fallita(self, op, errore):
+        op.stato = "fallita"; op.errore = errore; op.messaggio = f"Fallita: {errore}"
+        logger.error(f"Operazione GitHub '{op.descrizione}' fallita dopo {op.tentativo} tentativi: {errore}"); return None
+
+@st.cache_resource
+def get_github_client(): return GitHubClient(app_config)
+@st.cache_resource
+def get_github_scheduler(): return GitHubRetryScheduler(get_github_client(), app_config.get('GITHUB_WORKERS'), app_config.get('MAX_RETRY_ATTEMPTS'))
+
+github_client = get_github_client()
+github_scheduler = get_github_scheduler()
+
+# --- REGISTRO MEDICI (indice dei nomi normalizzati, quasi-duplicati, modifiche in blocco) ---
+class RegistroMedici:
+    """
+    Elenco medici indicizzato: i nomi normalizzati danno il controllo dei duplicati in O(1), l'indice a trigrammi
+    restringe la ricerca dei quasi-duplicati ("Aisoni" / "Aisoni M.", "Rossi" / "Rosi") a pochi candidati.
+    Le modifiche in blocco (con_modifiche) si validano tutte insieme e producono un solo nuovo elenco da salvare.
+    """
+    MODIFICHE_MAX = ((10, 1), (None, 2)) # Caratteri modificati (Levenshtein) entro cui due nomi sono quasi-duplicati: 1 fino a 10 caratteri, poi 2
+    SOGLIA_CANDIDATI = 0.3 # Frazione minima di trigrammi in comune per confrontare due nomi
+
+    def __init__(self, medici):
+        self.medici = []; self._normalizzati = {}; self._trigrammi = {}
+        for medico in sorted(set(medici)): self._aggiungi(medico)
+
+    @staticmethod
+    def normalizza(nome): return " ".join(unicodedata.normalize('NFKC', nome).lower().split())
+    @staticmethod
+    def parole(nome): return regex.sub(r"[^\p{L}\s]", " ", unicodedata.normalize('NFKC', nome).lower()).split() # Senza punteggiatura e iniziali puntate
+    @staticmethod
+    def trigrammi(chiave): chiave = f"  {chiave} "; return {chiave[i:i + 3] for i in range(len(chiave) - 2)}
+
+    def _aggiungi(self, medico):
+        self.medici.append(medico); self._normalizzati[self.normalizza(medico)] = medico
+        for t in self.trigrammi(" ".join(self.parole(medico))): self._trigrammi.setdefault(t, set()).add(medico)
+    def _rimuovi(self, medico):
+        self.medici.remove(medico); del self._normalizzati[self.normalizza(medico)]
+        for t in self.trigrammi(" ".join(self.parole(medico))): self._trigrammi[t].discard(medico)
+
+    def copia(self):
+        registro = RegistroMedici(()); registro.medici = list(self.medici); registro._normalizzati = dict(self._normalizzati)
+        registro._trigrammi = {t: set(medici) for t, medici in self._trigrammi.items()}; return registro
+    def trova(self, nome): return self._normalizzati.get(self.normalizza(nome))
+    @classmethod
+    def entro_modifiche(cls, chiave, altra):
+        """True se `altra` dista da `chiave` al più MODIFICHE_MAX caratteri (inserimenti, cancellazioni, sostituzioni)."""
+        limite = next(n for lunghezza, n in cls.MODIFICHE_MAX if lunghezza is None or len(chiave) <= lunghezza)
+        return abs(len(chiave) - len(altra)) <= limite and regex.fullmatch(rf"(?:{regex.escape(chiave)}){{e<={limite}}}", altra) is not None
+    def simili(self, nome):
+        """Medici già presenti che differiscono da `nome` solo per iniziali/punteggiatura o per pochi caratteri."""
+        parole = self.parole(nome); chiave = " ".join(parole); trigrammi = self.trigrammi(chiave)
+        conteggi = {}
+        for t in trigrammi:
+            for medico in self._trigrammi.get(t, ()): conteggi[medico] = conteggi.get(medico, 0) + 1
+        significative = {p for p in parole if len(p) > 1}; risultato = []
+        for medico, comuni in conteggi.items():
+            if comuni < self.SOGLIA_CANDIDATI * len(trigrammi): continue
+            parole_medico = self.parole(medico); significative_medico = {p for p in parole_medico if len(p) > 1}
+            if (significative and significative_medico and (significative <= significative_medico or significative_medico <= significative)) \
+               or self.entro_modifiche(chiave, " ".join(parole_medico)): risultato.append(medico)
+        return sorted(risultato)
+
+    def valida(self, nome_input, consenti_simili=False):
+        if not isinstance(nome_input, str): return False, "Il nome deve essere una stringa."
+        nome = unicodedata.normalize('NFKC', nome_input.strip())
+        if not nome: return False, "Il nome non può essere vuoto."
+        if len(nome) < 2: return False, "Il nome deve contenere almeno 2 caratteri."
+        if len(nome) > 100: return False, "Il nome non può superare 100 caratteri."
+        if not NOME_MEDICO_REGEX.match(nome): return False, "Il nome contiene caratteri non validi."
+        if self.trova(nome) is not None: return False, f"Il medico '{nome}' è già presente."
+        simili = [] if consenti_simili else self.simili(nome)
+        if simili: return False, f"'{nome}' è molto simile a: {', '.join(simili)}. Conferma per aggiungerlo comunque."
+        return True, nome
+
+    def con_modifiche(self, aggiunte, rimozioni, consenti_simili=False):
+        """
+        Applica in blocco rimozioni e aggiunte su una copia del registro, validando ogni nome anche rispetto agli altri del blocco.
+        Restituisce (nuovo registro, {nome: errore}): con errori il blocco va rifiutato per intero.
+        """
+        registro = self.copia(); errori = {}
+        for nome in rimozioni:
+            medico = registro.trova(nome)
+            if medico is None: errori[nome] = f"Il medico '{nome}' non è nell'elenco."
+            else: registro._rimuovi(medico)
+        for nome in aggiunte:
+            valido, msg_o_nome_norm = registro.valida(nome, consenti_simili)
+            if valido: registro._aggiungi(msg_o_nome_norm)
+            else: errori[nome] = msg_o_nome_norm
+        registro.medici.sort(); return registro, errori
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_registro_medici(medici: tuple): return RegistroMedici(medici) # Ricostruito solo quando l'elenco cambia
+
 # --- FUNZIONI DI VALIDAZIONE (valida_nome_medico_v2, verifica_connessione_github) --- (come prima, omesse per brevità)
 @monitor_performance()
-def valida_nome_medico_v2(nome_input, elenco_medici_corrente):
-    if not isinstance(nome_input, str): return False, "Il nome deve essere una stringa."
-    nome = unicodedata.normalize('NFKC', nome_input.strip())
-    if not nome: return False, "Il nome non può essere vuoto."
-    if len(nome) < 2: return False, "Il nome deve contenere almeno 2 caratteri."
-    if len(nome) > 100: return False, "Il nome non può superare 100 caratteri."
-    if not regex.match(r"^[\p{L}\p{M}\s.'-]+$", nome): return False, "Il nome contiene caratteri non validi."
-    existing_names_normalized = [unicodedata.normalize('NFKC', m.strip().lower()) for m in elenco_medici_corrente]
-    if unicodedata.normalize('NFKC', nome.lower()) in existing_names_normalized: return False, f"Il medico '{nome}' è già presente."
-    return True, nome
+def valida_nome_medico_v2(nome_input, elenco_medici_corrente, consenti_simili=False):
+    return get_registro_medici(tuple(elenco_medici_corrente)).valida(nome_input, consenti_simili)
 
 def verifica_connessione_github():
     issues = []; logger.info("Verifica connessione GitHub...")
     try:
-        res = requests.get(f"https://api.github.com/repos/{app_config.get('GITHUB_USER')}/{app_config.get('REPO_NAME')}", headers=app_config.headers, timeout=app_config.get('REQUEST_TIMEOUT'))
+        res = github_client.get(app_config.repo_api_url)
         if res.status_code == 404: issues.append(f"Repo '{app_config.get('GITHUB_USER')}/{app_config.get('REPO_NAME')}' non trovato.")
         elif res.status_code == 401: issues.append("Token GitHub non valido/permessi insuff.")
         elif res.status_code != 200: issues.append(f"Errore GitHub repo: {res.status_code}.")
@@ -182,75 +528,197 @@ def verifica_connessione_github():
     if issues: logger.warning(f"Problemi connessione GitHub: {issues}")
     return issues
 
-# --- BACKUP LOCALE --- (come prima, omesse per brevità)
-@monitor_performance()
-def salva_backup_locale(data_to_save, filename):
-    try:
-        backup_dir = os.path.join(tempfile.gettempdir(), "medical_shifts_app_backup"); os.makedirs(backup_dir, exist_ok=True)
-        backup_path = os.path.join(backup_dir, filename)
-        with open(backup_path, 'w', encoding='utf-8') as f: json.dump(data_to_save, f, indent=2, ensure_ascii=False)
-        logger.info(f"Backup locale salvato: {backup_path}")
-    except Exception as e: logger.warning(f"Impossibile salvare backup '{filename}': {e}"); st.sidebar.caption(f"⚠️ Backup locale fallito.")
-@monitor_performance()
-def carica_backup_locale(filename):
-    try:
-        backup_dir = os.path.join(tempfile.gettempdir(), "medical_shifts_app_backup"); backup_path = os.path.join(backup_dir, filename)
-        if os.path.exists(backup_path):
-            with open(backup_path, 'r', encoding='utf-8') as f: data_loaded = json.load(f)
-            logger.info(f"Backup '{filename}' caricato da: {backup_path}"); return data_loaded
-        else: logger.info(f"Nessun backup '{filename}' in {backup_path}")
-    except Exception as e: logger.warning(f"Errore caricamento backup '{filename}': {e}")
-    return None
+# --- ARCHIVIO SNAPSHOT LOCALE (contenuti GitHub per SHA del blob: cache, storico versioni e lettura offline) ---
+class ArchivioSnapshot:
+    """
+    Archivio SQLite dei file JSON letti o scritti su GitHub, indirizzati dallo SHA del blob git: ogni contenuto è memorizzato
+    una sola volta (JSON compatto compresso con zlib), `versioni` ne tiene lo storico per path e `correnti` la versione attuale
+    con l'ETag per le richieste condizionali (If-None-Match), così un 304 non richiede né download né base64/json.loads.
+    Ogni scrittura è una transazione (WAL): un'interruzione non lascia indice o blob a metà.
+    Le versioni non correnti più vecchie di `ritenzione_giorni` vengono eliminate; oltre `max_bytes` si liberano prima le versioni
+    storiche meno recenti, poi le correnti meno usate. Davanti a SQLite un LRU di al più `max_voci_memoria` contenuti decodificati
+    evita zlib/json.loads per i file più letti. I dati restituiti vanno trattati in sola lettura.
+    """
+    DB_FILE = "snapshot.sqlite3"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS blob (sha TEXT PRIMARY KEY, dati BLOB NOT NULL, size INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS versioni (path TEXT NOT NULL, sha TEXT NOT NULL, origine TEXT NOT NULL, visto REAL NOT NULL, PRIMARY KEY (path, sha));
+        CREATE INDEX IF NOT EXISTS versioni_sha ON versioni (sha);
+        CREATE TABLE IF NOT EXISTS correnti (path TEXT PRIMARY KEY, sha TEXT NOT NULL, etag TEXT, accesso REAL NOT NULL);
+    """
+    def __init__(self, cartella, max_bytes, ritenzione_giorni, max_voci_memoria=128):
+        self.max_bytes = max_bytes; self.ritenzione_secondi = ritenzione_giorni * 86400; self.max_voci_memoria = max(0, max_voci_memoria)
+        self.hits = 0; self.misses = 0; self.evictions = 0
+        self._lock = threading.RLock(); self._memoria = OrderedDict() # sha -> dati decodificati (tier in memoria, LRU)
+        self._accessi = {} # path -> ultimo accesso non ancora scritto (evita una scrittura SQLite per ogni hit)
+        try:
+            os.makedirs(cartella, exist_ok=True); self._db = sqlite3.connect(os.path.join(cartella, self.DB_FILE), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL"); self._db.execute("PRAGMA synchronous=NORMAL"); self._db.executescript(self.SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Archivio snapshot non apribile in {cartella}, uso un archivio in memoria: {e}")
+            self._db = sqlite3.connect(":memory:", check_same_thread=False); self._db.executescript(self.SCHEMA)
+    @staticmethod
+    def _comprimi(dati): return zlib.compress(json.dumps(dati, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    def _in_memoria(self, sha, dati):
+        self._memoria[sha] = dati; self._memoria.move_to_end(sha)
+        while len(self._memoria) > self.max_voci_memoria: self._memoria.popitem(last=False) # Resta su SQLite
+    def _leggi_blob(self, sha):
+        if sha in self._memoria: self._memoria.move_to_end(sha); return self._memoria[sha]
+        riga = self._db.execute("SELECT dati FROM blob WHERE sha = ?", (sha,)).fetchone()
+        if riga is None: return None
+        try: dati = json.loads(zlib.decompress(riga[0]))
+        except (zlib.error, ValueError) as e: logger.warning(f"Blob {sha[:7]} dell'archivio snapshot illeggibile: {e}"); return None
+        self._in_memoria(sha, dati); return dati
+    def intestazioni_condizionali(self, path):
+        with self._lock:
+            riga = self._db.execute("SELECT etag FROM correnti WHERE path = ?", (path,)).fetchone()
+            return {"If-None-Match": riga[0]} if riga and riga[0] else {}
+    def sha_noto(self, path):
+        with self._lock: riga = self._db.execute("SELECT sha FROM correnti WHERE path = ?", (path,)).fetchone(); return riga[0] if riga else None
+    def leggi(self, path):
+        """Restituisce (dati, sha) della versione corrente di `path` se presente (conteggiato come hit), altrimenti None."""
+        with self._lock:
+            sha = self.sha_noto(path)
+            if sha is None: return None
+            dati = self._leggi_blob(sha)
+            if dati is None: self.invalida(path); return None
+            self._accessi[path] = time.time(); self.hits += 1
+            return dati, sha
+    def ultima_versione(self, path):
+        """(dati, sha) della versione di `path` vista più di recente, anche se non più corrente: lettura offline. None se non ce n'è."""
+        with self._lock:
+            for (sha,) in self._db.execute("SELECT sha FROM versioni WHERE path = ? ORDER BY visto DESC", (path,)).fetchall():
+                dati = self._leggi_blob(sha)
+                if dati is not None: return dati, sha
+            return None
+    def percorsi(self):
+        with self._lock: return [p for (p,) in self._db.execute("SELECT DISTINCT path FROM versioni ORDER BY path").fetchall()]
+    def storico(self, path):
+        """Versioni di `path` in archivio, dalla più recente: DataFrame con SHA, origine ('letto'/'scritto'), ora e byte compressi."""
+        with self._lock:
+            righe = self._db.execute("SELECT v.sha, v.origine, v.visto, b.size, c.sha IS NOT NULL FROM versioni v JOIN blob b ON b.sha = v.sha "
+                                     "LEFT JOIN correnti c ON c.path = v.path AND c.sha = v.sha WHERE v.path = ? ORDER BY v.visto DESC", (path,)).fetchall()
+        df = pd.DataFrame(righe, columns=["SHA", "Origine", "Visto", "Byte", "Corrente"])
+        df["Visto"] = pd.to_datetime(df["Visto"], unit="s"); df["Corrente"] = df["Corrente"].astype(bool); return df
+    def registra_miss(self):
+        with self._lock: self.misses += 1
+    def salva(self, path, sha, dati, etag=None, origine="letto"):
+        """
+        Registra `dati` come versione corrente di `path` (blob `sha`, memorizzato una volta sola) e applica ritenzione e limite.
+        `etag` è quello della GET che ha letto `dati`; None (es. dopo una PUT, il cui ETag descrive la risposta del commit e non la
+        rappresentazione letta dalla GET) rende la lettura successiva incondizionata, che riprende l'ETag da GitHub.
+        """
+        with self._lock:
+            ora = time.time()
+            try:
+                with self._db:
+                    if self._db.execute("SELECT 1 FROM blob WHERE sha = ?", (sha,)).fetchone() is None:
+                        compresso = self._comprimi(dati); self._db.execute("INSERT INTO blob VALUES (?, ?, ?)", (sha, compresso, len(compresso)))
+                    self._db.execute("INSERT INTO versioni VALUES (?, ?, ?, ?) ON CONFLICT (path, sha) DO UPDATE SET visto = excluded.visto", (path, sha, origine, ora))
+                    self._db.execute("INSERT OR REPLACE INTO correnti VALUES (?, ?, ?, ?)", (path, sha, etag, ora)); self._accessi.pop(path, None)
+                    self._db.executemany("UPDATE correnti SET accesso = ? WHERE path = ?", [(t, p) for p, t in self._accessi.items()]); self._accessi.clear()
+                    self._applica_limiti(ora)
+            except (sqlite3.Error, TypeError, ValueError) as e: logger.warning(f"Impossibile salvare '{path}' nell'archivio snapshot: {e}"); return
+            self._in_memoria(sha, dati)
+    def invalida(self, path):
+        """`path` non ha più una versione corrente (la prossima lettura va su GitHub); lo storico resta per la lettura offline."""
+        with self._lock:
+            self._accessi.pop(path, None)
+            try:
+                with self._db: self._db.execute("DELETE FROM correnti WHERE path = ?", (path,))
+            except sqlite3.Error as e: logger.warning(f"Impossibile invalidare '{path}' nell'archivio snapshot: {e}")
+    def _rimuovi_versione(self, path, sha):
+        """Elimina una versione e il suo blob se nessun'altra versione lo usa; restituisce i byte liberati."""
+        self._db.execute("DELETE FROM correnti WHERE path = ? AND sha = ?", (path, sha)); self._db.execute("DELETE FROM versioni WHERE path = ? AND sha = ?", (path, sha))
+        if self._db.execute("SELECT 1 FROM versioni WHERE sha = ?", (sha,)).fetchone(): return 0
+        riga = self._db.execute("SELECT size FROM blob WHERE sha = ?", (sha,)).fetchone()
+        self._db.execute("DELETE FROM blob WHERE sha = ?", (sha,)); self._memoria.pop(sha, None)
+        return riga[0] if riga else 0
+    def _applica_limiti(self, ora):
+        storiche = "SELECT v.path, v.sha FROM versioni v LEFT JOIN correnti c ON c.path = v.path AND c.sha = v.sha WHERE c.path IS NULL"
+        for path, sha in self._db.execute(f"{storiche} AND v.visto < ?", (ora - self.ritenzione_secondi,)).fetchall(): self._rimuovi_versione(path, sha)
+        totale = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blob").fetchone()[0]
+        if totale <= self.max_bytes: return
+        candidati = self._db.execute(f"{storiche} ORDER BY v.visto").fetchall() + self._db.execute("SELECT path, sha FROM correnti ORDER BY accesso").fetchall()
+        for path, sha in candidati:
+            if totale <= self.max_bytes: break
+            totale -= self._rimuovi_versione(path, sha); self.evictions += 1
+            logger.info(f"Archivio snapshot: rimossa la versione {sha[:7]} di '{path}' (limite {self.max_bytes} byte).")
+    def statistiche(self):
+        with self._lock:
+            richieste = self.hits + self.misses
+            voci, versioni, n_blob, byte = self._db.execute("SELECT (SELECT COUNT(*) FROM correnti), (SELECT COUNT(*) FROM versioni), COUNT(*), COALESCE(SUM(size), 0) FROM blob").fetchone()
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "voci": voci, "versioni": versioni, "blob": n_blob,
+                    "bytes": byte, "in_memoria": len(self._memoria), "hit_rate": self.hits / richieste if richieste else 0.0}
+
+@st.cache_resource
+def get_archivio_snapshot():
+    return ArchivioSnapshot(app_config.get('SNAPSHOT_DIR'), int(app_config.get('CACHE_MAX_MB') * 1024 * 1024), app_config.get('SNAPSHOT_RITENZIONE_GIORNI'), app_config.get('SNAPSHOT_MEMORIA_VOCI'))
+
+github_cache = get_archivio_snapshot() # Tier di cache di tutte le letture GitHub
+
+def chiave_cache_github(file_path_in_repo): return f"{app_config.get('GITHUB_USER')}/{app_config.get('REPO_NAME')}/{file_path_in_repo}"
 
 # --- FUNZIONI GITHUB (carica_medici, salva_medici) --- (come prima, omesse per brevità)
-@retry_github_api()
 @monitor_performance("Caricamento Medici GitHub")
 def carica_medici_da_github():
+    """(elenco, sha) del file medici, con richiesta condizionale sulla cache locale. Non usa la sessione: gira anche in background."""
     logger.info(f"Caricamento medici da GitHub: {app_config.medici_api_url}")
-    res = requests.get(app_config.medici_api_url, headers=app_config.headers, timeout=app_config.get('REQUEST_TIMEOUT'))
-    res.raise_for_status(); contenuto = res.json();
+    chiave_cache = chiave_cache_github(app_config.get('FILE_PATH_MEDICI'))
+    res = github_client.get(app_config.medici_api_url, headers=github_cache.intestazioni_condizionali(chiave_cache))
+    if res.status_code == 304 and (in_cache := github_cache.leggi(chiave_cache)) is not None:
+        elenco, file_sha = in_cache
+        logger.info(f"Medici invariati su GitHub (304), uso cache ({len(elenco)}). SHA: {file_sha[:7]}..."); return elenco, file_sha
+    if res.status_code == 304: github_cache.invalida(chiave_cache); res = github_client.get(app_config.medici_api_url)
+    res.raise_for_status(); contenuto = res.json(); github_cache.registra_miss()
     if "content" not in contenuto or "sha" not in contenuto: logger.error("Risposta GitHub malformata."); raise ValueError("Formato risposta GitHub inatteso.")
     file_sha = contenuto["sha"]; elenco_json = base64.b64decode(contenuto["content"]).decode('utf-8'); elenco = json.loads(elenco_json)
-    SessionManager.set_safe('sha_medici', file_sha); logger.info(f"Medici caricati da GitHub ({len(elenco)}). SHA: {file_sha[:7]}..."); return elenco
-
-@monitor_performance("Inizializzazione Elenco Medici")
-def inizializza_elenco_medici():
-    try: elenco = carica_medici_da_github(); salva_backup_locale(elenco, MEDICI_BACKUP_FILE); return elenco
-    except requests.exceptions.HTTPError as e_gh:
-        if e_gh.response.status_code == 404: st.sidebar.warning(f"File medici non trovato su GitHub."); logger.info("File medici 404, init vuoto."); SessionManager.set_safe('sha_medici', None); return []
-        else: logger.error(f"Errore HTTP GitHub ({e_gh.response.status_code}). Tento backup."); st.sidebar.error("⚠️ Errore GitHub caricamento medici.")
-    except requests.exceptions.RequestException as e_req: logger.error(f"Errore rete GitHub ({e_req}). Tento backup."); st.sidebar.error("⚠️ Errore rete caricamento medici.")
-    except Exception as e_gen: logger.error(f"Errore imprevisto caricamento medici: {e_gen}", exc_info=True); st.sidebar.error(f"⚠️ Errore: {e_gen}")
-    backup_data = carica_backup_locale(MEDICI_BACKUP_FILE)
-    if backup_data is not None: st.sidebar.warning("Medici caricati da backup locale."); return backup_data
-    else: st.sidebar.error("Impossibile caricare medici."); return []
-
-@retry_github_api()
+    github_cache.salva(chiave_cache, file_sha, elenco, etag=res.headers.get("ETag"))
+    logger.info(f"Medici caricati da GitHub ({len(elenco)}). SHA: {file_sha[:7]}..."); return elenco, file_sha
+
 @monitor_performance("Salvataggio Medici GitHub")
-def salva_medici_su_github(lista_medici, sha_corrente):
+def salva_medici_su_github(lista_medici, sha_corrente, elenco_base=None, max_merge=3):
+    """
+    Salva l'elenco medici su GitHub e restituisce (nuovo SHA o None, elenco salvato).
+    Su 409/422 (elenco cambiato da un altro utente) rilegge l'elenco remoto, riapplica aggiunte e rimozioni rispetto a
+    `elenco_base` e riprova: a livello di insieme di nomi non esistono conflitti veri.
+    Eseguita da `github_scheduler`: gli errori HTTP/rete vengono rilanciati per il retry e mostrati dalla UI.
+    """
     if not isinstance(lista_medici, list): raise TypeError("lista_medici deve essere una lista.")
-    try: blob = json.dumps(lista_medici, indent=2, ensure_ascii=False).encode('utf-8'); encoded_content = base64.b64encode(blob).decode('utf-8')
-    except (TypeError, ValueError) as e_json_ser: logger.error(f"Errore encoding JSON: {e_json_ser}"); raise ValueError(f"Impossibile serializzare lista medici: {e_json_ser}")
-    data = {"message": f"Agg. elenco medici - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", "content": encoded_content, "branch": app_config.get('ASSENZE_BRANCH')}
-    if sha_corrente: data["sha"] = sha_corrente
-    try:
+    for tentativo in range(max_merge):
+        try: blob = json.dumps(lista_medici, indent=2, ensure_ascii=False).encode('utf-8'); encoded_content = base64.b64encode(blob).decode('utf-8')
+        except (TypeError, ValueError) as e_json_ser: logger.error(f"Errore encoding JSON: {e_json_ser}"); raise ValueError(f"Impossibile serializzare lista medici: {e_json_ser}")
+        data = {"message": f"Agg. elenco medici - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", "content": encoded_content, "branch": app_config.get('ASSENZE_BRANCH')}
+        if sha_corrente: data["sha"] = sha_corrente
         logger.info(f"Salvataggio {len(lista_medici)} medici su GitHub. SHA: {str(sha_corrente)[:7]}...")
-        res = requests.put(app_config.medici_api_url, headers=app_config.headers, json=data, timeout=app_config.get('REQUEST_TIMEOUT'))
+        res = github_client.put(app_config.medici_api_url, json=data)
+        if res.status_code in (409, 422) and elenco_base is not None and tentativo < max_merge - 1:
+            elenco_remoto, sha_corrente = opera_su_file_json_github(app_config.get('FILE_PATH_MEDICI'), operazione="carica")
+            aggiunti = set(lista_medici) - set(elenco_base); rimossi = set(elenco_base) - set(lista_medici)
+            elenco_base = list(elenco_remoto or []); lista_medici = sorted((set(elenco_base) | aggiunti) - rimossi)
+            logger.info(f"Elenco medici cambiato su GitHub: riapplico +{sorted(aggiunti)} -{sorted(rimossi)} sulla versione {str(sha_corrente)[:7]}."); continue
         res.raise_for_status()
         if res.status_code in [200, 201]:
-            nuovo_sha = res.json()["content"]["sha"]; SessionManager.set_safe('sha_medici', nuovo_sha)
-            logger.info(f"Medici salvati. Nuovo SHA: {nuovo_sha[:7]}..."); salva_backup_locale(lista_medici, MEDICI_BACKUP_FILE); return True
-        else: logger.warning(f"Salvataggio parziale: status {res.status_code}"); return False
-    except requests.exceptions.Timeout: logger.error("Timeout salvataggio GitHub"); st.sidebar.error("⏰ Timeout connessione GitHub"); return False
-    except requests.exceptions.ConnectionError: logger.error("Errore connessione GitHub"); st.sidebar.error("🌐 Problema connessione GitHub"); return False
-    except requests.exceptions.HTTPError as e_http_put: 
-        logger.error(f"Errore HTTP GitHub salvataggio: {e_http_put.response.status_code} - {e_http_put.response.text}")
-        st.sidebar.error(f"❌ Errore GitHub salvataggio: {e_http_put.response.status_code}")
-        if e_http_put.response.status_code == 409: st.sidebar.warning("Conflitto versione. Ricarica e riprova."); SessionManager.set_safe('sha_medici', None)
-        return False
+            nuovo_sha = res.json()["content"]["sha"]
+            github_cache.salva(chiave_cache_github(app_config.get('FILE_PATH_MEDICI')), nuovo_sha, lista_medici, origine="scritto") # Senza ETag: la prossima lettura è incondizionata
+            logger.info(f"Medici salvati. Nuovo SHA: {nuovo_sha[:7]}..."); return nuovo_sha, lista_medici
+        logger.warning(f"Salvataggio parziale: status {res.status_code}"); return None, lista_medici
+
+def mostra_errore_salvataggio_medici(errore):
+    if isinstance(errore, requests.exceptions.Timeout): logger.error("Timeout salvataggio GitHub"); st.sidebar.error("⏰ Timeout connessione GitHub")
+    elif isinstance(errore, requests.exceptions.ConnectionError): logger.error("Errore connessione GitHub"); st.sidebar.error("🌐 Problema connessione GitHub")
+    elif isinstance(errore, requests.exceptions.HTTPError):
+        logger.error(f"Errore HTTP GitHub salvataggio: {errore.response.status_code} - {errore.response.text}")
+        st.sidebar.error(f"❌ Errore GitHub salvataggio: {errore.response.status_code}")
+        if errore.response.status_code == 409: st.sidebar.warning("Conflitto versione. Ricarica e riprova."); SessionManager.set_safe('sha_medici', None)
+    else: logger.error(f"Eccezione salvataggio medici: {errore}"); st.sidebar.error(f"❌ Errore critico salvataggio: {errore}")
 
 # --- NUOVA FUNZIONE PER SALVARE/CARICARE FILE JSON GENERICO SU GITHUB ---
-@retry_github_api()
+class FileJsonCorrotto(ValueError):
+    """Il contenuto di un file su GitHub non è JSON valido: errore permanente (nessun retry), mostrato dal chiamante nel thread dello script."""
+    def __init__(self, path, dettaglio):
+        super().__init__(f"Il file '{path}' su GitHub sembra corrotto ({dettaglio})."); self.path = path
+
 @monitor_performance("Operazione File JSON GitHub")
 def opera_su_file_json_github(file_path_in_repo, dati_da_salvare=None, sha_corrente=None, operazione="salva"):
     """
@@ -258,12 +726,14 @@ def opera_su_file_json_github(file_path_in_repo, dati_da_salvare=None, sha_corre
     Per 'salva': `dati_da_salvare` è obbligatorio.
     Per 'carica' o 'controlla': `dati_da_salvare` è ignorato.
     Restituisce i dati caricati e il nuovo SHA per 'carica', (True/False, nuovo_SHA) per 'salva', (True/False, sha) per 'controlla'.
+    Solleva `FileJsonCorrotto` se il file esiste ma non è JSON valido: può girare nei thread del pool, quindi non usa `st.*`.
     """
     target_api_url = app_config.assenze_api_url(file_path_in_repo) # URL specifico per il file
+    chiave_cache = chiave_cache_github(file_path_in_repo)
     
     if operazione == "salva":
         if dati_da_salvare is None: raise ValueError("`dati_da_salvare` obbligatori per operazione 'salva'.")
-        try: blob = json.dumps(dati_da_salvare, indent=2, ensure_ascii=False).encode('utf-8'); encoded_content = base64.b64encode(blob).decode('utf-8')
+        try: blob = serializza_json_github(dati_da_salvare); encoded_content = base64.b64encode(blob).decode('utf-8')
         except (TypeError, ValueError) as e_json: logger.error(f"Errore encoding JSON per '{file_path_in_repo}': {e_json}"); raise
         
         payload = {"message": f"Aggiornamento file {file_path_in_repo} - {datetime.now().strftime('%Y-%m-%d %H:%M')}",
@@ -271,10 +741,11 @@ def opera_su_file_json_github(file_path_in_repo, dati_da_salvare=None, sha_corre
         if sha_corrente: payload["sha"] = sha_corrente
         
         logger.info(f"Tentativo di salvare '{file_path_in_repo}' su GitHub. SHA usato: {str(sha_corrente)[:7]}...")
-        res = requests.put(target_api_url, headers=app_config.headers, json=payload, timeout=app_config.get('REQUEST_TIMEOUT'))
+        res = github_client.put(target_api_url, json=payload)
+        if res.status_code in (409, 422): github_cache.invalida(chiave_cache) # SHA non più attuale: il prossimo 'controlla' lo rilegge
         res.raise_for_status()
         if res.status_code in [200, 201]:
-            nuovo_sha = res.json()["content"]["sha"]
+            nuovo_sha = res.json()["content"]["sha"]; github_cache.salva(chiave_cache, nuovo_sha, dati_da_salvare, origine="scritto") # Senza ETag: la prossima lettura è incondizionata
             logger.info(f"File '{file_path_in_repo}' salvato con successo. Nuovo SHA: {nuovo_sha[:7]}...")
             return True, nuovo_sha
         else:
@@ -282,12 +753,19 @@ def opera_su_file_json_github(file_path_in_repo, dati_da_salvare=None, sha_corre
             return False, sha_corrente # Restituisce lo SHA vecchio in caso di fallimento non HTTPError
 
     elif operazione == "carica" or operazione == "controlla":
-        logger.info(f"Tentativo di {operazione} file '{file_path_in_repo}' da GitHub.")
+        logger.info(f"Tentativo di {operazione} file '{file_path_in_repo}' da GitHub."); contenuto_api = {}
         try:
-            res = requests.get(target_api_url, headers=app_config.headers, timeout=app_config.get('REQUEST_TIMEOUT'))
+            res = github_client.get(target_api_url, headers=github_cache.intestazioni_condizionali(chiave_cache))
+            if res.status_code == 304: # ETag invariato: i dati decodificati sono già in cache
+                in_cache = github_cache.leggi(chiave_cache)
+                if in_cache is not None:
+                    dati_in_cache, sha_file = in_cache
+                    logger.info(f"File '{file_path_in_repo}' invariato (304), uso cache. SHA: {sha_file[:7]}...")
+                    return (True, sha_file) if operazione == "controlla" else (dati_in_cache, sha_file)
+                github_cache.invalida(chiave_cache); res = github_client.get(target_api_url)
             res.raise_for_status() # Solleva errore per 4xx/5xx tranne 404 gestito sotto
             
-            contenuto_api = res.json()
+            contenuto_api = res.json(); github_cache.registra_miss()
             sha_file = contenuto_api["sha"]
             if operazione == "controlla":
                 logger.info(f"File '{file_path_in_repo}' trovato. SHA: {sha_file[:7]}...")
@@ -296,110 +774,952 @@ def opera_su_file_json_github(file_path_in_repo, dati_da_salvare=None, sha_corre
             # Se operazione == "carica"
             dati_json_b64 = contenuto_api["content"]
             dati_decodificati = json.loads(base64.b64decode(dati_json_b64).decode('utf-8'))
+            github_cache.salva(chiave_cache, sha_file, dati_decodificati, etag=res.headers.get("ETag"))
             logger.info(f"File '{file_path_in_repo}' caricato. SHA: {sha_file[:7]}...")
             return dati_decodificati, sha_file
             
         except requests.exceptions.HTTPError as e_http_get:
             if e_http_get.response.status_code == 404:
-                logger.info(f"File '{file_path_in_repo}' non trovato su GitHub (404).")
+                logger.info(f"File '{file_path_in_repo}' non trovato su GitHub (404)."); github_cache.invalida(chiave_cache)
                 return (None, None) if operazione == "carica" else (False, None) # Non esiste
             else: # Altri errori HTTP
                 logger.error(f"Errore HTTP {e_http_get.response.status_code} durante {operazione} di '{file_path_in_repo}': {e_http_get.response.text}")
                 raise # Rilancia l'eccezione perché il retry decorator la gestisca
-        except json.JSONDecodeError as e_json_dec:
+        except (json.JSONDecodeError, UnicodeDecodeError) as e_json_dec:
             logger.error(f"Errore decodifica JSON per '{file_path_in_repo}': {e_json_dec}. Contenuto grezzo: {base64.b64decode(contenuto_api.get('content','')).decode('utf-8', errors='ignore')[:200]}...")
-            st.error(f"Il file '{file_path_in_repo}' su GitHub sembra corrotto.")
-            return (None, None) if operazione == "carica" else (False, None) # Considera corrotto come non caricabile/non valido
+            raise FileJsonCorrotto(file_path_in_repo, e_json_dec) from e_json_dec
     else:
         raise ValueError(f"Operazione '{operazione}' non supportata per opera_su_file_json_github.")
 
-# --- VERIFICA CONNESSIONE GITHUB E INIT STATO --- (come prima, omesse per brevità)
-if not SessionManager.get_safe('github_connection_checked'):
-    conn_issues = verifica_connessione_github()
-    if conn_issues: st.sidebar.error("⚠️ **Problemi Connessione GitHub:**"); [st.sidebar.error(f"  • {issue}") for issue in conn_issues]
-    SessionManager.set_safe('github_connection_checked', True)
-if not SessionManager.get_safe('elenco_medici_completo'):
-    with st.spinner("Caricamento elenco medici..."): SessionManager.set_safe('elenco_medici_completo', inizializza_elenco_medici())
+# --- FORMATO FILE ASSENZE (v2: intervalli per medico, JSON compatto; lettura anche del formato v1 per giorno) ---
+def periodo_file_assenze(path):
+    """(anno, mese) di un file assenze dal suo nome, None se il nome non è quello di un file assenze."""
+    m = ASSENZE_FILE_REGEX.match(os.path.basename(path)); return (int(m.group(1)), int(m.group(2))) if m else None
+
+def serializza_json_github(dati): return json.dumps(dati, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def celle_assenze(dati_mese):
+    """
+    `{(medico, 'YYYY-MM-DD'): tipo}` per le sole assenze (≠ 'Presente') di un file assenze mensile, in entrambi i formati:
+    v1 `{"Data", "tipo_assenza"}` per giorno oppure v2 `{"start", "end", "tipo"}` per intervallo.
+    """
+    celle = {}
+    for medico, records in ((dati_mese or {}).get("medici") or {}).items():
+        for r in records:
+            if "start" not in r: celle[(medico, r[COL_DATA])] = r["tipo_assenza"]; continue
+            giorno = date.fromisoformat(r["start"]); fine = date.fromisoformat(r["end"])
+            while giorno <= fine: celle[(medico, giorno.isoformat())] = r["tipo"]; giorno += timedelta(days=1)
+    return celle
+
+def codifica_assenze(anno, mese, celle):
+    """File assenze v2 da `{(medico, 'YYYY-MM-DD'): tipo}`: giorni consecutivi con lo stesso tipo diventano un intervallo."""
+    medici = {}
+    for (medico, data_iso), tipo in sorted(celle.items()):
+        if tipo == "Presente": continue
+        intervalli = medici.setdefault(medico, [])
+        if intervalli and intervalli[-1]["tipo"] == tipo and date.fromisoformat(intervalli[-1]["end"]) + timedelta(days=1) == date.fromisoformat(data_iso): intervalli[-1]["end"] = data_iso
+        else: intervalli.append({"start": data_iso, "end": data_iso, "tipo": tipo})
+    return {"versione": FORMATO_ASSENZE_VERSIONE, "anno": anno, "mese": mese, "medici": medici}
+
+def applica_modifiche_assenze(dati_mese, anno, mese, modifiche):
+    """Applica `{(medico, 'YYYY-MM-DD'): tipo}` a un file assenze mensile (anche None, v1 o v2) e restituisce il nuovo contenuto v2."""
+    celle = celle_assenze(dati_mese); celle.update(modifiche)
+    return codifica_assenze(anno, mese, celle)
+
+def celle_da_calendario(df_calendario, medici):
+    """Assenze (celle ≠ 'Presente') delle colonne `medici` del calendario, lette dalla matrice dei codici."""
+    righe, colonne = np.nonzero(codici_assenze(df_calendario, medici) > 0)
+    date_iso = pd.DatetimeIndex(df_calendario[COL_DATA]).strftime('%Y-%m-%d')
+    return {(medici[j], date_iso[r]): str(df_calendario[medici[j]].iloc[r]) for r, j in zip(righe, colonne)}
+
+# --- MERGE A TRE VIE DELLE ASSENZE (conflitti 409) ---
+class ConflittoAssenze(Exception):
+    """Celle modificate in modo diverso sia localmente sia su GitHub rispetto alla versione base caricata."""
+    def __init__(self, path, conflitti, celle_unite, dati_remoti, sha_remoto):
+        super().__init__(f"{len(conflitti)} celle in conflitto in '{path}'")
+        self.path = path; self.conflitti = conflitti; self.celle_unite = celle_unite; self.dati_remoti = dati_remoti; self.sha_remoto = sha_remoto
+
+def unisci_assenze_tre_vie(celle_base, celle_locali, celle_remote, medici_gestiti=None):
+    """
+    Merge a livello di cella medico/data: vince la parte che ha cambiato la cella rispetto alla base. Le celle cambiate
+    da entrambe con valori diversi sono conflitti `{chiave: (base, locale, remoto)}` (nell'unione resta il valore locale).
+    Per i medici fuori da `medici_gestiti` (non presenti nell'editor) la versione locale coincide con la base.
+    """
+    unite = {}; conflitti = {}
+    for chiave in set(celle_base) | set(celle_locali) | set(celle_remote):
+        valore_base = celle_base.get(chiave, "Presente"); valore_remoto = celle_remote.get(chiave, "Presente")
+        valore_locale = celle_locali.get(chiave, "Presente") if medici_gestiti is None or chiave[0] in medici_gestiti else valore_base
+        if valore_locale == valore_remoto or valore_remoto == valore_base: valore = valore_locale
+        elif valore_locale == valore_base: valore = valore_remoto
+        else: valore = valore_locale; conflitti[chiave] = (valore_base, valore_locale, valore_remoto)
+        if valore != "Presente": unite[chiave] = valore
+    return unite, conflitti
+
+@monitor_performance("Salvataggio Assenze GitHub")
+def salva_file_assenze_github(file_path_in_repo, dati_da_salvare, sha_noto=None, dati_base=None, medici_gestiti=None, max_merge=3):
+    """
+    Controlla lo SHA se non noto e salva il file assenze. Su 409/422 (SHA superato) rilegge la versione remota, la unisce
+    a tre vie con `dati_base` (la versione da cui partiva l'utente) e riprova; solleva `ConflittoAssenze` se restano conflitti veri.
+    Restituisce (nuovo SHA o None, dati salvati, unito_con_remoto). Eseguita da `github_scheduler`.
+    """
+    # 1. Controlla se il file esiste già per ottenere lo SHA
+    if not sha_noto: _, sha_noto = opera_su_file_json_github(file_path_in_repo, operazione="controlla")
+    unito = False
+    for tentativo in range(max_merge):
+        # 2. Salva il file (crea o aggiorna)
+        try:
+            successo_salvataggio, nuovo_sha = opera_su_file_json_github(file_path_in_repo=file_path_in_repo, dati_da_salvare=dati_da_salvare, sha_corrente=sha_noto, operazione="salva")
+            return (nuovo_sha if successo_salvataggio else None), dati_da_salvare, unito
+        except requests.exceptions.HTTPError as e_http:
+            if e_http.response is None or e_http.response.status_code not in (409, 422) or tentativo == max_merge - 1: raise
+        # 3. Versione remota cambiata: merge a tre vie e nuovo tentativo con lo SHA remoto
+        dati_remoti, sha_noto = opera_su_file_json_github(file_path_in_repo, operazione="carica")
+        celle_unite, conflitti = unisci_assenze_tre_vie(celle_assenze(dati_base), celle_assenze(dati_da_salvare), celle_assenze(dati_remoti), medici_gestiti)
+        if conflitti: logger.warning(f"Merge '{file_path_in_repo}': {len(conflitti)} celle in conflitto."); raise ConflittoAssenze(file_path_in_repo, conflitti, celle_unite, dati_remoti, sha_noto)
+        logger.info(f"Merge automatico '{file_path_in_repo}' con la versione remota {str(sha_noto)[:7]} riuscito, nuovo tentativo.")
+        dati_da_salvare = applica_modifiche_assenze(None, dati_da_salvare["anno"], dati_da_salvare["mese"], celle_unite); dati_base = dati_remoti; unito = True
+
+# --- SALVATAGGIO MULTI-FILE IN UN SOLO COMMIT (Git Data API) ---
+class GitHubConflitto(Exception):
+    """Uno o più file sono cambiati su GitHub rispetto allo SHA atteso dal chiamante."""
+    def __init__(self, percorsi):
+        super().__init__(f"File modificati su GitHub nel frattempo: {', '.join(percorsi)}"); self.percorsi = percorsi
+
+def sha_blob_git(contenuto_bytes): return hashlib.sha1(b"blob %d\0" % len(contenuto_bytes) + contenuto_bytes).hexdigest()
+
+def sha_file_github(path, ref):
+    """SHA del blob di `path` al commit `ref` (contents API), None se il file non esiste: per i file assenti da un albero troncato."""
+    res = github_client.get(app_config.assenze_api_url(path), params={"ref": ref})
+    if res.status_code == 404: return None
+    res.raise_for_status(); return res.json()["sha"]
+
+@monitor_performance("Salvataggio Batch GitHub")
+def salva_file_batch_github(file_da_salvare, sha_attesi=None, messaggio=None, max_tentativi_ref=3):
+    """
+    Salva più file JSON (`{path: dati}`) con un unico commit via Git Data API: ref, commit base, (albero base),
+    nuovo albero con i contenuti inline, commit e aggiornamento ref. I round trip non dipendono dal numero di file.
+    `sha_attesi` (`{path: sha o None}`) replica il controllo di concorrenza della contents API e solleva `GitHubConflitto`;
+    se GitHub tronca l'albero (repository molto grande) gli SHA dei file non elencati si leggono uno per uno.
+    Gli SHA dei blob sono calcolati localmente; restituisce `{path: nuovo_sha}`. Eseguita da `github_scheduler`.
+    """
+    if not file_da_salvare: return {}
+    branch = app_config.get('ASSENZE_BRANCH'); base_url = app_config.repo_api_url
+    contenuti = {path: serializza_json_github(dati) for path, dati in file_da_salvare.items()}
+    nuovi_sha = {path: sha_blob_git(blob) for path, blob in contenuti.items()}
+    messaggio = messaggio or f"Aggiornamento {len(contenuti)} file - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+    logger.info(f"Salvataggio batch di {len(contenuti)} file su '{branch}': {', '.join(sorted(contenuti))}")
+    for tentativo in range(max_tentativi_ref):
+        res = github_client.get(f"{base_url}/git/ref/heads/{branch}"); res.raise_for_status(); head_sha = res.json()["object"]["sha"]
+        res = github_client.get(f"{base_url}/git/commits/{head_sha}"); res.raise_for_status(); base_tree_sha = res.json()["tree"]["sha"]
+        if sha_attesi:
+            res = github_client.get(f"{base_url}/git/trees/{base_tree_sha}", params={"recursive": "1"} if any('/' in p for p in sha_attesi) else None); res.raise_for_status()
+            albero = res.json(); sha_remoti = {voce["path"]: voce["sha"] for voce in albero["tree"] if voce["type"] == "blob"}
+            if albero.get("truncated"): # Un file assente dall'elenco potrebbe esistere: verifica al commit di partenza
+                mancanti = [p for p in sha_attesi if p not in sha_remoti]; logger.warning(f"Albero '{branch}' troncato: verifico {len(mancanti)} file singolarmente.")
+                sha_remoti.update({p: sha_file_github(p, head_sha) for p in mancanti})
+            conflitti = [p for p, sha in sha_attesi.items() if sha_remoti.get(p) not in (sha, nuovi_sha.get(p))]
+            if conflitti: logger.warning(f"Conflitto salvataggio batch: {conflitti}"); raise GitHubConflitto(conflitti)
+        voci_tree = [{"path": path, "mode": "100644", "type": "blob", "content": blob.decode('utf-8')} for path, blob in contenuti.items()]
+        res = github_client.post(f"{base_url}/git/trees", json={"base_tree": base_tree_sha, "tree": voci_tree}); res.raise_for_status()
+        res = github_client.post(f"{base_url}/git/commits", json={"message": messaggio, "tree": res.json()["sha"], "parents": [head_sha]}); res.raise_for_status(); commit_sha = res.json()["sha"]
+        res = github_client.patch(f"{base_url}/git/refs/heads/{branch}", json={"sha": commit_sha, "force": False})
+        if res.status_code == 422 and tentativo < max_tentativi_ref - 1: logger.warning(f"Branch '{branch}' avanzato durante il batch, ricostruisco il commit..."); continue
+        res.raise_for_status(); break
+    for path, dati in file_da_salvare.items(): github_cache.salva(chiave_cache_github(path), nuovi_sha[path], dati, origine="scritto")
+    logger.info(f"Batch salvato nel commit {commit_sha[:7]}: {len(contenuti)} file."); return nuovi_sha
+
+@monitor_performance("Salvataggio Assenze Periodo")
+def salva_assenze_periodo(salvataggi, medici_gestiti=None):
+    """
+    Salva i file assenze di un periodo (`{path: (dati, sha_noto, dati_base)}`): un solo mese con `salva_file_assenze_github`,
+    più mesi con un unico commit batch. Se uno dei file è cambiato su GitHub, salva file per file con il merge a tre vie.
+    Restituisce `({path: (nuovo_sha, dati_salvati, unito_con_remoto)}, ConflittoAssenze o None)`: il conflitto è un risultato,
+    non un errore dell'operazione, perché ogni rerun ridefinisce le classi dello script e `isinstance` non lo riconoscerebbe.
+    """
+    if len(salvataggi) > 1:
+        try:
+            nuovi_sha = salva_file_batch_github({path: dati for path, (dati, _, _) in salvataggi.items()}, sha_attesi={path: sha for path, (_, sha, _) in salvataggi.items()},
+                                                messaggio=f"Aggiornamento assenze {', '.join(sorted(salvataggi))} - {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+            return {path: (nuovi_sha[path], salvataggi[path][0], False) for path in salvataggi}, None
+        except GitHubConflitto as e_conflitto: logger.info(f"{e_conflitto}: salvataggio file per file con merge.")
+    salvati = {}; conflitto = None
+    for path, (dati, sha_noto, dati_base) in salvataggi.items():
+        try: salvati[path] = salva_file_assenze_github(path, dati, sha_noto, dati_base, medici_gestiti)
+        except ConflittoAssenze as e_conflitto: conflitto = conflitto or e_conflitto
+    return salvati, conflitto
+
+# --- MIGRAZIONE FILE ASSENZE AL FORMATO v2 ---
+def elenca_file_assenze_github():
+    """`{path: sha}` dei file assenze presenti sul branch, letti dall'albero Git con una sola richiesta per tutti i file."""
+    base_url = app_config.repo_api_url; branch = app_config.get('ASSENZE_BRANCH')
+    res = github_client.get(f"{base_url}/git/ref/heads/{branch}"); res.raise_for_status(); head_sha = res.json()["object"]["sha"]
+    res = github_client.get(f"{base_url}/git/commits/{head_sha}"); res.raise_for_status(); tree_sha = res.json()["tree"]["sha"]
+    res = github_client.get(f"{base_url}/git/trees/{tree_sha}", params={"recursive": "1"}); res.raise_for_status()
+    return {voce["path"]: voce["sha"] for voce in res.json()["tree"] if voce["type"] == "blob" and ASSENZE_FILE_REGEX.match(os.path.basename(voce["path"]))}
+
+@monitor_performance("Migrazione Formato Assenze")
+def migra_file_assenze_github():
+    """Riscrive nel formato v2, con un solo commit, i file assenze ancora nel formato per giorno; restituisce i path migrati."""
+    file_da_migrare = {}; sha_attesi = {}
+    for path in sorted(elenca_file_assenze_github()):
+        dati, sha = opera_su_file_json_github(path, operazione="carica")
+        if dati is None or dati.get("versione") == FORMATO_ASSENZE_VERSIONE: continue
+        file_da_migrare[path] = codifica_assenze(dati["anno"], dati["mese"], celle_assenze(dati)); sha_attesi[path] = sha
+        logger.info(f"Migrazione '{path}': {len(serializza_json_github(dati))} -> {len(serializza_json_github(file_da_migrare[path]))} byte.")
+    if file_da_migrare: salva_file_batch_github(file_da_migrare, sha_attesi=sha_attesi, messaggio=f"Migrazione {len(file_da_migrare)} file assenze al formato v{FORMATO_ASSENZE_VERSIONE}")
+    return sorted(file_da_migrare)
+
+# --- INDICE ASSENZE MULTI-MESE (caricamento parallelo, interrogazioni per data e per medico) ---
+class IndiceAssenze:
+    """
+    Indice colonnare in memoria delle assenze salvate su più mesi, condiviso da tutte le sessioni del processo:
+    una riga per giorno di assenza (data, medico, tipo categoriali), ordinate per data. I file mensili vengono letti
+    in parallelo e, ad ogni aggiornamento, solo quelli il cui SHA è cambiato. I DataFrame restituiti sono in sola lettura.
+    """
+    COLONNE = ["data", "medico", "tipo"]
+    def __init__(self, max_workers):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="indice-assenze")
+        self._lock = threading.Lock(); self._file = {} # path -> (sha, righe del mese)
+        self._anni = set(); self._df = self._righe_mese(None); self.ultimo_aggiornamento = 0.0
+    @staticmethod
+    def anno_file(path): periodo = periodo_file_assenze(path); return periodo[0] if periodo else None
+    @staticmethod
+    def _righe_mese(dati_mese):
+        celle = celle_assenze(dati_mese)
+        medici, date_iso = zip(*celle) if celle else ((), ())
+        return pd.DataFrame({"data": pd.to_datetime(list(date_iso)), "medico": list(medici), "tipo": pd.Categorical(list(celle.values()), dtype=TIPO_ASSENZA_DTYPE)})
+    def _leggi_file(self, path, sha):
+        chiave = chiave_cache_github(path) # Lo SHA dell'albero basta a riconoscere un blob già in cache: nessuna richiesta
+        if github_cache.sha_noto(chiave) == sha:
+            in_cache = github_cache.leggi(chiave)
+            if in_cache is not None: return in_cache
+        try: return opera_su_file_json_github(path, operazione="carica")
+        except FileJsonCorrotto as e: logger.warning(f"Indice assenze: {e} Il mese resta fuori dall'indice."); return None, None
+    def _ricostruisci(self):
+        parti = [righe for _, righe in self._file.values() if not righe.empty]
+        df = pd.concat(parti, ignore_index=True) if parti else self._righe_mese(None)
+        df["medico"] = df["medico"].astype("category"); df["tipo"] = df["tipo"].astype(TIPO_ASSENZA_DTYPE)
+        self._df = df.sort_values("data", kind="stable", ignore_index=True)
+    def copre(self, anno_da, anno_a):
+        with self._lock: return set(range(anno_da, anno_a + 1)) <= self._anni
+    @monitor_performance("Aggiornamento Indice Assenze")
+    def aggiorna(self, anno_da, anno_a):
+        """Allinea l'indice ai file assenze degli anni [anno_da, anno_a] sul branch; restituisce quanti file sono stati riletti."""
+        anni = range(anno_da, anno_a + 1)
+        file_remoti = {p: sha for p, sha in elenca_file_assenze_github().items() if self.anno_file(p) in anni}
+        with self._lock: da_leggere = {p: sha for p, sha in file_remoti.items() if self._file.get(p, (None,))[0] != sha}
+        letti = {path: self.executor.submit(self._leggi_file, path, sha) for path, sha in da_leggere.items()}
+        letti = {path: futuro.result() for path, futuro in letti.items()}
+        with self._lock:
+            for path in [p for p in self._file if self.anno_file(p) in anni and p not in file_remoti]: del self._file[path] # file rimossi dal repo
+            for path, (dati_mese, sha) in letti.items():
+                if sha is not None: self._file[path] = (sha, self._righe_mese(dati_mese))
+            self._anni.update(anni); self._ricostruisci(); self.ultimo_aggiornamento = time.time()
+        logger.info(f"Indice assenze {anno_da}-{anno_a}: {len(letti)}/{len(file_remoti)} file riletti, {len(self._df)} giorni di assenza.")
+        return len(letti)
+    def sincronizza_da_cache(self):
+        """Recepisce senza rete i file salvati da questo processo (manuali, automatici, batch): la cache locale ne ha già SHA e dati."""
+        with self._lock:
+            cambiati = {}
+            for path, (sha, _) in self._file.items():
+                chiave = chiave_cache_github(path)
+                if github_cache.sha_noto(chiave) in (None, sha): continue
+                in_cache = github_cache.leggi(chiave)
+                if in_cache is not None: cambiati[path] = (in_cache[1], self._righe_mese(in_cache[0]))
+            if cambiati: self._file.update(cambiati); self._ricostruisci()
+    def _intervallo(self, df, da, a):
+        date = df["data"].to_numpy()
+        return df.iloc[np.searchsorted(date, np.datetime64(da, 'ns'), 'left'):np.searchsorted(date, np.datetime64(a, 'ns'), 'right')]
+    @monitor_performance("Indice Assenze: assenti per data")
+    def assenti_il(self, giorno):
+        """Medici assenti il `giorno` con il tipo di assenza."""
+        righe = self._intervallo(self._df, giorno, giorno)
+        return pd.DataFrame({"Medico": righe["medico"].astype(str).to_numpy(), "Assenza": righe["tipo"].astype(str).to_numpy()})
+    @monitor_performance("Indice Assenze: riepilogo medico")
+    def giorni_per_tipo(self, medico, anno):
+        """Giorni di assenza di `medico` nell'anno, per tipo (tutti i tipi diversi da 'Presente', anche a zero)."""
+        righe = self._intervallo(self._df, date(anno, 1, 1), date(anno, 12, 31))
+        return righe.loc[righe["medico"] == medico, "tipo"].value_counts().reindex(TIPI_ASSENZA[1:], fill_value=0)
+    @monitor_performance("Indice Assenze: giorni sotto organico")
+    def giorni_sotto_organico(self, medici, minimo, da, a):
+        """Giorni tra `da` e `a` in cui i medici di `medici` presenti sono meno di `minimo`."""
+        righe = self._intervallo(self._df, da, a); righe = righe[righe["medico"].isin(medici)]
+        giorni = pd.date_range(da, a, freq="D")
+        presenti = len(medici) - righe.groupby("data").size().reindex(giorni, fill_value=0).to_numpy()
+        sotto = presenti < minimo
+        return pd.DataFrame({COL_DATA: giorni[sotto], COL_GIORNO: giorni[sotto].strftime("%A"), "Presenti": presenti[sotto]})
+
+@st.cache_resource
+def get_indice_assenze(): return IndiceAssenze(app_config.get('GITHUB_WORKERS'))
+
+indice_assenze = get_indice_assenze()
+
+# --- IMPORTAZIONE MASSIVA ASSENZE (CSV/XLSX in streaming, un commit per tutti i mesi) ---
+COLONNE_IMPORT = {"medico": ("medico", "nome", "nominativo"), "dal": ("dal", "inizio", "data inizio", "data", "start"),
+                  "al": ("al", "fine", "data fine", "end"), "tipo": ("tipo", "tipo assenza", "tipo_assenza", "causale")} # "al" facoltativa: un solo giorno
+RIGHE_PER_BLOCCO_IMPORT = 50_000 # Righe del file import convertite in DataFrame per volta (liste Python solo per un blocco)
+
+def righe_file_import(file_caricato, nome_file):
+    """Righe (sequenze di valori) di un file CSV o XLSX lette in streaming: openpyxl in sola lettura, csv riga per riga."""
+    if nome_file.lower().endswith(".xlsx"):
+        workbook = openpyxl.load_workbook(file_caricato, read_only=True, data_only=True)
+        try: yield from workbook.active.iter_rows(values_only=True)
+        finally: workbook.close()
+        return
+    testo = io.TextIOWrapper(file_caricato, encoding="utf-8-sig", newline="")
+    campione = testo.read(8192); testo.seek(0)
+    try: dialetto = csv.Sniffer().sniff(campione, delimiters=";,\t")
+    except csv.Error: dialetto = csv.excel
+    yield from csv.reader(testo, dialetto)
+
+def converti_date_import(valori):
+    """Date da celle Excel (datetime) o testo ISO / gg/mm/aaaa; NaT se non valide."""
+    date_iso = pd.to_datetime(valori, format="ISO8601", errors="coerce") # prima l'ISO: con dayfirst '2025-06-03' diventerebbe 6 marzo
+    mancanti = date_iso.isna() & valori.notna()
+    if mancanti.any(): date_iso[mancanti] = pd.to_datetime(valori[mancanti], dayfirst=True, format="mixed", errors="coerce")
+    return date_iso.dt.normalize()
+
+@monitor_performance("Lettura File Import Assenze")
+def leggi_import_assenze(righe, elenco_medici):
+    """
+    Valida le righe (intestazione + dati) contro `elenco_medici` e TIPI_ASSENZA ed espande gli intervalli per giorno.
+    Restituisce (`{path: {(medico, data_iso): tipo}}` raggruppato per file mensile, DataFrame degli scarti con riga e motivo).
+    Per la stessa cella prevale l'ultima riga del file; il tipo 'Presente' cancella un'assenza già salvata.
+    """
+    righe = iter(righe); intestazione = next(righe, None)
+    if intestazione is None: raise ValueError("Il file è vuoto.")
+    nomi_colonne = [RegistroMedici.normalizza(str(c or "")) for c in intestazione]
+    indici = {campo: next((i for i, n in enumerate(nomi_colonne) if n in alias), None) for campo, alias in COLONNE_IMPORT.items()}
+    mancanti = [campo for campo, i in indici.items() if i is None and campo != "al"]
+    if mancanti: raise ValueError(f"Colonne mancanti: {', '.join(mancanti)}. Intestazioni attese, ad esempio: Medico, Dal, Al, Tipo.")
+    righe_non_vuote = ((numero_riga, riga) for numero_riga, riga in enumerate(righe, start=2) if any(v not in (None, "") for v in riga))
+    parti = []
+    while blocco := list(itertools.islice(righe_non_vuote, RIGHE_PER_BLOCCO_IMPORT)):
+        parte = pd.DataFrame({campo: [riga[i] if i is not None and i < len(riga) else None for _, riga in blocco] for campo, i in indici.items()}, dtype=object)
+        parte["riga"] = np.fromiter((numero_riga for numero_riga, _ in blocco), dtype=np.int64, count=len(blocco)); parti.append(parte)
+    df = pd.concat(parti, ignore_index=True) if parti else pd.DataFrame({**{campo: [] for campo in COLONNE_IMPORT}, "riga": np.array([], dtype=np.int64)})
+    medici_normalizzati = {RegistroMedici.normalizza(m): m for m in elenco_medici} # Stessa normalizzazione dei nomi del file
+    medico = df["medico"].astype(str).map(RegistroMedici.normalizza).map(medici_normalizzati)
+    tipo = df["tipo"].astype(str).str.strip().str.lower().map({t.lower(): t for t in TIPI_ASSENZA})
+    dal = converti_date_import(df["dal"]); al = converti_date_import(df["al"])
+    al_non_valida = (al.isna() & df["al"].notna() & df["al"].astype(str).str.strip().ne("")).to_numpy(); al = al.fillna(dal) # Cella vuota: un solo giorno
+    giorni = ((al - dal).dt.days + 1).fillna(0).astype(int).to_numpy()
+    motivi = np.select([medico.isna().to_numpy(), tipo.isna().to_numpy(), dal.isna().to_numpy(), al_non_valida, giorni < 1, giorni > 366],
+                       ["Medico non in elenco", "Tipo assenza non valido", "Data inizio non valida", "Data fine non valida", "Data fine prima della data inizio", "Intervallo oltre un anno"], default="")
+    validi = motivi == ""
+    scarti = pd.DataFrame({"Riga": df["riga"].to_numpy()[~validi], "Medico": df["medico"][~validi].astype(str).to_numpy(), "Motivo": motivi[~validi]})
+    # Espansione vettoriale degli intervalli: una riga per giorno, ripetendo medico/tipo e sommando gli scostamenti
+    giorni = giorni[validi]; totale = int(giorni.sum())
+    scostamenti = np.arange(totale) - np.repeat(np.cumsum(giorni) - giorni, giorni)
+    date_giorni = pd.DatetimeIndex(np.repeat(dal[validi].to_numpy(), giorni) + scostamenti.astype('timedelta64[D]'))
+    espanse = pd.DataFrame({"medico": np.repeat(medico[validi].to_numpy(), giorni), "data": date_giorni.strftime('%Y-%m-%d'), "tipo": np.repeat(tipo[validi].to_numpy(), giorni),
+                            "anno": date_giorni.year, "mese": date_giorni.month}).drop_duplicates(["medico", "data"], keep="last")
+    celle_per_file = {nome_file_assenze(anno, mese): dict(zip(zip(gruppo["medico"], gruppo["data"]), gruppo["tipo"])) for (anno, mese), gruppo in espanse.groupby(["anno", "mese"])}
+    logger.info(f"Import assenze: {len(df)} righe, {len(scarti)} scartate, {len(espanse)} giorni in {len(celle_per_file)} file.")
+    return celle_per_file, scarti
+
+@monitor_performance("Importazione Assenze GitHub")
+def importa_assenze_github(celle_per_file, max_tentativi=3):
+    """
+    Applica le celle importate all'ultima versione di ogni file mensile (letti in parallelo) e salva tutti i file con un
+    unico commit batch; se un file cambia nel frattempo rilegge e riprova. Restituisce `{path: nuovo_sha}`. Eseguita da `github_scheduler`.
+    """
+    for tentativo in range(max_tentativi):
+        with ThreadPoolExecutor(max_workers=app_config.get('GITHUB_WORKERS'), thread_name_prefix="import-assenze") as pool:
+            remoti = dict(zip(celle_per_file, pool.map(lambda path: opera_su_file_json_github(path, operazione="carica"), celle_per_file)))
+        file_da_salvare = {path: applica_modifiche_assenze(remoti[path][0], *periodo_file_assenze(path), celle) for path, celle in celle_per_file.items()}
+        try: return salva_file_batch_github(file_da_salvare, sha_attesi={path: sha for path, (_, sha) in remoti.items()},
+                                            messaggio=f"Importazione assenze: {sum(len(c) for c in celle_per_file.values())} giorni in {len(file_da_salvare)} file")
+        except GitHubConflitto as e_conflitto:
+            if tentativo == max_tentativi - 1: raise
+            logger.warning(f"Importazione assenze: {e_conflitto}, rileggo e riprovo.")
+
+# --- SALVATAGGIO AUTOMATICO ASSENZE (journal locale + write-behind) ---
+class AutosaveQueue:
+    """
+    Coda write-behind per le modifiche alle assenze. Ogni modifica di cella viene prima scritta in un journal JSONL
+    append-only (sopravvive a chiusura della scheda e riavvii), poi un thread di processo le raggruppa per file mensile
+    e, trascorso il debounce senza nuove modifiche, le applica sull'ultima versione su GitHub con un solo commit.
+    Gli errori transitori vengono ritentati; uno permanente (permessi, branch, file corrotto) blocca il file finché l'utente
+    non chiede di riprovare: le modifiche restano in coda e nel journal.
+    """
+    def __init__(self, journal_path, debounce_secondi):
+        self.journal_path = journal_path; self.debounce = debounce_secondi; self._lock = threading.RLock(); self._evento = threading.Event()
+        self._pendenti = {} # path -> {(medico, data_iso): (tipo, seq)}
+        self._periodo = {}; self._ultima_modifica = {}; self._riprova_dopo = {}; self._seq = 0; self.bloccati = {} # path -> errore permanente
+        self.sha_salvati = {}; self.ultimo_flush = None; self.ultimo_errore = None
+        self._ripristina_journal()
+        threading.Thread(target=self._ciclo, name="autosave-assenze", daemon=True).start()
+    def _ripristina_journal(self):
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f: righe = [json.loads(r) for r in f if r.strip()]
+        except FileNotFoundError: return
+        except (OSError, ValueError) as e: logger.error(f"Journal autosave '{self.journal_path}' illeggibile: {e}"); return
+        salvati_fino_a = {}
+        for riga in righe:
+            if "flush" in riga: salvati_fino_a[riga["flush"]] = max(salvati_fino_a.get(riga["flush"], 0), riga["seq"])
+            self._seq = max(self._seq, riga["seq"])
+        for riga in righe:
+            if "flush" in riga or riga["seq"] <= salvati_fino_a.get(riga["path"], 0): continue
+            self._pendenti.setdefault(riga["path"], {})[(riga["medico"], riga["data"])] = (riga["tipo"], riga["seq"])
+            self._periodo[riga["path"]] = (riga["anno"], riga["mese"]); self._ultima_modifica[riga["path"]] = 0.0
+        if self._pendenti: logger.info(f"Journal autosave: {self.in_attesa()} modifiche non salvate ripristinate ({', '.join(self._pendenti)}).")
+    def _scrivi_journal(self, riga):
+        with open(self.journal_path, 'a', encoding='utf-8') as f: f.write(json.dumps(riga, ensure_ascii=False, separators=(',', ':')) + "\n"); f.flush(); os.fsync(f.fileno())
+    def accoda(self, path, anno, mese, medico, data_iso, tipo):
+        with self._lock:
+            self._seq += 1
+            self._scrivi_journal({"seq": self._seq, "ts": time.time(), "path": path, "anno": anno, "mese": mese, "medico": medico, "data": data_iso, "tipo": tipo})
+            self._pendenti.setdefault(path, {})[(medico, data_iso)] = (tipo, self._seq)
+            self._periodo[path] = (anno, mese); self._ultima_modifica[path] = time.monotonic()
+        self._evento.set()
+    def modifiche_in_attesa(self, path):
+        with self._lock: return {k: tipo for k, (tipo, _) in self._pendenti.get(path, {}).items()}
+    def in_attesa(self):
+        with self._lock: return sum(len(m) for m in self._pendenti.values())
+    def sblocca(self):
+        """Rimette in coda i file bloccati da un errore permanente (es. dopo aver corretto permessi o file su GitHub)."""
+        with self._lock: self.bloccati.clear(); self._riprova_dopo.clear()
+        self._evento.set()
+    @staticmethod
+    def errore_ritentabile(e):
+        """Rete, 5xx, rate limit e SHA superato da un altro salvataggio (il flush successivo rilegge la versione remota)."""
+        if isinstance(e, requests.exceptions.HTTPError): return e.response is not None and (github_client.e_ritentabile(e.response) or e.response.status_code in (409, 422))
+        return isinstance(e, (requests.exceptions.RequestException, GitHubConflitto))
+    def _ciclo(self):
+        while True:
+            self._evento.wait(timeout=1.0); self._evento.clear()
+            try: self._flush_scaduti()
+            except Exception as e: logger.error(f"Errore inatteso nel thread autosave: {e}", exc_info=True)
+    def _flush_scaduti(self):
+        adesso = time.monotonic()
+        with self._lock:
+            scaduti = [p for p, m in self._pendenti.items() if m and p not in self.bloccati and adesso - self._ultima_modifica[p] >= self.debounce and adesso >= self._riprova_dopo.get(p, 0)]
+            snapshot = {p: (self._periodo[p], {k: tipo for k, (tipo, _) in self._pendenti[p].items()}, max(seq for _, seq in self._pendenti[p].values())) for p in scaduti}
+        if not snapshot: return
+        try: nuovi_sha = self._scrivi(snapshot)
+        except GitHubBudgetEsaurito as e:
+            with self._lock: self._riprova_dopo.update({p: adesso + e.retry_after for p in snapshot})
+            return
+        except Exception as e:
+            if not self.errore_ritentabile(e):
+                logger.error(f"Salvataggio automatico di {list(snapshot)} fallito con errore permanente, sospeso: {e}")
+                with self._lock: self.bloccati.update({p: str(e) for p in snapshot})
+                return
+            self.ultimo_errore = str(e); logger.error(f"Salvataggio automatico di {list(snapshot)} fallito, riprovo: {e}")
+            attesa = max(app_config.get('RETRY_DELAY_SECONDS') * 4, github_client.secondi_prima_di_riprovare(getattr(e, 'response', None), 0)) # Retry-After, se indicato
+            with self._lock: self._riprova_dopo.update({p: adesso + attesa for p in snapshot})
+            return
+        with self._lock:
+            for path, (_, _, seq_max) in snapshot.items():
+                self._pendenti[path] = {k: v for k, v in self._pendenti[path].items() if v[1] > seq_max} # conserva le modifiche arrivate durante il flush
+                self._scrivi_journal({"flush": path, "seq": seq_max}); self._riprova_dopo.pop(path, None)
+            self.sha_salvati.update(nuovi_sha); self.ultimo_flush = datetime.now(); self.ultimo_errore = None
+            if not any(self._pendenti.values()): open(self.journal_path, 'w').close() # tutto salvato: journal compattato
+    def _scrivi(self, snapshot):
+        file_da_salvare = {}; sha_attesi = {}
+        for path, ((anno, mese), modifiche, _) in snapshot.items():
+            dati_remoti, sha_remoto = opera_su_file_json_github(path, operazione="carica") # ETag: di norma un 304 dalla cache
+            file_da_salvare[path] = applica_modifiche_assenze(dati_remoti, anno, mese, modifiche); sha_attesi[path] = sha_remoto
+        n_modifiche = sum(len(m) for _, m, _ in snapshot.values())
+        if len(file_da_salvare) == 1:
+            path, dati = next(iter(file_da_salvare.items()))
+            successo, nuovo_sha = opera_su_file_json_github(path, dati, sha_attesi[path], operazione="salva")
+            if not successo: raise RuntimeError(f"Salvataggio automatico '{path}' non riuscito.")
+            nuovi_sha = {path: nuovo_sha}
+        else: nuovi_sha = salva_file_batch_github(file_da_salvare, sha_attesi=sha_attesi, messaggio=f"Salvataggio automatico assenze ({n_modifiche} modifiche) - {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+        logger.info(f"Salvataggio automatico: {n_modifiche} modifiche in {len(nuovi_sha)} file."); return nuovi_sha
+
+@st.cache_resource
+def get_autosave_queue(): return AutosaveQueue(AUTOSAVE_JOURNAL_FILE, app_config.get('AUTOSAVE_DEBOUNCE_SECONDI'))
+
+autosave_queue = get_autosave_queue()
+
+@st.fragment(run_every=2.0)
+def monitora_autosave():
+    in_attesa = autosave_queue.in_attesa()
+    if in_attesa: st.caption(f"💾 {in_attesa} modifiche in attesa di salvataggio automatico...")
+    elif autosave_queue.ultimo_flush: st.caption(f"💾 Tutto salvato ({autosave_queue.ultimo_flush.strftime('%H:%M:%S')}).")
+    if autosave_queue.ultimo_errore: st.caption(f"⚠️ Ultimo tentativo fallito, riprovo: {autosave_queue.ultimo_errore}")
+    if autosave_queue.bloccati:
+        st.error("❌ Salvataggio automatico sospeso, le modifiche restano in coda:\n" + "\n".join(f"- {path}: {errore}" for path, errore in autosave_queue.bloccati.items()))
+        if st.button("🔁 Riprova il salvataggio automatico", key="btn_sblocca_autosave"): autosave_queue.sblocca()
+
+# --- DIAGNOSTICA (metriche di processo: pagina ?pagina=diagnostica e file Prometheus) ---
+def metriche_di_stato():
+    """Valori istantanei di cache, budget GitHub e autosave, aggiunti come gauge all'export Prometheus."""
+    stat_cache = github_cache.statistiche(); stato_limiter = github_client.limiter.stato()
+    extra = {"cache_github_hit_rate": round(stat_cache["hit_rate"], 4), "cache_github_voci": stat_cache["voci"], "cache_github_byte": stat_cache["bytes"],
+             "cache_github_evictions": stat_cache["evictions"], "snapshot_versioni": stat_cache["versioni"], "snapshot_blob": stat_cache["blob"], "snapshot_in_memoria": stat_cache["in_memoria"], "github_budget_token_locali": round(stato_limiter["tokens"], 1), "autosave_modifiche_in_attesa": autosave_queue.in_attesa()}
+    if stato_limiter["remaining_server"] is not None: extra["github_rate_limit_remaining"] = stato_limiter["remaining_server"]
+    return extra
+
+@st.cache_resource(show_spinner=False)
+def _stato_file_metriche(): return threading.Lock(), [0.0] # Lock e ora dell'ultima scrittura, condivisi dalle sessioni
+
+_lock_file_metriche, _ultima_scrittura_metriche = _stato_file_metriche()
+
+def chiudi_rerun_metriche():
+    """Fine rerun: chiamate/tempo GitHub del rerun e memoria della sessione nel registro; file Prometheus aggiornato al più ogni METRICHE_INTERVALLO_SECONDI."""
+    ctx = get_script_run_ctx()
+    if ctx is None or ctx.fragment_ids_this_run or rerun_registrato[0]: return # I rerun dei soli frammenti non sono rerun completi
+    rerun_registrato[0] = True
+    metriche.chiudi_rerun(ctx.session_id, time.perf_counter() - inizio_rerun, sum(stima_memoria(v) for v in st.session_state.to_dict().values()))
+    with _lock_file_metriche:
+        if time.time() - _ultima_scrittura_metriche[0] < app_config.get('METRICHE_INTERVALLO_SECONDI'): return
+        _ultima_scrittura_metriche[0] = time.time()
+    metriche.scrivi_prometheus(app_config.get('METRICHE_FILE'), metriche_di_stato())
+
+def rilancia_script():
+    """`st.rerun()` che prima chiude le metriche del rerun: l'eccezione di controllo salterebbe la chiamata a fine script."""
+    chiudi_rerun_metriche(); st.rerun()
+def ferma_script(): chiudi_rerun_metriche(); st.stop()
+
+def pagina_diagnostica():
+    st.title("🩺 Diagnostica prestazioni")
+    st.caption(f"Metriche del processo (tutte le sessioni) dall'avvio di {timedelta(seconds=int(time.time() - metriche.avvio))} fa. "
+               f"Export Prometheus: `{app_config.get('METRICHE_FILE')}`.")
+    riepilogo = metriche.riepilogo_campioni().set_index("Serie"); contatori = metriche.contatori(); sessioni = metriche.sessioni()
+    richieste_github = sum(v for (nome, _), v in contatori.items() if nome == "github_richieste_totali")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Richieste GitHub", richieste_github)
+    col2.metric("Dati GitHub ricevuti/inviati", f"{contatori.get(('github_byte_ricevuti_totali', ()), 0) / 1024:.0f} / {contatori.get(('github_byte_inviati_totali', ()), 0) / 1024:.0f} KB")
+    col3.metric("Sessioni attive", len(sessioni))
+    col4.metric("Hit rate cache GitHub", f"{github_cache.statistiche()['hit_rate']:.0%}")
+
+    st.subheader("Dove va il tempo di un rerun")
+    per_rerun = riepilogo.reindex(["Rerun completo", "Tempo GitHub per rerun", "Chiamate GitHub per rerun"])[["Chiamate", "Media", "p50", "p95", "p99", "Max"]]
+    st.dataframe(per_rerun.rename(columns={"Chiamate": "Rerun"}), width='stretch')
+    st.caption("Tempo GitHub alto rispetto al rerun completo: lentezza di rete/API; basso: pandas e Streamlit (vedi le funzioni sotto).")
+
+    st.subheader("Latenze per funzione e richiesta GitHub (s)")
+    funzioni = riepilogo.drop(index=["Rerun completo", "Tempo GitHub per rerun", "Chiamate GitHub per rerun"], errors="ignore").sort_values("p95", ascending=False)
+    st.dataframe(funzioni, width='stretch', column_config={c: st.column_config.NumberColumn(format="%.4f") for c in ["Totale", "Media", "p50", "p95", "p99", "Max"]})
+
+    col_sx, col_dx = st.columns(2)
+    with col_sx:
+        st.subheader("Cache")
+        righe_cache = [{"Cache": nome, "Hit": hit, "Miss": miss, "Hit rate": hit / (hit + miss) if hit + miss else 0.0} for nome, (hit, miss) in sorted(metriche.tasso_hit_cache().items())]
+        stat_cache = github_cache.statistiche(); righe_cache.append({"Cache": "contenuti GitHub (ETag/SHA)", "Hit": stat_cache["hits"], "Miss": stat_cache["misses"], "Hit rate": stat_cache["hit_rate"]})
+        st.dataframe(pd.DataFrame(righe_cache), hide_index=True, width='stretch', column_config={"Hit rate": st.column_config.NumberColumn(format="percent")})
+        st.subheader("Richieste GitHub")
+        st.dataframe(pd.DataFrame([{**dict(etichette), "Richieste": v} for (nome, etichette), v in contatori.items() if nome == "github_richieste_totali"]), hide_index=True, width='stretch')
+    with col_dx:
+        st.subheader("Memoria per sessione")
+        sessione_corrente = get_script_run_ctx().session_id
+        st.dataframe(pd.DataFrame([{"Sessione": sid[:8] + (" (questa)" if sid == sessione_corrente else ""), "Memoria (KB)": v["memoria"] / 1024,
+                                    "Ultimo rerun": datetime.fromtimestamp(v["aggiornata"]).strftime('%H:%M:%S')} for sid, v in sessioni.items()]), hide_index=True, width='stretch')
+        st.subheader("Stato")
+        st.json(metriche_di_stato())
+    st.subheader("Archivio snapshot locale")
+    stat_cache = github_cache.statistiche()
+    st.caption(f"{stat_cache['versioni']} versioni di {len(github_cache.percorsi())} file in {stat_cache['blob']} blob ({stat_cache['bytes'] / 1024:.0f} KB compressi), "
+               f"{stat_cache['evictions']} rimosse per limite di spazio, {stat_cache['in_memoria']} decodificate in memoria. Cartella: `{app_config.get('SNAPSHOT_DIR')}`.")
+    if path_storico := st.selectbox("Storico versioni del file", github_cache.percorsi(), index=None, placeholder="Scegli un file..."):
+        st.dataframe(github_cache.storico(path_storico), hide_index=True, width='stretch')
+    st.download_button("⬇️ Metriche Prometheus", metriche.testo_prometheus(metriche_di_stato()), file_name="medical_shifts_metrics.prom", mime="text/plain")
+
+if st.query_params.get("pagina") == "diagnostica":
+    token_diagnostica = app_config.get('DIAGNOSTICA_TOKEN')
+    if not token_diagnostica: st.error("🔒 Diagnostica disattivata: impostare DIAGNOSTICA_TOKEN nelle secrets per abilitarla."); ferma_script()
+    if not hmac.compare_digest(st.query_params.get("token", "").encode(), str(token_diagnostica).encode()): st.error("🔒 Accesso alla diagnostica non autorizzato."); ferma_script()
+    pagina_diagnostica(); ferma_script()
+
+# --- FUNZIONI CALENDARIO (scheletro per periodo condiviso dal processo, colonne medico agganciate a parte) ---
+def anni_selezionabili(): oggi = date.today(); return list(range(oggi.year - 1, oggi.year + 3)) # Range anni più contenuto
+
+def mesi_del_periodo(anno, mese, n_mesi):
+    """Tupla di `n_mesi` mesi consecutivi `(anno, mese)` a partire da `anno`/`mese`, anche a cavallo d'anno."""
+    return tuple(((anno * 12 + mese - 1 + i) // 12, (mese - 1 + i) % 12 + 1) for i in range(n_mesi))
+
+@st.cache_resource(show_spinner=False)
+def festivita_anni(anni: tuple):
+    """Festività italiane di tutti gli `anni`, calcolate una volta per processo: nome della festività indicizzato per data."""
+    try: festivita = holidays.country_holidays("IT", years=list(anni))
+    except Exception as e_hol: logger.warning(f"Festività {anni} non disponibili: {e_hol}"); festivita = {}
+    return pd.Series(list(festivita.values()), index=pd.DatetimeIndex(list(festivita.keys())), dtype=object).sort_index()
+
+@misura_cache("scheletro_calendario")
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+@monitor_performance("Scheletro Calendario (Cached)")
+def scheletro_calendario(mesi: tuple):
+    """Colonne non-medico (data, giorno, festivo, nome festivo) dei mesi consecutivi `mesi`: dipendono solo dal periodo."""
+    (anno_inizio, mese_inizio), (anno_fine, mese_fine) = mesi[0], mesi[-1]
+    date_range_pd = pd.date_range(start=datetime(anno_inizio, mese_inizio, 1), end=datetime(anno_fine, mese_fine, calendar.monthrange(anno_fine, mese_fine)[1]), freq='D')
+    anni = tuple(sorted(set(anni_selezionabili()) | set(range(anno_inizio, anno_fine + 1)))) # Di norma la stessa chiave per ogni periodo
+    nomi_festivi = festivita_anni(anni).reindex(date_range_pd)
+    logger.info(f"Scheletro calendario {mese_inizio}/{anno_inizio}-{mese_fine}/{anno_fine} creato: {len(date_range_pd)} gg.")
+    return pd.DataFrame({COL_DATA: date_range_pd, COL_GIORNO: date_range_pd.strftime("%A"),
+                         COL_FESTIVO: nomi_festivi.notna().to_numpy(), COL_NOME_FESTIVO: nomi_festivi.fillna("").to_numpy()})
 
-# --- FUNZIONI CALENDARIO --- (come prima, omesse per brevità)
-@st.cache_data(ttl=3600, show_spinner="Generazione calendario...")
-@monitor_performance("Generazione Calendario (Cached)")
-def genera_calendario_cached(anno: int, mese: int, medici_tuple_sorted: tuple): # Accetta tupla ordinata
-    try:
-        medici_list = list(medici_tuple_sorted)
-        logger.info(f"Cache miss o uso diretto: Genero calendario {mese}/{anno}, {len(medici_list)} medici")
-        return genera_struttura_calendario(anno, mese, medici_list)
-    except Exception as e: logger.error(f"Errore gen. calendario (cached): {e}", exc_info=True); st.error(f"Impossibile generare calendario: {e}"); return pd.DataFrame()
 @monitor_performance("Creazione Struttura Calendario")
-def genera_struttura_calendario(anno, mese, medici_selezionati):
+def genera_struttura_calendario(mesi, medici_selezionati):
+    """Calendario dei `mesi` con una colonna 'Presente' per medico, agganciata allo scheletro del periodo in cache."""
     try:
-        start_date = datetime(anno, mese, 1); _, ultimo_giorno = calendar.monthrange(anno, mese); end_date = datetime(anno, mese, ultimo_giorno)
-        date_range_pd = pd.date_range(start=start_date, end=end_date, freq='D')
-        try: festivita_anno = holidays.country_holidays("IT", years=anno)
-        except Exception as e_hol: logger.warning(f"Festività {anno} non disponibili: {e_hol}"); st.sidebar.caption(f"⚠️ Festività {anno} non caricate."); festivita_anno = {}
-        df_cols = {COL_DATA: date_range_pd, COL_GIORNO: [d.strftime("%A") for d in date_range_pd],
-                   COL_FESTIVO: [d.date() in festivita_anno for d in date_range_pd], # Mantenuto per logica futura se serve
-                   COL_NOME_FESTIVO: [festivita_anno.get(d.date(), "") for d in date_range_pd]} # Mantenuto per logica futura
-        for medico in medici_selezionati: df_cols[medico] = "Presente" # Default per assenze
-        df = pd.DataFrame(df_cols); logger.info(f"Calendario {mese}/{anno} creato: {len(df)} gg, {len(medici_selezionati)} medici."); return df
+        df_scheletro = scheletro_calendario(tuple(mesi))
+        return calendario_con_codici(df_scheletro, medici_selezionati, np.zeros((len(df_scheletro), len(medici_selezionati)), dtype=np.int8)) # Default "Presente"
     except Exception as e: logger.error(f"Errore grave gen. struttura calendario: {e}", exc_info=True); st.error(f"Errore critico gen. calendario: {e}"); return pd.DataFrame()
+
+# --- MATRICE ASSENZE (codici categoriali giorni × medici) ---
+def calendario_con_codici(df_calendario, medici, codici):
+    """Calendario (sole colonne non-medico di `df_calendario`) con una colonna Categorical per medico dai codici `codici[giorno, medico]`."""
+    colonne_medici = {medico: pd.Categorical.from_codes(codici[:, j], dtype=TIPO_ASSENZA_DTYPE) for j, medico in enumerate(medici)}
+    return pd.concat([df_calendario[[c for c in COLONNE_CALENDARIO if c in df_calendario.columns]].reset_index(drop=True),
+                      pd.DataFrame(colonne_medici, index=pd.RangeIndex(len(df_calendario)))], axis=1)
+
+def codici_assenze(df, medici):
+    """Matrice int8 giorni × medici dei codici in TIPI_ASSENZA (-1 per valori non validi); accetta colonne Categorical o stringa."""
+    if not medici: return np.zeros((len(df), 0), dtype=np.int8)
+    return np.column_stack([df[medico].astype(TIPO_ASSENZA_DTYPE).cat.codes.to_numpy() for medico in medici])
+
+def celle_modificate(df_prima, df_dopo, medici):
+    """Confronto vettoriale delle matrici di codici: array (righe, colonne) delle celle valide cambiate in `df_dopo`."""
+    codici_prima = codici_assenze(df_prima, medici); codici_dopo = codici_assenze(df_dopo, medici)
+    return np.nonzero((codici_prima != codici_dopo) & (codici_dopo >= 0))
+
+def applica_assenze_a_calendario(df_calendario, dati_mese):
+    """Calendario con le colonne medico riempite dalle assenze di `dati_mese` (default 'Presente'), con indicizzazione vettoriale."""
+    medici = [c for c in df_calendario.columns if c not in COLONNE_CALENDARIO]
+    codici = np.zeros((len(df_calendario), len(medici)), dtype=np.int8)
+    celle = celle_assenze(dati_mese)
+    if celle and medici:
+        (medici_celle, date_celle), tipi_celle = zip(*celle.keys()), celle.values()
+        righe = pd.DatetimeIndex(df_calendario[COL_DATA]).get_indexer(pd.to_datetime(list(date_celle)))
+        colonne = pd.Index(medici).get_indexer(list(medici_celle)); valori = TIPO_ASSENZA_DTYPE.categories.get_indexer(list(tipi_celle))
+        validi = (righe >= 0) & (colonne >= 0) & (valori >= 0)
+        codici[righe[validi], colonne[validi]] = valori[validi]
+    return calendario_con_codici(df_calendario, medici, codici)
+
+def righe_del_mese(df_calendario, anno, mese):
+    date_calendario = pd.DatetimeIndex(df_calendario[COL_DATA]); return (date_calendario.year == anno) & (date_calendario.month == mese)
+
+def sostituisci_mese_in_calendario(df_calendario, anno, mese, dati_mese):
+    """Calendario (anche di più mesi) con le sole righe di `anno`/`mese` riscritte dalle assenze di `dati_mese`."""
+    medici = [c for c in df_calendario.columns if c not in COLONNE_CALENDARIO]; nel_mese = righe_del_mese(df_calendario, anno, mese)
+    codici = codici_assenze(df_calendario, medici)
+    codici[nel_mese] = codici_assenze(applica_assenze_a_calendario(df_calendario[nel_mese], dati_mese), medici)
+    return calendario_con_codici(df_calendario, medici, codici)
+
+def nome_file_assenze(anno, mese): return f"{ASSENZE_FILE_PREFIX}_{anno}_{mese:02}.json"
+
+@monitor_performance("Caricamento Assenze Mese")
+def carica_assenze_mese(anno, mese):
+    """
+    (dati, sha) del file assenze salvato per il mese, (None, None) se non esiste. Se la sessione ha verificato il file
+    da meno di ASSENZE_REVALIDA_SECONDI risponde dalla cache locale senza rete. Oltre, se il file è in cache risponde
+    comunque da lì (stale-while-revalidate: `avvia_precaricamento_assenze` lo rivalida in background e
+    `applica_esito_precaricamento` aggiorna il mese se è cambiato); solo un file assente dalla cache richiede una GET subito;
+    La GET è un solo tentativo: se GitHub non risponde si usa l'ultima versione nota nell'archivio snapshot e il mese, non
+    verificato, viene riletto con retry da `avvia_precaricamento_assenze` nello stesso rerun (esito applicato ai successivi).
+    """
+    path = nome_file_assenze(anno, mese); verifiche = SessionManager.get_safe('assenze_verificate', {})
+    in_cache = github_cache.leggi(chiave_cache_github(path))
+    if time.time() - verifiche.get(path, 0) < app_config.get('ASSENZE_REVALIDA_SECONDI'):
+        if not SessionManager.get_safe('sha_assenze', {}).get(path): return None, None # verificato di recente: non esiste
+        if in_cache is not None: return in_cache
+    elif in_cache is not None: return in_cache
+    try: dati_mese, sha_mese = opera_su_file_json_github(path, operazione="carica")
+    except requests.exceptions.RequestException as e: # GitHub non raggiungibile: ultima versione nota, riletta in background dal precaricamento
+        snapshot = github_cache.ultima_versione(chiave_cache_github(path))
+        if snapshot is None: raise
+        logger.warning(f"'{path}' dall'archivio snapshot locale (GitHub non raggiungibile: {e})."); return snapshot
+    verifiche[path] = time.time(); SessionManager.set_safe('assenze_verificate', verifiche)
+    return dati_mese, sha_mese
+
+@monitor_performance("Precaricamento Assenze")
+def precarica_file_assenze(paths):
+    """
+    ({path: (dati, sha)}, {path: messaggio}): file letti in parallelo con richieste condizionali (un file invariato costa un 304)
+    e file corrotti, che non fermano la lettura degli altri. Eseguita da `github_scheduler`.
+    """
+    def leggi(path):
+        try: return opera_su_file_json_github(path, operazione="carica"), None
+        except FileJsonCorrotto as e: return None, str(e)
+    with ThreadPoolExecutor(max_workers=len(paths), thread_name_prefix="precarica-assenze") as pool: esiti = dict(zip(paths, pool.map(leggi, paths)))
+    return {path: letto for path, (letto, errore) in esiti.items() if errore is None}, {path: errore for path, (_, errore) in esiti.items() if errore is not None}
+
+def avvia_precaricamento_assenze(mesi):
+    """Rivalida in background i mesi mostrati e precarica il precedente e il successivo, se la sessione non li ha verificati di recente."""
+    if operazione_in_corso('precarica_assenze') or time.time() < SessionManager.get_safe('precaricamento_sospeso_fino', 0): return
+    verifiche = SessionManager.get_safe('assenze_verificate', {}); (anno_inizio, mese_inizio) = mesi[0]
+    paths = [nome_file_assenze(anno, mese) for anno, mese in mesi_del_periodo(anno_inizio, mese_inizio - 1, len(mesi) + 2)]
+    paths = [path for path in paths if time.time() - verifiche.get(path, 0) >= app_config.get('ASSENZE_REVALIDA_SECONDI')]
+    if paths: avvia_operazione_github('precarica_assenze', "precarica_assenze", f"Aggiornamento assenze da GitHub ({len(paths)} mesi)", precarica_file_assenze, paths, contesto={'avviata': time.time()})
+
+def mese_modificato_localmente(df_calendario, anno, mese, medici):
+    """True se le celle del mese nel calendario differiscono dalla versione base della sessione o hanno salvataggi automatici in attesa."""
+    path = nome_file_assenze(anno, mese)
+    if autosave_queue.modifiche_in_attesa(path): return True
+    celle_base = {chiave: tipo for chiave, tipo in celle_assenze(SessionManager.get_safe('base_assenze', {}).get(path)).items() if chiave[0] in medici}
+    return celle_da_calendario(df_calendario[righe_del_mese(df_calendario, anno, mese)], medici) != celle_base
+
+def applica_esito_precaricamento(op):
+    """
+    File verificati per la sessione e, per i mesi mostrati cambiati su GitHub, righe del calendario sostituite dalla nuova versione.
+    Un mese con modifiche locali resta com'è: al salvataggio lo SHA della sessione porta al merge a tre vie con la versione remota.
+    Un file corrotto viene segnalato e lascia invariati dati e SHA della sessione.
+    """
+    if op.stato == "fallita":
+        logger.warning(f"Precaricamento assenze non riuscito: {op.errore}"); SessionManager.set_safe('precaricamento_sospeso_fino', time.time() + app_config.get('ASSENZE_REVALIDA_SECONDI'))
+        st.caption(f"⚠️ Assenze mostrate dalla copia locale: aggiornamento da GitHub non riuscito ({op.errore})."); return
+    verifiche = SessionManager.get_safe('assenze_verificate', {}); sha_sessione = SessionManager.get_safe('sha_assenze', {}); basi = SessionManager.get_safe('base_assenze', {})
+    df_turni = SessionManager.get_safe('df_turni'); medici = SessionManager.get_safe('medici_pianificati', [])
+    mesi_mostrati = {nome_file_assenze(anno, mese): (anno, mese) for anno, mese in SessionManager.get_safe('mesi_periodo') or ()}
+    letti, corrotti = op.risultato
+    for path, messaggio in corrotti.items():
+        verifiche[path] = op.contesto['avviata']; st.error(f"❌ {messaggio} Le assenze del mese restano quelle della copia locale.")
+    for path, (dati, sha) in letti.items():
+        verifiche[path] = op.contesto['avviata']
+        if path not in mesi_mostrati or df_turni is None or df_turni.empty: sha_sessione[path] = sha; basi[path] = dati; continue
+        if sha == sha_sessione.get(path): continue
+        anno, mese = mesi_mostrati[path]
+        if mese_modificato_localmente(df_turni, anno, mese, medici):
+            st.info(f"🔀 '{path}' è cambiato su GitHub: le tue modifiche saranno unite alla nuova versione al salvataggio."); continue
+        df_turni = sostituisci_mese_in_calendario(df_turni, anno, mese, dati); sha_sessione[path] = sha; basi[path] = dati
+        logger.info(f"Assenze di '{path}' aggiornate dalla rivalidazione in background. SHA: {str(sha)[:7]}...")
+    SessionManager.set_safe('assenze_verificate', verifiche); SessionManager.set_safe('df_turni', df_turni)
+
+@misura_cache("calendario_con_assenze")
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False)
+@monitor_performance("Calendario con Assenze (Cached)")
+def calendario_con_assenze_cached(anno: int, mese: int, medici_tuple_sorted: tuple, sha_assenze, _dati_mese):
+    """Calendario del mese con le assenze salvate già applicate; memorizzato per SHA del file (i dati non entrano nella chiave)."""
+    df_base = genera_struttura_calendario(((anno, mese),), list(medici_tuple_sorted))
+    return applica_assenze_a_calendario(df_base, _dati_mese) if sha_assenze and not df_base.empty else df_base
+
 @monitor_performance("Aggiornamento Calendario")
-def aggiorna_calendario_se_necessario(anno, mese, medici_pianificati_lista):
+def aggiorna_calendario_se_necessario(mesi, medici_pianificati_lista):
     try:
         medici_set_frozen = frozenset(medici_pianificati_lista) # frozenset è hashable
-        current_key = f"{anno}-{mese}-{hash(medici_set_frozen)}"
+        current_key = f"{'_'.join(f'{anno}-{mese}' for anno, mese in mesi)}-{hash(medici_set_frozen)}"
         if (SessionManager.get_safe('last_calendar_key') != current_key or SessionManager.get_safe('df_turni') is None):
-            if medici_pianificati_lista: SessionManager.set_safe('df_turni', genera_calendario_cached(anno, mese, tuple(sorted(list(set(medici_pianificati_lista))))))
+            if medici_pianificati_lista:
+                medici_tuple = tuple(sorted(list(set(medici_pianificati_lista)))); parti = []
+                for anno, mese in mesi: # Ogni mese dal proprio file (e dalla propria cache per SHA), poi un unico calendario
+                    path_mese = nome_file_assenze(anno, mese)
+                    try:
+                        dati_mese, sha_mese = carica_assenze_mese(anno, mese)
+                        SessionManager.get_safe('sha_assenze', {})[path_mese] = sha_mese; SessionManager.get_safe('base_assenze', {})[path_mese] = dati_mese
+                    except requests.exceptions.RequestException as e_load:
+                        logger.warning(f"Assenze salvate di {path_mese} non caricate: {e_load}"); st.warning(f"⚠️ Impossibile caricare le assenze già salvate per {mese}/{anno}: il modulo parte vuoto e si aggiorna appena GitHub risponde.")
+                        dati_mese, sha_mese = None, None
+                    except FileJsonCorrotto as e_corrotto: st.error(f"❌ {e_corrotto} Il modulo di {mese}/{anno} parte vuoto."); dati_mese, sha_mese = None, None
+                    df_mese = calendario_con_assenze_cached(anno, mese, medici_tuple, sha_mese, dati_mese)
+                    modifiche_pendenti = autosave_queue.modifiche_in_attesa(path_mese) # modifiche non ancora salvate in background
+                    if modifiche_pendenti: df_mese = applica_assenze_a_calendario(df_mese, applica_modifiche_assenze(dati_mese, anno, mese, modifiche_pendenti))
+                    parti.append(df_mese)
+                SessionManager.set_safe('df_turni', pd.concat(parti, ignore_index=True) if len(parti) > 1 else parti[0])
             else: SessionManager.set_safe('df_turni', pd.DataFrame())
             SessionManager.set_safe('last_calendar_key', current_key)
     except Exception as e: logger.error(f"Errore critico aggiornamento calendario: {e}", exc_info=True); st.error(f"Impossibile aggiornare calendario: {e}"); SessionManager.set_safe('df_turni', pd.DataFrame())
 
+# --- OPERAZIONI GITHUB IN BACKGROUND (avanzamento e applicazione risultati) ---
+def avvia_operazione_github(chiave, tipo, descrizione, funzione, *args, contesto=None):
+    operazioni = SessionManager.get_safe('operazioni_github', {})
+    operazioni[chiave] = github_scheduler.sottometti(tipo, descrizione, funzione, *args, contesto=contesto)
+    SessionManager.set_safe('operazioni_github', operazioni)
+def operazione_in_corso(chiave):
+    op = SessionManager.get_safe('operazioni_github', {}).get(chiave); return op is not None and not op.conclusa
+def raccogli_operazione_conclusa(chiave):
+    """Rimuove e restituisce l'operazione `chiave` se conclusa (il chiamante ne applica l'esito), altrimenti None."""
+    operazioni = SessionManager.get_safe('operazioni_github', {}); op = operazioni.get(chiave)
+    if op is None or not op.conclusa: return None
+    operazioni.pop(chiave); SessionManager.set_safe('operazioni_github', operazioni); return op
+
+@st.fragment(run_every=1.0)
+def monitora_operazioni_github():
+    """Aggiorna solo questo frammento ogni secondo finché ci sono operazioni in corso; a conclusione rilancia lo script."""
+    operazioni = SessionManager.get_safe('operazioni_github', {}); calcolo = SessionManager.get_safe('pianificazione')
+    if any(op.conclusa for op in operazioni.values()) or (calcolo is not None and (calcolo['future'].done() or pianificazione_scaduta(calcolo))): rilancia_script()
+    for op in operazioni.values(): st.caption(f"⏳ {op.descrizione}: {op.messaggio}")
+    if calcolo is not None: st.caption(f"⏳ Pianificazione turni: calcolo in corso da {time.time() - calcolo['avviata']:.0f}s...")
+
+def applica_esito_salvataggio_medici(op):
+    ctx = op.contesto
+    if op.stato == "fallita": mostra_errore_salvataggio_medici(op.errore); return
+    nuovo_sha, elenco_salvato = op.risultato
+    if not nuovo_sha: st.sidebar.error(f"❌ Salvataggio elenco medici non riuscito."); return
+    SessionManager.set_safe('sha_medici', nuovo_sha); SessionManager.set_safe('elenco_medici_completo', elenco_salvato)
+    if elenco_salvato != ctx['elenco']: st.sidebar.info("🔀 Elenco medici aggiornato anche da un altro utente: modifiche unite.")
+    if ctx['azione'] == 'aggiungi': st.toast(f"Medico '{ctx['medico']}' aggiunto!", icon="✅"); logger.info(f"Medico aggiunto GitHub: {ctx['medico']}"); return
+    if ctx['azione'] == 'multipla':
+        st.toast(f"Elenco medici aggiornato: {len(ctx['aggiunti'])} aggiunti, {len(ctx['rimossi'])} rimossi.", icon="✅")
+        logger.info(f"Modifica multipla medici GitHub: aggiunti {ctx['aggiunti']}, rimossi {ctx['rimossi']}")
+        for chiave in ("txt_medici_multipli", "multi_rimuovi_medici"): st.session_state.pop(chiave, None) # Form svuotato solo a salvataggio riuscito
+        if not ctx['rimossi']: return
+        rimossi = set(ctx['rimossi'])
+    else: st.toast(f"Medico '{ctx['medico']}' rimosso.", icon="🗑️"); logger.info(f"Medico rimosso GitHub: {ctx['medico']}"); rimossi = {ctx['medico']}
+    SessionManager.clear_calendar_related_state()
+    current_medici_pianificati = SessionManager.get_safe('medici_pianificati', [])
+    if rimossi & set(current_medici_pianificati): SessionManager.set_safe('medici_pianificati', [m for m in current_medici_pianificati if m not in rimossi])
+    SessionManager.set_safe("medico_da_rimuovere_selection", ctx['opzione_vuota'])
+
+def applica_esito_caricamento_medici(op):
+    """Sostituisce l'elenco mostrato all'avvio (ultima versione nell'archivio snapshot o vuoto) con quello letto da GitHub in background."""
+    da_archivio = SessionManager.get_safe('medici_da_archivio', False); SessionManager.set_safe('medici_da_archivio', False)
+    if op.stato == "fallita":
+        errore = op.errore
+        if isinstance(errore, requests.exceptions.HTTPError) and errore.response is not None and errore.response.status_code == 404:
+            st.sidebar.warning(f"File medici non trovato su GitHub."); logger.info("File medici 404, init vuoto."); SessionManager.set_safe('sha_medici', None); elenco = []
+        else:
+            if isinstance(errore, requests.exceptions.HTTPError): logger.error(f"Errore HTTP GitHub ({errore.response.status_code}) caricamento medici."); st.sidebar.error("⚠️ Errore GitHub caricamento medici.")
+            elif isinstance(errore, requests.exceptions.RequestException): logger.error(f"Errore rete GitHub ({errore})."); st.sidebar.error("⚠️ Errore rete caricamento medici.")
+            else: logger.error(f"Errore imprevisto caricamento medici: {errore}"); st.sidebar.error(f"⚠️ Errore: {errore}")
+            if da_archivio: st.sidebar.warning("Medici dall'archivio locale (ultima versione nota).")
+            else: st.sidebar.error("Impossibile caricare medici.")
+            return
+    else:
+        elenco, sha = op.risultato; SessionManager.set_safe('sha_medici', sha)
+    precedente = SessionManager.get_safe('elenco_medici_completo', [])
+    if elenco == precedente: return
+    SessionManager.set_safe('elenco_medici_completo', elenco)
+    if da_archivio: st.toast("Elenco medici aggiornato da GitHub.", icon="🔄")
+    # La selezione predefinita (tutti i medici) segue il nuovo elenco; una selezione dell'utente perde solo i medici rimossi
+    pianificati = st.session_state.get("multi_medici_pianif", SessionManager.get_safe('medici_pianificati', []))
+    nuovi_pianificati = elenco[:] if not pianificati or set(pianificati) == set(precedente) else [m for m in pianificati if m in elenco]
+    SessionManager.set_safe('medici_pianificati', nuovi_pianificati); st.session_state.pop("multi_medici_pianif", None) # il multiselect riparte dal default
+    if SessionManager.get_safe('mesi_periodo'): aggiorna_calendario_se_necessario(SessionManager.get_safe('mesi_periodo'), nuovi_pianificati)
+
+def applica_esito_importazione(op):
+    if op.stato == "fallita": st.error(f"❌ Importazione assenze non riuscita: {op.errore}"); return
+    st.toast(f"Importazione completata: {len(op.risultato)} file aggiornati con un solo commit.", icon="📥")
+    verifiche = SessionManager.get_safe('assenze_verificate', {})
+    for path in op.risultato: verifiche.pop(path, None) # il calendario li rilegge dalla cache, già aggiornata dal batch
+    SessionManager.clear_calendar_related_state()
+
+# --- PIANIFICAZIONE TURNI (motore in pianificatore_turni.py, eseguito in un processo separato) ---
+@st.cache_resource(show_spinner=False)
+def get_executor_pianificazione():
+    """Un calcolo alla volta per tutte le sessioni: il thread attende il processo di `pianifica_in_processo`."""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="pianificazione")
+
+def pianifica_in_processo(assenti, festivi, regole, iniziale):
+    """
+    `pianificatore_turni.pianifica` in un interprete nuovo che esegue solo `pianificatore_turni.py` (argomenti e risultato via
+    pickle su stdin/stdout): niente reimportazione dello script dell'app nel figlio, e oltre PIANIFICAZIONE_TIMEOUT_SECONDI
+    il processo viene terminato con `kill()`.
+    """
+    timeout = app_config.get('PIANIFICAZIONE_TIMEOUT_SECONDI')
+    processo = subprocess.Popen([sys.executable, os.path.abspath(pianificatore_turni.__file__)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try: uscita, errori = processo.communicate(pickle.dumps((assenti, festivi, regole, iniziale)), timeout=timeout)
+    except subprocess.TimeoutExpired: processo.kill(); processo.communicate(); raise TimeoutError(f"nessun risultato entro {timeout:.0f} secondi, processo di calcolo terminato")
+    if processo.returncode != 0: raise RuntimeError((errori.decode(errors="replace").strip().splitlines() or [f"processo di calcolo uscito con codice {processo.returncode}"])[-1])
+    return pickle.loads(uscita)
+
+def avvia_pianificazione(assenti, festivi, regole, iniziale, contesto):
+    """Sottomette il calcolo al processo di pianificazione e ne conserva il Future nella sessione (interrogato da `monitora_operazioni_github`)."""
+    future = get_executor_pianificazione().submit(pianifica_in_processo, assenti, festivi, regole, iniziale)
+    SessionManager.set_safe('pianificazione', {'future': future, 'avviata': time.time(), 'contesto': contesto})
+    logger.info(f"Pianificazione turni avviata: {assenti.shape[1]} medici, {assenti.shape[0]} giorni, warm start {iniziale is not None}.")
+
+def pianificazione_in_corso(): return SessionManager.get_safe('pianificazione') is not None
+def pianificazione_scaduta(calcolo): return time.time() - calcolo['avviata'] > app_config.get('PIANIFICAZIONE_TIMEOUT_SECONDI')
+
+def raccogli_pianificazione_conclusa():
+    """Rimuove e restituisce il calcolo turni della sessione se concluso o scaduto (il chiamante ne applica l'esito), altrimenti None."""
+    calcolo = SessionManager.get_safe('pianificazione')
+    if calcolo is None or not (calcolo['future'].done() or pianificazione_scaduta(calcolo)): return None
+    SessionManager.set_safe('pianificazione', None); return calcolo
+
+def dati_pianificazione(df_calendario, medici):
+    """(assenti, festivi, date ISO) del calendario: assente ogni cella diversa da 'Presente', festivi anche sabato e domenica."""
+    date_calendario = pd.DatetimeIndex(df_calendario[COL_DATA])
+    festivi = df_calendario[COL_FESTIVO].to_numpy(dtype=bool) | (date_calendario.dayofweek >= 5)
+    return codici_assenze(df_calendario, medici) != 0, festivi, list(date_calendario.strftime('%Y-%m-%d'))
+
+def allinea_piano_turni(piano, medici, date_iso):
+    """Turni di `piano` riallineati su medici e giorni indicati (False per medici o giorni non pianificati); None senza piano."""
+    if not piano: return None
+    righe = pd.Index(piano["date"]).get_indexer(date_iso); colonne = pd.Index(piano["medici"]).get_indexer(medici)
+    turni = np.zeros((len(date_iso), len(medici)), dtype=bool); righe_ok = righe >= 0; colonne_ok = colonne >= 0
+    turni[np.ix_(righe_ok, colonne_ok)] = piano["turni"][np.ix_(righe[righe_ok], colonne[colonne_ok])]
+    return turni
+
+def applica_esito_pianificazione(calcolo):
+    future = calcolo['future']; contesto = calcolo['contesto']; durata = time.time() - calcolo['avviata']
+    if not future.done():
+        future.cancel(); logger.error(f"Pianificazione turni oltre {app_config.get('PIANIFICAZIONE_TIMEOUT_SECONDI'):.0f}s: risultato scartato.") # Se il calcolo è partito, il suo processo termina allo stesso timeout
+        st.error(f"❌ Pianificazione turni interrotta: nessun risultato entro {app_config.get('PIANIFICAZIONE_TIMEOUT_SECONDI'):.0f} secondi."); return
+    if future.exception() is not None:
+        logger.error(f"Pianificazione turni non riuscita: {future.exception()!r}"); st.error(f"❌ Pianificazione turni non riuscita: {future.exception()}"); return
+    risultato = future.result(); statistiche = risultato["statistiche"]
+    metriche.osserva("Pianificazione Turni", durata); metriche.osserva("Pianificazione turni: solver", statistiche["secondi_totali"]); metriche.osserva("Pianificazione turni: ricerca locale", statistiche["secondi_ricerca"])
+    metriche.incrementa("pianificazioni_totali", warm_start=str(statistiche["warm_start"]).lower(), scoperture=str(statistiche["scoperture"] > 0).lower())
+    piani = SessionManager.get_safe('piani_turni', {}); piani[contesto['chiave']] = {**risultato, "medici": contesto['medici'], "date": contesto['date'], "festivi": contesto['festivi']}
+    SessionManager.set_safe('piani_turni', piani)
+    st.toast(f"Turni pianificati in {statistiche['secondi_totali']:.2f}s" + (f", {statistiche['scoperture']} turni scoperti." if statistiche['scoperture'] else "."), icon="🧩")
+
+# --- AVVIO (stale-while-revalidate): elenco medici dall'archivio snapshot, verifica GitHub ed elenco aggiornato in background ---
+if not SessionManager.get_safe('github_connection_checked'):
+    SessionManager.set_safe('github_connection_checked', True)
+    avvia_operazione_github('verifica_github', "verifica_github", "Verifica connessione GitHub", verifica_connessione_github)
+    avvia_operazione_github('carica_medici', "carica_medici", "Aggiornamento elenco medici da GitHub", carica_medici_da_github)
+    snapshot_medici = github_cache.ultima_versione(chiave_cache_github(app_config.get('FILE_PATH_MEDICI')))
+    if snapshot_medici and not SessionManager.get_safe('elenco_medici_completo'):
+        SessionManager.set_safe('elenco_medici_completo', list(snapshot_medici[0])); SessionManager.set_safe('medici_da_archivio', True)
+
 # --- UI SIDEBAR (Gestione Medici, Selezione Periodo) --- (come prima, omesse per brevità)
 st.sidebar.title("🗓️ Gestione Turni")
 st.sidebar.markdown("App per la pianificazione dei turni medici.")
 st.sidebar.divider(); st.sidebar.header("👨‍⚕️ Medici")
+op_verifica = raccogli_operazione_conclusa('verifica_github')
+if op_verifica is not None and op_verifica.risultato: st.sidebar.error("⚠️ **Problemi Connessione GitHub:**"); [st.sidebar.error(f"  • {issue}") for issue in op_verifica.risultato]
+op_carica_medici = raccogli_operazione_conclusa('carica_medici')
+if op_carica_medici is not None: applica_esito_caricamento_medici(op_carica_medici)
+op_medici = raccogli_operazione_conclusa('salva_medici')
+if op_medici is not None: applica_esito_salvataggio_medici(op_medici)
+salvataggio_medici_in_corso = operazione_in_corso('salva_medici') or operazione_in_corso('carica_medici') # Niente modifiche all'elenco prima di avere lo SHA di GitHub
+if operazione_in_corso('carica_medici'):
+    st.sidebar.caption("⏳ Elenco dall'archivio locale, aggiornamento da GitHub in corso..." if SessionManager.get_safe('medici_da_archivio') else "⏳ Caricamento elenco medici da GitHub...")
 with st.sidebar.form("form_aggiungi_medico", clear_on_submit=True):
     nuovo_medico_input = st.text_input("➕ Nome nuovo medico (es. Rossi Mario)").strip()
-    submitted_add = st.form_submit_button("Aggiungi Medico", type="primary")
+    consenti_simile = st.checkbox("Aggiungi anche se simile a un medico già presente", key="chk_consenti_simile")
+    submitted_add = st.form_submit_button("Aggiungi Medico", type="primary", disabled=salvataggio_medici_in_corso)
 if submitted_add and nuovo_medico_input:
-    valido, msg_o_nome_norm = valida_nome_medico_v2(nuovo_medico_input, SessionManager.get_safe('elenco_medici_completo', []))
+    valido, msg_o_nome_norm = valida_nome_medico_v2(nuovo_medico_input, SessionManager.get_safe('elenco_medici_completo', []), consenti_simile)
     if not valido: st.sidebar.error(msg_o_nome_norm)
     else:
         elenco_aggiornato = SessionManager.get_safe('elenco_medici_completo', []) + [msg_o_nome_norm]; elenco_aggiornato.sort()
-        with st.spinner("Salvataggio medico..."):
-            try:
-                if salva_medici_su_github(elenco_aggiornato, SessionManager.get_safe("sha_medici")):
-                    SessionManager.set_safe('elenco_medici_completo', elenco_aggiornato)
-                    st.toast(f"Medico '{msg_o_nome_norm}' aggiunto!", icon="✅"); logger.info(f"Medico aggiunto GitHub: {msg_o_nome_norm}"); st.rerun()
-            except Exception as e_save: logger.error(f"Eccezione salvataggio medico: {e_save}", exc_info=True); st.sidebar.error(f"❌ Errore critico salvataggio: {e_save}")
+        avvia_operazione_github('salva_medici', "salva_medici", f"Salvataggio medico '{msg_o_nome_norm}'", salva_medici_su_github, elenco_aggiornato, SessionManager.get_safe("sha_medici"), SessionManager.get_safe('elenco_medici_completo', []),
+                                contesto={'azione': 'aggiungi', 'medico': msg_o_nome_norm, 'elenco': elenco_aggiornato})
+        salvataggio_medici_in_corso = True
 elenco_medici_corrente = SessionManager.get_safe('elenco_medici_completo', [])
+elenco_medici_ordinato = sorted(set(elenco_medici_corrente)) # Opzioni condivise da rimozione e pianificazione
+opzione_nessuna_rimozione = "--- Seleziona per rimuovere ---" # Voce iniziale del selettore, ripristinata dopo ogni salvataggio dell'elenco
 if elenco_medici_corrente:
-    options_rimuovi = ["--- Seleziona per rimuovere ---"] + sorted(list(set(elenco_medici_corrente)))
+    options_rimuovi = [opzione_nessuna_rimozione] + elenco_medici_ordinato
     current_sel_rimuovi = SessionManager.get_safe("medico_da_rimuovere_selection", options_rimuovi[0])
     try: default_idx_rimuovi = options_rimuovi.index(current_sel_rimuovi)
     except ValueError: default_idx_rimuovi = 0
     medico_da_rimuovere = st.sidebar.selectbox("🗑️ Rimuovi medico", options_rimuovi, index=default_idx_rimuovi, key="sel_rimuovi_medico")
     SessionManager.set_safe("medico_da_rimuovere_selection", medico_da_rimuovere)
-    if medico_da_rimuovere != options_rimuovi[0] and st.sidebar.button("Conferma Rimozione", key="btn_rimuovi_medico", type="secondary"):
+    if medico_da_rimuovere != options_rimuovi[0] and st.sidebar.button("Conferma Rimozione", key="btn_rimuovi_medico", type="secondary", disabled=salvataggio_medici_in_corso):
         medici_temp = elenco_medici_corrente.copy(); medici_temp.remove(medico_da_rimuovere)
-        with st.spinner(f"Rimozione '{medico_da_rimuovere}'..."):
-            try:
-                if salva_medici_su_github(medici_temp, SessionManager.get_safe("sha_medici")):
-                    SessionManager.set_safe('elenco_medici_completo', medici_temp)
-                    st.toast(f"Medico '{medico_da_rimuovere}' rimosso.", icon="🗑️"); logger.info(f"Medico rimosso GitHub: {medico_da_rimuovere}")
-                    SessionManager.clear_calendar_related_state()
-                    current_medici_pianificati = SessionManager.get_safe('medici_pianificati', [])
-                    if medico_da_rimuovere in current_medici_pianificati: current_medici_pianificati.remove(medico_da_rimuovere); SessionManager.set_safe('medici_pianificati', current_medici_pianificati)
-                    SessionManager.set_safe("medico_da_rimuovere_selection", options_rimuovi[0]); st.rerun()
-            except Exception as e_remove: logger.error(f"Eccezione rimozione medico: {e_remove}", exc_info=True); st.sidebar.error(f"❌ Errore critico rimozione: {e_remove}")
+        avvia_operazione_github('salva_medici', "salva_medici", f"Rimozione '{medico_da_rimuovere}'", salva_medici_su_github, medici_temp, SessionManager.get_safe("sha_medici"), elenco_medici_corrente,
+                                contesto={'azione': 'rimuovi', 'medico': medico_da_rimuovere, 'elenco': medici_temp, 'opzione_vuota': opzione_nessuna_rimozione})
 else: st.sidebar.caption("Nessun medico nell'elenco.")
+with st.sidebar.expander("👥 Modifiche multiple all'elenco"):
+    with st.form("form_medici_multipli"):
+        testo_aggiunte = st.text_area("Nuovi medici (uno per riga)", height=150, key="txt_medici_multipli")
+        rimozioni_multiple = st.multiselect("Medici da rimuovere", elenco_medici_ordinato, key="multi_rimuovi_medici")
+        consenti_simili_multipli = st.checkbox("Consenti nomi simili a medici già presenti", key="chk_consenti_simili_multipli")
+        submitted_multipli = st.form_submit_button("Applica con un solo salvataggio", disabled=salvataggio_medici_in_corso)
+    if submitted_multipli:
+        aggiunte = list(dict.fromkeys(riga.strip() for riga in testo_aggiunte.splitlines() if riga.strip()))
+        nuovo_registro, errori_multipli = get_registro_medici(tuple(elenco_medici_corrente)).con_modifiche(aggiunte, rimozioni_multiple, consenti_simili_multipli)
+        if errori_multipli: st.error("Nessuna modifica applicata:\n" + "\n".join(f"- {nome}: {errore}" for nome, errore in errori_multipli.items()))
+        elif not aggiunte and not rimozioni_multiple: st.info("Nessuna modifica da applicare.")
+        else:
+            presenti = set(elenco_medici_corrente); aggiunti = [m for m in nuovo_registro.medici if m not in presenti]
+            avvia_operazione_github('salva_medici', "salva_medici", f"Modifica multipla medici (+{len(aggiunti)} / -{len(rimozioni_multiple)})", salva_medici_su_github, nuovo_registro.medici, SessionManager.get_safe("sha_medici"), elenco_medici_corrente,
+                                    contesto={'azione': 'multipla', 'aggiunti': aggiunti, 'rimossi': list(rimozioni_multiple), 'elenco': nuovo_registro.medici, 'opzione_vuota': opzione_nessuna_rimozione})
 st.sidebar.divider(); st.sidebar.header("🎯 Pianificazione")
 default_medici_pianif = SessionManager.get_safe('medici_pianificati', [])
 valid_default_medici = [m for m in default_medici_pianif if m in elenco_medici_corrente]
 if not valid_default_medici and elenco_medici_corrente: valid_default_medici = elenco_medici_corrente[:]
-medici_pianificati = st.sidebar.multiselect("👨‍⚕️ Medici per input assenze:", options=sorted(list(set(elenco_medici_corrente))), default=valid_default_medici, key="multi_medici_pianif", help="Seleziona medici per cui inserire le assenze.")
+medici_pianificati = st.sidebar.multiselect("👨‍⚕️ Medici per input assenze:", options=elenco_medici_ordinato, default=valid_default_medici, key="multi_medici_pianif", help="Seleziona medici per cui inserire le assenze.")
 st.sidebar.header("🗓️ Periodo Assenze")
-oggi = datetime.today(); anni_disponibili = list(range(oggi.year - 1, oggi.year + 3)) # Range anni più contenuto
+oggi = datetime.today(); anni_disponibili = anni_selezionabili()
 idx_mese_default = SessionManager.get_safe('selected_mese_index', oggi.month - 1); idx_mese_default = oggi.month - 1 if not 0 <= idx_mese_default < 12 else idx_mese_default
 # Trova l'indice di oggi.year o il più vicino se non presente
 try: idx_anno_default = anni_disponibili.index(SessionManager.get_safe('selected_anno_val', oggi.year))
@@ -409,34 +1729,54 @@ idx_anno_default = anni_disponibili.index(oggi.year) if not 0 <= idx_anno_defaul
 col1_sb, col2_sb = st.sidebar.columns(2); lista_mesi = list(range(1, 13))
 selected_mese = col1_sb.selectbox("Mese:", lista_mesi, index=idx_mese_default, format_func=lambda x: calendar.month_name[x], key="sel_mese")
 selected_anno = col2_sb.selectbox("Anno:", anni_disponibili, index=idx_anno_default, key="sel_anno")
+vista_periodo = st.sidebar.radio("Vista:", ["Mese", "Trimestre", "Più mesi"], horizontal=True, key="sel_vista", help="Trimestre: quello che contiene il mese scelto. Più mesi: a partire dal mese scelto.")
+if vista_periodo == "Trimestre": mesi_periodo = mesi_del_periodo(selected_anno, (selected_mese - 1) // 3 * 3 + 1, 3)
+elif vista_periodo == "Più mesi": mesi_periodo = mesi_del_periodo(selected_anno, selected_mese, st.sidebar.number_input("Numero di mesi:", min_value=2, max_value=12, value=2, key="sel_n_mesi"))
+else: mesi_periodo = ((selected_anno, selected_mese),)
+autosave_attivo = st.sidebar.toggle("💾 Salvataggio automatico", key="autosave_attivo", help="Salva le modifiche alle assenze su GitHub in background, raggruppandole per mese.")
+if autosave_attivo or autosave_queue.in_attesa():
+    with st.sidebar: monitora_autosave()
 
 # --- LOGICA DI AGGIORNAMENTO PRINCIPALE (PERIODO E MEDICI) ---
+op_import = raccogli_operazione_conclusa('importa_assenze')
+if op_import is not None: applica_esito_importazione(op_import)
+op_precarica = raccogli_operazione_conclusa('precarica_assenze')
+if op_precarica is not None: applica_esito_precaricamento(op_precarica)
+calcolo_pianificazione = raccogli_pianificazione_conclusa()
+if calcolo_pianificazione is not None: applica_esito_pianificazione(calcolo_pianificazione)
 if SessionManager.get_safe('medici_pianificati', []) != medici_pianificati:
     SessionManager.set_safe('medici_pianificati', medici_pianificati)
-    aggiorna_calendario_se_necessario(selected_anno, selected_mese, medici_pianificati) 
-if (SessionManager.get_safe('selected_mese_val') != selected_mese or SessionManager.get_safe('selected_anno_val') != selected_anno):
-    SessionManager.set_safe('selected_mese_val',selected_mese); SessionManager.set_safe('selected_anno_val',selected_anno)
+    aggiorna_calendario_se_necessario(mesi_periodo, medici_pianificati) 
+if (SessionManager.get_safe('selected_mese_val') != selected_mese or SessionManager.get_safe('selected_anno_val') != selected_anno or SessionManager.get_safe('mesi_periodo') != mesi_periodo):
+    SessionManager.set_safe('selected_mese_val',selected_mese); SessionManager.set_safe('selected_anno_val',selected_anno); SessionManager.set_safe('mesi_periodo', mesi_periodo)
     SessionManager.set_safe('selected_mese_index', lista_mesi.index(selected_mese)); SessionManager.set_safe('selected_anno_index', anni_disponibili.index(selected_anno))
-    aggiorna_calendario_se_necessario(selected_anno, selected_mese, medici_pianificati)
+    aggiorna_calendario_se_necessario(mesi_periodo, medici_pianificati)
 elif SessionManager.get_safe('df_turni') is None:
-     aggiorna_calendario_se_necessario(selected_anno, selected_mese, medici_pianificati)
-nome_mese_corrente = calendar.month_name[selected_mese]
+     aggiorna_calendario_se_necessario(mesi_periodo, medici_pianificati)
+avvia_precaricamento_assenze(mesi_periodo)
+(anno_inizio, mese_inizio), (anno_fine, mese_fine) = mesi_periodo[0], mesi_periodo[-1]
+descrizione_periodo = f"{calendar.month_name[mese_inizio]} {anno_inizio}" + (f" – {calendar.month_name[mese_fine]} {anno_fine}" if len(mesi_periodo) > 1 else "")
 
-# --- AREA PRINCIPALE ---
-st.title(f"📝 Input Assenze Medici")
-st.markdown(f"### Periodo: {nome_mese_corrente} {selected_anno}")
-df_turni_corrente = SessionManager.get_safe('df_turni')
-
-if not medici_pianificati: st.info("👈 **Nessun medico selezionato.** Scegli dalla sidebar.")
-elif df_turni_corrente is None or df_turni_corrente.empty:
-    st.warning("📅 Il modulo per l'input delle assenze è vuoto. Verifica selezioni o ricarica."); logger.warning(f"df_turni vuoto/None per input. Medici: {len(medici_pianificati)}.")
-else:
+# --- AREA PRINCIPALE (editor, salvataggio e consultazione come frammenti: un'interazione rilancia solo il proprio pannello) ---
+@st.fragment
+def pannello_editor_assenze(mesi, medici_pianificati):
+    df_turni_corrente = SessionManager.get_safe('df_turni')
     st.markdown("#### 🗓️ **Inserisci le assenze per ciascun medico selezionato:**")
-    cols_per_editor = [COL_DATA, COL_GIORNO] + medici_pianificati # Giorno per contesto
+    medici_editor = medici_pianificati
+    if len(medici_pianificati) > app_config.get('MEDICI_PER_PAGINA'): # Roster grandi: al browser va solo un blocco alfabetico di medici
+        col_filtro, col_pagina = st.columns([1, 2])
+        filtro_medici = col_filtro.text_input("🔎 Filtra medici", key="editor_filtro_medici").strip().lower()
+        medici_filtrati = [m for m in sorted(medici_pianificati) if filtro_medici in m.lower()]
+        pagine_medici = [medici_filtrati[i:i + app_config.get('MEDICI_PER_PAGINA')] for i in range(0, len(medici_filtrati), app_config.get('MEDICI_PER_PAGINA'))]
+        if not pagine_medici: st.info(f"Nessun medico selezionato corrisponde a '{filtro_medici}'."); return
+        indice_pagina = col_pagina.selectbox("Medici:", range(len(pagine_medici)), format_func=lambda i: f"{pagine_medici[i][0]} – {pagine_medici[i][-1]} ({len(pagine_medici[i])})", key="editor_pagina_medici")
+        medici_editor = pagine_medici[min(indice_pagina, len(pagine_medici) - 1)]
+        st.caption(f"Mostrati {len(medici_editor)} di {len(medici_pianificati)} medici: le modifiche restano nel calendario completo anche cambiando blocco.")
+    cols_per_editor = [COL_DATA, COL_GIORNO] + medici_editor # Giorno per contesto
     column_config_editor = {
         COL_DATA: st.column_config.DateColumn("Data", format="DD/MM/YYYY", disabled=True, width="small"),
         COL_GIORNO: st.column_config.TextColumn("Giorno", disabled=True, width="small")}
-    for medico in medici_pianificati:
+    for medico in medici_editor:
         nome_cognome = medico.split(); nome_display = nome_cognome[-1].capitalize() if len(nome_cognome) > 1 else medico.capitalize()
         column_config_editor[medico] = st.column_config.SelectboxColumn(f"Dr. {nome_display}", help=f"Assenza per {medico}", options=TIPI_ASSENZA, required=True, width="medium")
     
@@ -447,74 +1787,230 @@ else:
         st.error(f"Errore interno: colonne {missing_cols} non trovate per editor.")
     else:
         df_editor_input = df_turni_corrente[cols_per_editor].copy()
-        editor_key = f"data_editor_assenze_{SessionManager.get_safe('last_calendar_key', 'default_key')}"
+        editor_key = f"data_editor_assenze_{SessionManager.get_safe('last_calendar_key', 'default_key')}_{hash(tuple(medici_editor))}" # Uno stato widget per blocco
         try:
-            edited_df_assenze = st.data_editor(df_editor_input, column_config=column_config_editor, use_container_width=True,
+            edited_df_assenze = st.data_editor(df_editor_input, column_config=column_config_editor, width="stretch",
                                              hide_index=True, num_rows="fixed", key=editor_key, 
-                                             height=(len(df_editor_input) + 1) * ROW_HEIGHT_PX + TABLE_PADDING_PX)
-            modifiche_editor = False
-            for medico_col in medici_pianificati:
-                if df_turni_corrente[medico_col].dtype == edited_df_assenze[medico_col].dtype and not df_turni_corrente[medico_col].equals(edited_df_assenze[medico_col]):
-                    # Aggiorna direttamente il DataFrame in session_state
-                    SessionManager.get_safe('df_turni')[medico_col] = edited_df_assenze[medico_col].copy(); modifiche_editor = True
+                                             height=(min(len(df_editor_input), RIGHE_EDITOR_VISIBILI) + 1) * ROW_HEIGHT_PX + TABLE_PADDING_PX)
+            righe_mod, colonne_mod = celle_modificate(df_turni_corrente, edited_df_assenze, medici_editor)
+            modifiche_editor = len(righe_mod) > 0
+            if modifiche_editor:
+                if SessionManager.get_safe('autosave_attivo', False):
+                    date_mod = pd.DatetimeIndex(edited_df_assenze[COL_DATA]); date_mod_iso = date_mod.strftime('%Y-%m-%d')
+                    for r, j in zip(righe_mod, colonne_mod): # Ogni cella va nel file del proprio mese (viste di più mesi)
+                        anno_cella, mese_cella = int(date_mod.year[r]), int(date_mod.month[r])
+                        autosave_queue.accoda(nome_file_assenze(anno_cella, mese_cella), anno_cella, mese_cella, medici_editor[j], date_mod_iso[r], str(edited_df_assenze[medici_editor[j]].iloc[r]))
+                # Aggiorna direttamente il DataFrame completo in session_state, solo nelle colonne cambiate
+                for j in np.unique(colonne_mod):
+                    SessionManager.get_safe('df_turni')[medici_editor[j]] = pd.Categorical(edited_df_assenze[medici_editor[j]], dtype=TIPO_ASSENZA_DTYPE)
             if modifiche_editor: st.toast("Modifiche alle assenze registrate localmente.", icon="📝"); logger.info("Assenze modificate e aggiornate in session_state.")
         except Exception as e_data_editor: logger.error(f"Errore st.data_editor: {e_data_editor}", exc_info=True); st.error("⚠️ Errore editor assenze. Ricarica.")
     
-    st.divider()
+
+@st.fragment
+def pannello_salvataggio_assenze(mesi, medici_pianificati):
+    df_turni_corrente = SessionManager.get_safe('df_turni')
+    file_periodo = {nome_file_assenze(anno, mese): (anno, mese) for anno, mese in mesi} # Un file JSON per mese del periodo
     st.markdown("#### 💾 **Salva Assenze su GitHub**")
-    
-    nome_file_assenze_json = f"{ASSENZE_FILE_PREFIX}_{selected_anno}_{selected_mese:02}.json"
-    path_completo_file_assenze = nome_file_assenze_json # Se vuoi metterlo in una sottocartella, es. "dati_assenze/" + nome_file_assenze_json
+
+    op_assenze = raccogli_operazione_conclusa('salva_assenze')
+    if op_assenze is not None:
+        esiti, conflitto_salvataggio = op_assenze.risultato if op_assenze.stato == "completata" else ({}, None)
+        for path_salvato, (nuovo_sha_assenze, dati_salvati, unito_con_remoto) in esiti.items():
+            if not nuovo_sha_assenze: st.error(f"❌ Impossibile salvare il file '{path_salvato}' su GitHub. Controlla i log."); continue
+            # Aggiorna lo SHA del file delle assenze in session_state
+            sha_assenze_dict = SessionManager.get_safe('sha_assenze', {})
+            sha_assenze_dict[path_salvato] = nuovo_sha_assenze
+            SessionManager.set_safe('sha_assenze', sha_assenze_dict)
+            SessionManager.get_safe('base_assenze', {})[path_salvato] = dati_salvati
+            if unito_con_remoto and path_salvato in file_periodo:
+                df_turni_corrente = sostituisci_mese_in_calendario(df_turni_corrente, *file_periodo[path_salvato], dati_salvati); SessionManager.set_safe('df_turni', df_turni_corrente)
+                st.info(f"🔀 Modifiche di altri utenti a '{path_salvato}' unite automaticamente alle tue.")
+            st.success(f"🎉 File '{path_salvato}' salvato con successo su GitHub!")
+            logger.info(f"File assenze '{path_salvato}' salvato su GitHub. Nuovo SHA: {nuovo_sha_assenze[:7]}...")
+        if conflitto_salvataggio is not None: SessionManager.set_safe('conflitto_assenze', conflitto_salvataggio)
+        if op_assenze.stato == "fallita":
+            logger.error(f"Errore critico durante il salvataggio del JSON delle assenze: {op_assenze.errore}")
+            st.error(f"❌ Errore imprevisto: {op_assenze.errore}")
+
+    conflitto = SessionManager.get_safe('conflitto_assenze')
+    if conflitto is not None and conflitto.path in file_periodo:
+        anno_conflitto, mese_conflitto = file_periodo[conflitto.path]
+        st.warning(f"⚠️ {len(conflitto.conflitti)} celle di '{conflitto.path}' sono state modificate anche da un altro utente. Tutte le altre modifiche sono state unite: scegli quale versione tenere per queste.")
+        st.dataframe(pd.DataFrame([{"Medico": medico, "Data": data_iso, "Versione iniziale": base, "Tua versione": locale, "Versione su GitHub": remoto}
+                                   for (medico, data_iso), (base, locale, remoto) in sorted(conflitto.conflitti.items())]), hide_index=True)
+        col_mie, col_remote = st.columns(2)
+        scelta_mie = col_mie.button("Mantieni le mie", key="btn_conflitto_mie", disabled=operazione_in_corso('salva_assenze'))
+        scelta_remote = col_remote.button("Usa versione GitHub", key="btn_conflitto_remote", disabled=operazione_in_corso('salva_assenze'))
+        if scelta_mie or scelta_remote:
+            celle_risolte = dict(conflitto.celle_unite) # contiene già le versioni locali delle celle in conflitto
+            if scelta_remote:
+                for chiave, (_, _, remoto) in conflitto.conflitti.items():
+                    if remoto == "Presente": celle_risolte.pop(chiave, None)
+                    else: celle_risolte[chiave] = remoto
+            dati_risolti = applica_modifiche_assenze(None, anno_conflitto, mese_conflitto, celle_risolte)
+            SessionManager.set_safe('conflitto_assenze', None)
+            avvia_operazione_github('salva_assenze', "salva_assenze", f"Salvataggio '{conflitto.path}' (conflitti risolti)", salva_assenze_periodo,
+                                    {conflitto.path: (dati_risolti, conflitto.sha_remoto, conflitto.dati_remoti)}, None, contesto={'path': conflitto.path})
+            SessionManager.set_safe('df_turni', sostituisci_mese_in_calendario(df_turni_corrente, anno_conflitto, mese_conflitto, dati_risolti)); rilancia_script()
 
     # Bottone per salvare il JSON su GitHub
-    if st.button(f"📤 Salva {nome_file_assenze_json} su GitHub", key="btn_salva_json_github", type="primary", help="Salva le assenze correnti come file JSON nel repository GitHub."):
+    etichetta_file = next(iter(file_periodo)) if len(file_periodo) == 1 else f"{len(file_periodo)} file assenze"
+    if st.button(f"📤 Salva {etichetta_file} su GitHub", key="btn_salva_json_github", type="primary", help="Salva le assenze correnti come file JSON nel repository GitHub (più mesi: un solo commit).",
+                 disabled=operazione_in_corso('salva_assenze')):
         if df_turni_corrente is not None and not df_turni_corrente.empty:
-            # Prepara i dati per il JSON: un dizionario per medico con le sue assenze
-            dati_json_da_salvare = {"anno": selected_anno, "mese": selected_mese, "medici": {}}
-            df_per_json = df_turni_corrente.copy()
-            df_per_json[COL_DATA] = df_per_json[COL_DATA].dt.strftime('%Y-%m-%d') # Formato data standard per JSON
-
-            for medico in medici_pianificati:
-                # Salva solo i giorni in cui il medico NON è 'Presente' per compattezza
-                assenze_medico = df_per_json[df_per_json[medico] != "Presente"][[COL_DATA, medico]].rename(columns={medico: "tipo_assenza"}).to_dict(orient='records')
-                if assenze_medico: # Solo se ci sono effettive assenze
-                    dati_json_da_salvare["medici"][medico] = assenze_medico
+            # Prepara i dati per il JSON (formato v2) di ogni mese: intervalli di assenza per medico, solo i giorni diversi da 'Presente'
+            salvataggi = {}
+            for path_mese, (anno, mese) in file_periodo.items():
+                base_mese = SessionManager.get_safe('base_assenze', {}).get(path_mese)
+                celle_da_salvare = {chiave: tipo for chiave, tipo in celle_assenze(base_mese).items() if chiave[0] not in medici_pianificati} # Medici non in modifica: restano come salvati
+                celle_da_salvare.update(celle_da_calendario(df_turni_corrente[righe_del_mese(df_turni_corrente, anno, mese)], medici_pianificati))
+                # Lo SHA della versione da cui parte la sessione (in coppia con base_mese): se GitHub o la cache sono andati avanti (altri utenti,
+                # salvataggio automatico, rivalidazione in background) il 409 porta al merge a tre vie invece che a una sovrascrittura
+                sha_mese = SessionManager.get_safe('sha_assenze', {}).get(path_mese) if path_mese in SessionManager.get_safe('base_assenze', {}) else github_cache.sha_noto(chiave_cache_github(path_mese))
+                salvataggi[path_mese] = (codifica_assenze(anno, mese, celle_da_salvare), sha_mese, base_mese)
             
-            if not dati_json_da_salvare["medici"]: # Se nessun medico ha assenze registrate
+            if not any(dati["medici"] for dati, _, _ in salvataggi.values()): # Se nessun medico ha assenze registrate
                  st.info("Nessuna assenza registrata (diversa da 'Presente'). Verrà salvato un file con struttura base.", icon="ℹ️")
                  # Puoi decidere se salvare comunque un file vuoto o meno. Qui lo salvo.
             
-            with st.spinner(f"Controllo e salvataggio di '{path_completo_file_assenze}' su GitHub..."):
-                try:
-                    # 1. Controlla se il file esiste già per ottenere lo SHA
-                    sha_file_assenze_attuale = SessionManager.get_safe('sha_assenze', {}).get(path_completo_file_assenze)
-                    if not sha_file_assenze_attuale: # Se non in sessione, prova a caricarlo da GitHub
-                        _, sha_file_assenze_attuale = opera_su_file_json_github(path_completo_file_assenze, operazione="controlla")
-                    
-                    # 2. Salva il file (crea o aggiorna)
-                    successo_salvataggio, nuovo_sha_assenze = opera_su_file_json_github(
-                        file_path_in_repo=path_completo_file_assenze,
-                        dati_da_salvare=dati_json_da_salvare,
-                        sha_corrente=sha_file_assenze_attuale,
-                        operazione="salva"
-                    )
-                    if successo_salvataggio:
-                        # Aggiorna lo SHA del file delle assenze in session_state
-                        sha_assenze_dict = SessionManager.get_safe('sha_assenze', {})
-                        sha_assenze_dict[path_completo_file_assenze] = nuovo_sha_assenze
-                        SessionManager.set_safe('sha_assenze', sha_assenze_dict)
-                        st.success(f"🎉 File '{path_completo_file_assenze}' salvato con successo su GitHub!")
-                        logger.info(f"File assenze '{path_completo_file_assenze}' salvato su GitHub. Nuovo SHA: {nuovo_sha_assenze[:7]}...")
-                    else:
-                        st.error(f"❌ Impossibile salvare il file '{path_completo_file_assenze}' su GitHub. Controlla i log.")
-                except Exception as e_salva_json:
-                    logger.error(f"Errore critico durante il salvataggio del JSON delle assenze: {e_salva_json}", exc_info=True)
-                    st.error(f"❌ Errore imprevisto: {e_salva_json}")
+            avvia_operazione_github('salva_assenze', "salva_assenze", f"Salvataggio {etichetta_file}", salva_assenze_periodo, salvataggi, list(medici_pianificati), contesto={'path': etichetta_file})
+            rilancia_script() # avanzamento nella sidebar, fuori dal frammento
         else:
             st.warning("Nessun dato di assenze da salvare (calendario vuoto).")
 
+@st.fragment
+def pannello_consultazione_assenze(selected_anno, selected_mese, anni_disponibili):
+    elenco_medici = SessionManager.get_safe('elenco_medici_completo', [])
+    with st.expander("📊 Consultazione assenze su più mesi"):
+        anno_da, anno_a = st.select_slider("Anni", options=anni_disponibili, value=(selected_anno, selected_anno), key="indice_anni")
+        indice_pronto = indice_assenze.copre(anno_da, anno_a)
+        scaduto = time.time() - indice_assenze.ultimo_aggiornamento > app_config.get('ASSENZE_REVALIDA_SECONDI')
+        op_indice = raccogli_operazione_conclusa('indice_assenze') # Rivalidazione in background: l'indice condiviso è già aggiornato
+        if op_indice is not None and op_indice.stato == "fallita":
+            logger.warning(f"Rivalidazione indice assenze non riuscita: {op_indice.errore}"); SessionManager.set_safe('indice_sospeso_fino', time.time() + app_config.get('ASSENZE_REVALIDA_SECONDI'))
+            st.caption(f"⚠️ Assenze dall'ultimo aggiornamento riuscito: rivalidazione da GitHub non riuscita ({op_indice.errore}).")
+        if st.button("🔄 Aggiorna" if indice_pronto else "📥 Carica le assenze degli anni selezionati", key="btn_indice_assenze"):
+            try:
+                with st.spinner("Caricamento assenze..."): indice_assenze.aggiorna(anno_da, anno_a); indice_pronto = True
+            except requests.exceptions.RequestException as e_indice: logger.error(f"Aggiornamento indice assenze fallito: {e_indice}"); st.error(f"❌ Impossibile caricare le assenze: {e_indice}")
+        elif indice_pronto and scaduto and not operazione_in_corso('indice_assenze') and time.time() >= SessionManager.get_safe('indice_sospeso_fino', 0):
+            avvia_operazione_github('indice_assenze', "indice_assenze", f"Rivalidazione assenze {anno_da}-{anno_a}", indice_assenze.aggiorna, anno_da, anno_a)
+        if indice_pronto:
+            indice_assenze.sincronizza_da_cache()
+            tab_data, tab_medico, tab_organico = st.tabs(["Assenti per data", "Riepilogo medico", "Giorni sotto organico"])
+            with tab_data:
+                giorno_default = min(max(date(selected_anno, selected_mese, 1), date(anno_da, 1, 1)), date(anno_a, 12, 31))
+                giorno_scelto = st.date_input("Data", value=giorno_default, min_value=date(anno_da, 1, 1), max_value=date(anno_a, 12, 31), key="indice_data", format="DD/MM/YYYY")
+                assenti = indice_assenze.assenti_il(giorno_scelto)
+                if assenti.empty: st.caption("Nessun medico assente.")
+                else: st.dataframe(assenti, hide_index=True)
+            with tab_medico:
+                if elenco_medici:
+                    col_med, col_anno = st.columns(2)
+                    medico_scelto = col_med.selectbox("Medico", sorted(elenco_medici), key="indice_medico")
+                    anno_scelto = col_anno.selectbox("Anno", list(range(anno_da, anno_a + 1)), index=min(max(selected_anno - anno_da, 0), anno_a - anno_da), key="indice_anno_medico")
+                    for col_metrica, (tipo, giorni) in zip(st.columns(len(TIPI_ASSENZA) - 1), indice_assenze.giorni_per_tipo(medico_scelto, anno_scelto).items()): col_metrica.metric(tipo, int(giorni))
+                else: st.caption("Nessun medico nell'elenco.")
+            with tab_organico:
+                minimo = st.number_input("Medici presenti almeno", min_value=1, max_value=max(len(elenco_medici), 1),
+                                         value=min(app_config.get('MINIMO_MEDICI_PRESENTI'), max(len(elenco_medici), 1)), key="indice_minimo")
+                sotto_organico = indice_assenze.giorni_sotto_organico(elenco_medici, minimo, date(anno_da, 1, 1), date(anno_a, 12, 31))
+                if sotto_organico.empty: st.success("Nessun giorno sotto l'organico minimo.")
+                else: st.dataframe(sotto_organico, hide_index=True, column_config={COL_DATA: st.column_config.DateColumn("Data", format="DD/MM/YYYY")})
+
+@st.fragment
+def pannello_importazione_assenze():
+    with st.expander("📥 Importa assenze da file (CSV/Excel)"):
+        st.caption("Una riga per assenza con le colonne **Medico**, **Dal**, **Al** (facoltativa) e **Tipo** "
+                   f"({', '.join(TIPI_ASSENZA[1:])}; 'Presente' cancella). Date nel formato gg/mm/aaaa o aaaa-mm-gg.")
+        file_import = st.file_uploader("File CSV o XLSX", type=["csv", "xlsx"], key="file_import_assenze")
+        if file_import is None: return
+        elenco_medici = SessionManager.get_safe('elenco_medici_completo', []); chiave_import = (file_import.file_id, tuple(elenco_medici))
+        analisi = SessionManager.get_safe('analisi_import') # Il frammento si riesegue a ogni interazione: il file si analizza una volta sola
+        if analisi is None or analisi[0] != chiave_import:
+            try: analisi = (chiave_import, *leggi_import_assenze(righe_file_import(file_import, file_import.name), elenco_medici))
+            except Exception as e_import: logger.warning(f"File import '{file_import.name}' non valido: {e_import}"); st.error(f"❌ File non leggibile: {e_import}"); return
+            SessionManager.set_safe('analisi_import', analisi)
+        _, celle_per_file, scarti = analisi
+        n_giorni = sum(len(celle) for celle in celle_per_file.values())
+        st.markdown(f"**{n_giorni}** giorni di assenza in **{len(celle_per_file)}** file mensili" + (f": {', '.join(sorted(celle_per_file))}" if celle_per_file else "."))
+        if not scarti.empty: st.warning(f"⚠️ {len(scarti)} righe scartate:"); st.dataframe(scarti, hide_index=True)
+        if st.button("📤 Importa su GitHub", key="btn_importa_assenze", type="primary", disabled=not celle_per_file or operazione_in_corso('importa_assenze')):
+            avvia_operazione_github('importa_assenze', "importa_assenze", f"Importazione {file_import.name} ({n_giorni} giorni)", importa_assenze_github, celle_per_file)
+            rilancia_script() # avanzamento nella sidebar, fuori dal frammento
+
+@st.fragment
+def pannello_pianificazione_turni(mesi, medici_pianificati):
+    with st.expander("🧩 Pianificazione turni"):
+        df_calendario = SessionManager.get_safe('df_turni')
+        if df_calendario is None or df_calendario.empty or not medici_pianificati: st.caption("Seleziona medici e periodo per pianificare i turni."); return
+        st.caption("Un turno al giorno per medico tra i presenti nel calendario (modifiche non salvate comprese): copertura minima, "
+                   "massimo di giorni consecutivi ed equità di turni e weekend/festivi in proporzione ai giorni di presenza.")
+        n_medici = len(medici_pianificati); col_feriale, col_festivo, col_consecutivi, col_peso = st.columns(4)
+        minimo_feriale = col_feriale.number_input("Di turno nei feriali", min_value=0, max_value=n_medici, value=min(app_config.get('MINIMO_MEDICI_PRESENTI'), n_medici), key="pian_minimo_feriale")
+        minimo_festivo = col_festivo.number_input("Di turno weekend/festivi", min_value=0, max_value=n_medici, value=min(1, n_medici), key="pian_minimo_festivo")
+        max_consecutivi = col_consecutivi.number_input("Max giorni consecutivi", min_value=1, max_value=31, value=5, key="pian_max_consecutivi")
+        peso_festivi = col_peso.slider("Peso equità weekend/festivi", min_value=0.0, max_value=5.0, value=2.0, step=0.5, key="pian_peso_festivi")
+        chiave = "_".join(f"{anno}-{mese}" for anno, mese in mesi); piano = SessionManager.get_safe('piani_turni', {}).get(chiave)
+        assenti, festivi, date_iso = dati_pianificazione(df_calendario, medici_pianificati)
+        if st.button("🔁 Ripianifica partendo dal piano attuale" if piano else "⚙️ Genera turni", key="btn_pianifica_turni", type="primary", disabled=pianificazione_in_corso()):
+            regole = pianificatore_turni.RegolePianificazione(minimo_feriale, minimo_festivo, max_consecutivi, peso_festivi, secondi_max=app_config.get('PIANIFICAZIONE_SECONDI_MAX'))
+            avvia_pianificazione(assenti, festivi, regole, allinea_piano_turni(piano, medici_pianificati, date_iso),
+                                 contesto={'chiave': chiave, 'medici': list(medici_pianificati), 'date': date_iso, 'festivi': festivi})
+            rilancia_script() # avanzamento nella sidebar, fuori dal frammento
+        if piano is None: return
+        statistiche = piano["statistiche"]; turni = piano["turni"]; medici_piano = np.array(piano["medici"])
+        in_conflitto = int((allinea_piano_turni(piano, medici_pianificati, date_iso) & assenti).sum())
+        if in_conflitto: st.warning(f"⚠️ {in_conflitto} turni assegnati a medici ora assenti: ripianifica per correggerli (il piano attuale fa da punto di partenza).")
+        col_tempo, col_mosse, col_scoperti, col_cambiate = st.columns(4)
+        col_tempo.metric("Tempo di calcolo", f"{statistiche['secondi_totali']:.2f} s", help=f"Costruzione {statistiche['secondi_costruzione']:.3f} s, ricerca locale {statistiche['secondi_ricerca']:.3f} s ({statistiche['passate']} passate)" + (", interrotta per limite di tempo." if statistiche['interrotta'] else "."))
+        col_mosse.metric("Scambi ricerca locale", statistiche['mosse'])
+        col_scoperti.metric("Turni scoperti", statistiche['scoperture'])
+        col_cambiate.metric("Celle cambiate", statistiche['celle_cambiate'] if statistiche['warm_start'] else "—", help="Rispetto al piano precedente (warm start).")
+        tab_giorni, tab_medici = st.tabs(["Turni per giorno", "Riepilogo per medico"])
+        with tab_giorni:
+            st.dataframe(pd.DataFrame({COL_DATA: pd.to_datetime(piano["date"]), "Di turno": [", ".join(medici_piano[riga]) for riga in turni], "Scoperti": piano["scoperture"]}),
+                         hide_index=True, width='stretch', column_config={COL_DATA: st.column_config.DateColumn("Data", format="DD/MM/YYYY")})
+        with tab_medici:
+            st.dataframe(pd.DataFrame({"Medico": medici_piano, "Turni": turni.sum(axis=0), "Obiettivo": piano["obiettivo"], "Weekend/festivi": turni[piano["festivi"]].sum(axis=0),
+                                       "Obiettivo weekend/festivi": piano["obiettivo_festivi"]}).round(1), hide_index=True, width='stretch')
+        csv_turni = pd.DataFrame(np.where(turni, "T", ""), columns=medici_piano).assign(**{COL_DATA: piano["date"]}).set_index(COL_DATA).to_csv()
+        st.download_button("⬇️ Turni (CSV)", csv_turni, file_name=f"turni_{chiave}.csv", mime="text/csv", key="btn_scarica_turni")
+
+st.title(f"📝 Input Assenze Medici")
+st.markdown(f"### Periodo: {descrizione_periodo}")
+df_turni_corrente = SessionManager.get_safe('df_turni')
+
+if not medici_pianificati and operazione_in_corso('carica_medici'): st.info("⏳ **Caricamento elenco medici da GitHub...**")
+elif not medici_pianificati: st.info("👈 **Nessun medico selezionato.** Scegli dalla sidebar.")
+elif df_turni_corrente is None or df_turni_corrente.empty:
+    st.warning("📅 Il modulo per l'input delle assenze è vuoto. Verifica selezioni o ricarica."); logger.warning(f"df_turni vuoto/None per input. Medici: {len(medici_pianificati)}.")
+else:
+    pannello_editor_assenze(mesi_periodo, medici_pianificati)
+    st.divider()
+    pannello_salvataggio_assenze(mesi_periodo, medici_pianificati)
+st.divider()
+pannello_consultazione_assenze(selected_anno, selected_mese, anni_disponibili)
+pannello_pianificazione_turni(mesi_periodo, medici_pianificati)
+pannello_importazione_assenze()
+
+with st.sidebar.expander("🛠️ Manutenzione"):
+    op_migrazione = raccogli_operazione_conclusa('migrazione_assenze')
+    if op_migrazione is not None and op_migrazione.stato == "completata":
+        st.success(f"Convertiti {len(op_migrazione.risultato)} file al formato compatto." if op_migrazione.risultato else "Tutti i file assenze sono già nel formato compatto.")
+    elif op_migrazione is not None: st.error(f"❌ Conversione non riuscita: {op_migrazione.errore}")
+    if st.button("Converti file assenze al formato compatto", key="btn_migra_assenze", help="Riscrive in un solo commit i file assenze salvati con il vecchio formato per giorno.",
+                 disabled=operazione_in_corso('migrazione_assenze')):
+        avvia_operazione_github('migrazione_assenze', "migrazione_assenze", "Conversione file assenze al formato compatto", migra_file_assenze_github)
+    if app_config.get('DIAGNOSTICA_TOKEN'): st.markdown("[🩺 Diagnostica prestazioni](?pagina=diagnostica)", help="Latenze, chiamate GitHub, cache e memoria delle sessioni. Aggiungere &token=<DIAGNOSTICA_TOKEN> all'indirizzo.")
+
+if any(not op.conclusa for op in SessionManager.get_safe('operazioni_github', {}).values()) or pianificazione_in_corso():
+    with st.sidebar: monitora_operazioni_github()
+
 st.sidebar.divider()
 st.sidebar.markdown(f"""<div style="font-size: 0.8em; text-align: center; color: grey;">
     Input Assenze Medici v1.2<br>
     {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}</div>""", unsafe_allow_html=True)
 logger.info("--- Rendering pagina completato (Input Assenze) ---")
+chiudi_rerun_metriche()
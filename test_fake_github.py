@@ -0,0 +1,128 @@
+"""
+Test del GitHub finto (fake_github.py) e del salvataggio batch di streamlit_app.py eseguito contro di esso.
+
+Uso:
+    python -m pytest test_fake_github.py   (oppure: python -m unittest test_fake_github)
+"""
+import base64
+import json
+import os
+import tempfile
+import unittest
+
+import requests
+
+import fake_github
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+
+
+class ServerFinto(unittest.TestCase):
+    """Un server finto in background per test, con `medici.json` già nel repository."""
+    max_voci_albero = None
+    def setUp(self):
+        self.server = fake_github.avvia_in_background(max_voci_albero=self.max_voci_albero)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/repos/u/r"; self.http = requests.Session()
+        self.server.repo.scrivi_file("medici.json", json.dumps(["Aisoni", "Lacavalla"]).encode())
+    def tearDown(self): self.http.close(); self.server.shutdown(); self.server.server_close()
+    def get(self, resto, **kwargs): return self.http.get(self.url + resto, **kwargs)
+    def head(self): return self.get("/git/ref/heads/main").json()["object"]["sha"]
+    def commit(self, voci, parent, messaggio="Batch"):
+        """Albero (sopra quello di `parent`) con `voci` `{path: testo}` e commit figlio di `parent`; restituisce lo SHA del commit."""
+        base_tree = self.get(f"/git/commits/{parent}").json()["tree"]["sha"]
+        res = self.http.post(self.url + "/git/trees", json={"base_tree": base_tree, "tree": [{"path": p, "mode": "100644", "type": "blob", "content": t} for p, t in voci.items()]})
+        self.assertEqual(res.status_code, 201)
+        res = self.http.post(self.url + "/git/commits", json={"message": messaggio, "tree": res.json()["sha"], "parents": [parent]}); self.assertEqual(res.status_code, 201)
+        return res.json()["sha"]
+    def sposta_ref(self, commit_sha): return self.http.patch(self.url + "/git/refs/heads/main", json={"sha": commit_sha, "force": False})
+
+
+class TestGitDataApi(ServerFinto):
+    def test_ref_albero_commit_ref(self):
+        head = self.head(); commit_sha = self.commit({"a.json": '{"a":1}', "b.json": '{"b":2}'}, head)
+        res = self.sposta_ref(commit_sha); self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.head(), commit_sha)
+        self.assertEqual(self.get(f"/git/commits/{commit_sha}").json()["parents"], [{"sha": head}])
+        albero = self.get(f"/git/trees/{self.get(f'/git/commits/{commit_sha}').json()['tree']['sha']}", params={"recursive": "1"}).json()
+        self.assertFalse(albero["truncated"]); self.assertEqual([v["path"] for v in albero["tree"]], ["a.json", "b.json", "medici.json"])
+        contenuto, sha = self.server.repo.leggi_file("b.json")
+        self.assertEqual(contenuto, b'{"b":2}'); self.assertEqual(sha, fake_github.sha_blob_git(contenuto))
+
+    def test_ref_avanzato_nel_frattempo_422(self):
+        head = self.head(); commit_sha = self.commit({"a.json": '{"a":1}'}, head)
+        self.server.repo.scrivi_file("altro.json", b"{}") # Un altro client sposta il branch tra la lettura del ref e il PATCH
+        res = self.sposta_ref(commit_sha); self.assertEqual(res.status_code, 422); self.assertIn("fast forward", res.json()["message"])
+        self.assertIsNone(self.server.repo.leggi_file("a.json")[0])
+        res = self.sposta_ref(self.commit({"a.json": '{"a":1}'}, self.head())); self.assertEqual(res.status_code, 200) # Ricostruito sul nuovo head
+        self.assertEqual(self.server.repo.leggi_file("altro.json")[0], b"{}"); self.assertEqual(self.server.repo.leggi_file("a.json")[0], b'{"a":1}')
+
+    def test_contents_controllo_sha(self):
+        _, sha = self.server.repo.leggi_file("medici.json"); contenuto = base64.b64encode(b'["Rossi"]').decode()
+        res = self.http.put(self.url + "/contents/medici.json", json={"content": contenuto, "sha": "0" * 40}); self.assertEqual(res.status_code, 409)
+        res = self.http.put(self.url + "/contents/medici.json", json={"content": contenuto}); self.assertEqual(res.status_code, 422) # File esistente senza SHA
+        res = self.http.put(self.url + "/contents/medici.json", json={"content": contenuto, "sha": sha}); self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["content"]["sha"], fake_github.sha_blob_git(b'["Rossi"]'))
+        res = self.http.put(self.url + "/contents/nuovo.json", json={"content": contenuto}); self.assertEqual(res.status_code, 201)
+
+    def test_contents_etag_e_ref_commit(self):
+        res = self.get("/contents/medici.json"); etag = res.headers["ETag"]
+        self.assertEqual(self.get("/contents/medici.json", headers={"If-None-Match": etag}).status_code, 304)
+        head = self.head(); self.server.repo.scrivi_file("medici.json", b"[]")
+        self.assertEqual(self.get("/contents/medici.json", params={"ref": head}).headers["ETag"], etag) # Versione al commit indicato
+        self.assertEqual(self.get("/contents/medici.json", params={"ref": "inesistente"}).status_code, 404)
+
+    def test_guasto_iniettato(self):
+        fake_github.inietta_guasto(self.server, 403, metodi=("GET",))
+        res = self.get("/contents/medici.json"); self.assertEqual(res.status_code, 403); self.assertEqual(res.headers["Retry-After"], "1")
+        self.assertEqual(self.get("/contents/medici.json").status_code, 200)
+
+
+class TestAlberoTroncato(ServerFinto):
+    max_voci_albero = 2
+    def test_albero_troncato(self):
+        for nome in ("a.json", "b.json", "c.json"): self.server.repo.scrivi_file(nome, b"{}")
+        albero = self.get(f"/git/trees/{self.get(f'/git/commits/{self.head()}').json()['tree']['sha']}", params={"recursive": "1"}).json()
+        self.assertTrue(albero["truncated"]); self.assertEqual(len(albero["tree"]), 2)
+
+
+class TestSalvataggioBatchApp(ServerFinto):
+    """`salva_file_batch_github` di streamlit_app.py contro il server finto, eseguita dentro un AppTest di Streamlit."""
+    max_voci_albero = 2 # L'elenco del repository è sempre troncato: il controllo degli SHA deve ricorrere alla contents API
+    CODICE = '''
+try: st.session_state["esito_batch"] = ("ok", salva_file_batch_github(FILE_BATCH, sha_attesi=SHA_ATTESI))
+except GitHubConflitto as e: st.session_state["esito_batch"] = ("conflitto", sorted(e.percorsi))
+'''
+    def setUp(self):
+        super().setUp(); self.cartella = tempfile.TemporaryDirectory(); self.cwd = os.getcwd(); os.chdir(self.cartella.name) # Log e journal dell'app
+        for mese in (1, 2, 3): self.server.repo.scrivi_file(f"assenze_medici_2025_{mese:02}.json", json.dumps({"versione": 2, "anno": 2025, "mese": mese, "medici": {}}).encode())
+    def tearDown(self): os.chdir(self.cwd); self.cartella.cleanup(); super().tearDown()
+    def salva_batch(self, file_batch, sha_attesi):
+        import streamlit as st
+        from streamlit.testing.v1 import AppTest
+        st.cache_resource.clear(); st.cache_data.clear() # Client e configurazione in cache sono per processo: ogni test ha il suo server finto
+        with open(APP_PATH, encoding="utf-8") as f: sorgente = f.read()
+        at = AppTest.from_string(f"{sorgente}\nFILE_BATCH = {file_batch!r}\nSHA_ATTESI = {sha_attesi!r}\n{self.CODICE}", default_timeout=30)
+        for chiave, valore in {"GITHUB_USER": "u", "REPO_NAME": "r", "GITHUB_TOKEN": "t", "GITHUB_API_URL": f"http://127.0.0.1:{self.server.server_port}",
+                               "SNAPSHOT_DIR": os.path.join(self.cartella.name, "snapshot"), "METRICHE_FILE": os.path.join(self.cartella.name, "metriche.prom")}.items(): at.secrets[chiave] = valore
+        at.run(); self.assertFalse(at.exception, [e.value for e in at.exception]); return at.session_state["esito_batch"]
+
+    def test_batch_con_sha_attesi(self):
+        sha = {p: self.server.repo.leggi_file(p)[1] for p in ("assenze_medici_2025_02.json", "assenze_medici_2025_03.json")}
+        dati = {p: {"versione": 2, "anno": 2025, "mese": int(p[-7:-5]), "medici": {"Aisoni": [{"start": "2025-01-01", "end": "2025-01-01", "tipo": "Ferie"}]}} for p in sha}
+        esito, nuovi_sha = self.salva_batch(dati, sha)
+        self.assertEqual(esito, "ok")
+        for path in sha: self.assertEqual(self.server.repo.leggi_file(path)[1], nuovi_sha[path])
+
+    def test_conflitto_su_file_fuori_dall_albero_troncato(self):
+        path = "assenze_medici_2025_03.json"; sha_vecchio = self.server.repo.leggi_file(path)[1]
+        self.server.repo.scrivi_file(path, b'{"versione":2,"anno":2025,"mese":3,"medici":{"Lacavalla":[]}}') # Modificato da un altro utente
+        esito, percorsi = self.salva_batch({path: {"versione": 2, "anno": 2025, "mese": 3, "medici": {}}}, {path: sha_vecchio})
+        self.assertEqual((esito, percorsi), ("conflitto", [path]))
+        esito, percorsi = self.salva_batch({path: {"versione": 2, "anno": 2025, "mese": 3, "medici": {}}}, {path: None}) # Atteso nuovo ma esistente: niente sovrascrittura
+        self.assertEqual((esito, percorsi), ("conflitto", [path]))
+        esito, percorsi = self.salva_batch({"assenze_medici_2025_04.json": {"versione": 2, "anno": 2025, "mese": 4, "medici": {}}}, {"assenze_medici_2025_04.json": "0" * 40})
+        self.assertEqual((esito, percorsi), ("conflitto", ["assenze_medici_2025_04.json"])) # Atteso ma inesistente
+
+
+if __name__ == "__main__":
+    unittest.main()
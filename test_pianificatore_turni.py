@@ -0,0 +1,69 @@
+"""
+Test del motore di pianificazione turni (pianificatore_turni.py): vincoli di copertura, turni consecutivi e assenze,
+warm start e validazione degli argomenti.
+
+Uso:
+    python -m pytest test_pianificatore_turni.py   (oppure: python -m unittest test_pianificatore_turni)
+"""
+import unittest
+
+import numpy as np
+
+import pianificatore_turni
+
+
+def periodo(n_giorni=30, n_medici=8, quota_assenze=0.15, seme=1):
+    """(assenti, festivi) casuali ma riproducibili: weekend ogni 7 giorni."""
+    casuale = np.random.default_rng(seme)
+    assenti = casuale.random((n_giorni, n_medici)) < quota_assenze; festivi = np.arange(n_giorni) % 7 >= 5
+    return assenti, festivi
+
+
+class TestPianifica(unittest.TestCase):
+    def setUp(self): self.regole = pianificatore_turni.RegolePianificazione(minimo_feriale=3, minimo_festivo=2, max_consecutivi=3, secondi_max=0.5)
+
+    def verifica_vincoli(self, risultato, assenti, festivi):
+        turni = risultato["turni"]; richiesti = self.regole.richiesti(festivi)
+        self.assertEqual(turni.shape, assenti.shape); self.assertEqual(turni.dtype, bool)
+        self.assertFalse((turni & assenti).any(), "turno assegnato in un giorno di assenza")
+        np.testing.assert_array_equal(turni.sum(axis=1) + risultato["scoperture"], richiesti) # Copertura: di turno + scoperti = richiesti
+        self.assertLessEqual(int(pianificatore_turni.corse_consecutive(turni)[0].max()), self.regole.max_consecutivi)
+        self.assertEqual(risultato["statistiche"]["scoperture"], int(risultato["scoperture"].sum()))
+        self.assertLessEqual(risultato["statistiche"]["obiettivo_finale"], risultato["statistiche"]["obiettivo_iniziale"])
+
+    def test_copertura_consecutivi_e_assenze(self):
+        for seme in range(5):
+            with self.subTest(seme=seme):
+                assenti, festivi = periodo(seme=seme); risultato = pianificatore_turni.pianifica(assenti, festivi, self.regole)
+                self.verifica_vincoli(risultato, assenti, festivi); self.assertEqual(risultato["statistiche"]["scoperture"], 0)
+                self.assertFalse(risultato["statistiche"]["warm_start"]); self.assertIsNone(risultato["statistiche"]["celle_cambiate"])
+
+    def test_scoperture_quando_mancano_medici(self):
+        assenti, festivi = periodo(); assenti[10, :-1] = True # Un solo medico disponibile il giorno 10
+        risultato = pianificatore_turni.pianifica(assenti, festivi, self.regole)
+        self.verifica_vincoli(risultato, assenti, festivi)
+        self.assertEqual(int(risultato["turni"][10].sum()), 1); self.assertEqual(int(risultato["scoperture"][10]), self.regole.richiesti(festivi)[10] - 1)
+
+    def test_warm_start(self):
+        assenti, festivi = periodo(); primo = pianificatore_turni.pianifica(assenti, festivi, self.regole)
+        stesso = pianificatore_turni.pianifica(assenti, festivi, self.regole, iniziale=primo["turni"])
+        self.assertTrue(stesso["statistiche"]["warm_start"]); self.assertEqual(stesso["statistiche"]["celle_cambiate"], 0)
+        np.testing.assert_array_equal(stesso["turni"], primo["turni"])
+        giorno, medico = map(int, np.argwhere(primo["turni"] & ~festivi[:, None])[0]); assenti[giorno, medico] = True # Nuova assenza su un turno assegnato
+        ripianificato = pianificatore_turni.pianifica(assenti, festivi, self.regole, iniziale=primo["turni"])
+        self.verifica_vincoli(ripianificato, assenti, festivi)
+        cambiate = int((ripianificato["turni"] != primo["turni"]).sum())
+        self.assertEqual(ripianificato["statistiche"]["celle_cambiate"], cambiate); self.assertGreaterEqual(cambiate, 1)
+        self.assertLess(cambiate, primo["turni"].size // 10) # Il piano precedente resta in gran parte invariato
+
+    def test_forma_del_warm_start_incompatibile(self):
+        assenti, festivi = periodo()
+        with self.assertRaises(ValueError): pianificatore_turni.pianifica(assenti, festivi, self.regole, iniziale=np.zeros((assenti.shape[0], assenti.shape[1] + 1), dtype=bool))
+
+    def test_periodo_senza_medici(self):
+        risultato = pianificatore_turni.pianifica(np.zeros((7, 0), dtype=bool), np.zeros(7, dtype=bool), self.regole)
+        self.assertEqual(risultato["turni"].shape, (7, 0)); self.assertEqual(risultato["statistiche"]["scoperture"], 7 * self.regole.minimo_feriale)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,331 @@
+"""
+Test unitari delle funzioni di streamlit_app.py (file assenze: merge, formato e importazione; registro medici; indice assenze; journal del salvataggio automatico; accesso alla diagnostica; pianificazione turni in un processo separato).
+
+Lo script viene eseguito una volta per modulo in un AppTest di Streamlit, contro il GitHub finto di fake_github.py,
+e i test chiamano direttamente le funzioni del suo namespace.
+
+Uso:
+    python -m pytest test_streamlit_app.py   (oppure: python -m unittest test_streamlit_app)
+"""
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from datetime import date, datetime
+
+import numpy as np
+import openpyxl
+
+import fake_github
+import pianificatore_turni
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+app = {} # Namespace globale dello script dopo il primo run
+
+
+def nuovo_app_test(codice_aggiunto=""):
+    """AppTest dello script (più `codice_aggiunto`) configurato sul GitHub finto del modulo."""
+    from streamlit.testing.v1 import AppTest
+    with open(APP_PATH, encoding="utf-8") as f: sorgente = f.read()
+    at = AppTest.from_string(f"{sorgente}\n{codice_aggiunto}\n", default_timeout=30)
+    for chiave, valore in {"GITHUB_USER": "u", "REPO_NAME": "r", "GITHUB_TOKEN": "t", "GITHUB_API_URL": f"http://127.0.0.1:{server.server_port}",
+                           "SNAPSHOT_DIR": os.path.join(cartella.name, "snapshot"), "METRICHE_FILE": os.path.join(cartella.name, "metriche.prom")}.items(): at.secrets[chiave] = valore
+    return at
+
+def setUpModule():
+    import streamlit as st
+    global server, cartella, cwd, app_test
+    st.cache_resource.clear(); st.cache_data.clear() # Configurazione e client in cache sono per processo: niente resti di altri moduli di test
+    server = fake_github.avvia_in_background(); server.repo.scrivi_file("medici.json", json.dumps(["Aisoni", "Lacavalla"]).encode())
+    cartella = tempfile.TemporaryDirectory(); cwd = os.getcwd(); os.chdir(cartella.name) # Log e journal dell'app
+    app_test = at = nuovo_app_test("st.session_state['_app'] = globals()"); at.run()
+    if at.exception: raise RuntimeError([e.value for e in at.exception])
+    app.update(at.session_state["_app"])
+
+def tearDownModule(): os.chdir(cwd); cartella.cleanup(); server.shutdown(); server.server_close()
+
+
+A1, A2, B1, C1 = ("Aisoni", "2025-06-01"), ("Aisoni", "2025-06-02"), ("Bianchi", "2025-06-01"), ("Conti", "2025-06-01")
+
+class TestUnisciAssenzeTreVie(unittest.TestCase):
+    CASI = [ # (descrizione, base, locale, remoto, medici_gestiti, unite attese, conflitti attesi)
+        ("solo locale cambiato", {A1: "Ferie"}, {A1: "Malattia"}, {A1: "Ferie"}, None, {A1: "Malattia"}, {}),
+        ("solo remoto cambiato", {A1: "Ferie"}, {A1: "Ferie"}, {A1: "Congresso"}, None, {A1: "Congresso"}, {}),
+        ("entrambi, stesso valore", {A1: "Ferie"}, {A1: "Malattia"}, {A1: "Malattia"}, None, {A1: "Malattia"}, {}),
+        ("entrambi, valori diversi", {A1: "Ferie"}, {A1: "Malattia"}, {A1: "Congresso"}, None, {A1: "Malattia"}, {A1: ("Ferie", "Malattia", "Congresso")}),
+        ("cancellata in locale, cambiata in remoto", {A1: "Ferie"}, {}, {A1: "Altro"}, None, {}, {A1: ("Ferie", "Presente", "Altro")}),
+        ("cancellata in locale", {A1: "Ferie", A2: "Ferie"}, {A2: "Ferie"}, {A1: "Ferie", A2: "Ferie"}, None, {A2: "Ferie"}, {}),
+        ("modifiche diverse su celle diverse", {A1: "Ferie"}, {A1: "Ferie", A2: "Lezione"}, {A1: "Ferie", B1: "Malattia"}, None, {A1: "Ferie", A2: "Lezione", B1: "Malattia"}, {}),
+        ("medico aggiunto in locale", {A1: "Ferie"}, {A1: "Ferie", C1: "Congresso"}, {A1: "Ferie"}, None, {A1: "Ferie", C1: "Congresso"}, {}),
+        ("medico aggiunto in remoto", {A1: "Ferie"}, {A1: "Ferie"}, {A1: "Ferie", C1: "Congresso"}, None, {A1: "Ferie", C1: "Congresso"}, {}),
+        ("medico rimosso in remoto", {A1: "Ferie", B1: "Malattia"}, {A1: "Ferie", B1: "Malattia"}, {A1: "Ferie"}, None, {A1: "Ferie"}, {}),
+        ("medico rimosso in locale", {A1: "Ferie", B1: "Malattia"}, {A1: "Ferie"}, {A1: "Ferie", B1: "Malattia"}, None, {A1: "Ferie"}, {}),
+        ("medico fuori dall'editor: vale la base", {A1: "Ferie", B1: "Malattia"}, {A1: "Lezione"}, {A1: "Ferie", B1: "Malattia"}, {"Aisoni"}, {A1: "Lezione", B1: "Malattia"}, {}),
+        ("medico fuori dall'editor cambiato in remoto", {B1: "Malattia"}, {}, {B1: "Altro"}, {"Aisoni"}, {B1: "Altro"}, {}),
+        ("nessuna modifica", {A1: "Ferie"}, {A1: "Ferie"}, {A1: "Ferie"}, None, {A1: "Ferie"}, {}),
+    ]
+    def test_casi(self):
+        for descrizione, base, locale, remoto, gestiti, unite_attese, conflitti_attesi in self.CASI:
+            with self.subTest(descrizione):
+                unite, conflitti = app["unisci_assenze_tre_vie"](base, locale, remoto, gestiti)
+                self.assertEqual(unite, unite_attese); self.assertEqual(conflitti, conflitti_attesi)
+
+
+class TestFormatoAssenze(unittest.TestCase):
+    """Formato su disco: lettura v1 (un record per giorno) e v2 (intervalli), codifica v2 e andata/ritorno senza perdite."""
+    def andata_ritorno(self, anno, mese, celle):
+        """Celle -> file v2 -> JSON su disco -> celle."""
+        dati = json.loads(app["serializza_json_github"](app["codifica_assenze"](anno, mese, celle)))
+        self.assertEqual(dati["versione"], app["FORMATO_ASSENZE_VERSIONE"]); return app["celle_assenze"](dati)
+
+    def test_v1_celle_v2_celle_identita(self):
+        with open(os.path.join(os.path.dirname(APP_PATH), "assenze_medici_2025_06.json"), encoding="utf-8") as f: v1 = json.load(f)
+        celle = app["celle_assenze"](v1)
+        self.assertEqual(celle[("Andreotti", "2025-06-08")], "Ferie"); self.assertEqual(len(celle), 6)
+        self.assertEqual(self.andata_ritorno(2025, 6, celle), celle)
+        v2 = app["codifica_assenze"](2025, 6, celle)
+        self.assertEqual(v2["medici"]["Andreotti"], [{"start": "2025-06-07", "end": "2025-06-09", "tipo": "Ferie"}])
+        self.assertEqual(app["celle_assenze"](v2), app["celle_assenze"](json.loads(json.dumps(v1)))) # v1 e v2 descrivono le stesse celle
+
+    def test_cambio_tipo_divide_intervallo(self):
+        celle = {("Aisoni", f"2025-06-{g:02}"): tipo for g, tipo in [(1, "Ferie"), (2, "Ferie"), (3, "Malattia"), (4, "Malattia"), (5, "Ferie"), (7, "Ferie"), (8, "Presente")]}
+        v2 = app["codifica_assenze"](2025, 6, celle)
+        self.assertEqual(v2["medici"]["Aisoni"], [{"start": "2025-06-01", "end": "2025-06-02", "tipo": "Ferie"}, {"start": "2025-06-03", "end": "2025-06-04", "tipo": "Malattia"},
+                                                  {"start": "2025-06-05", "end": "2025-06-05", "tipo": "Ferie"}, {"start": "2025-06-07", "end": "2025-06-07", "tipo": "Ferie"}])
+        self.assertEqual(self.andata_ritorno(2025, 6, celle), {k: t for k, t in celle.items() if t != "Presente"}) # 'Presente' non viene scritto
+
+    def test_mese_vuoto(self):
+        self.assertEqual(app["celle_assenze"](None), {}); self.assertEqual(app["celle_assenze"]({"anno": 2025, "mese": 6, "medici": {}}), {})
+        self.assertEqual(app["celle_assenze"]({"anno": 2025, "mese": 6, "medici": {"Aisoni": []}}), {})
+        self.assertEqual(app["codifica_assenze"](2025, 6, {}), {"versione": app["FORMATO_ASSENZE_VERSIONE"], "anno": 2025, "mese": 6, "medici": {}})
+        self.assertEqual(self.andata_ritorno(2025, 6, {("Aisoni", "2025-06-01"): "Presente"}), {})
+
+    def test_fine_mese_e_29_febbraio(self):
+        for anno, mese, giorni in ((2024, 2, range(26, 30)), (2025, 2, range(26, 29)), (2025, 1, range(29, 32)), (2025, 4, range(29, 31))):
+            with self.subTest(f"{anno}-{mese:02}"):
+                celle = {("Aisoni", f"{anno}-{mese:02}-{g:02}"): "Ferie" for g in giorni}
+                v2 = app["codifica_assenze"](anno, mese, celle)
+                self.assertEqual(v2["medici"]["Aisoni"], [{"start": f"{anno}-{mese:02}-{giorni[0]:02}", "end": f"{anno}-{mese:02}-{giorni[-1]:02}", "tipo": "Ferie"}])
+                self.assertEqual(self.andata_ritorno(anno, mese, celle), celle)
+        intervallo = lambda start, end: {"versione": 2, "medici": {"Aisoni": [{"start": start, "end": end, "tipo": "Ferie"}]}}
+        self.assertEqual(sorted(d for _, d in app["celle_assenze"](intervallo("2024-02-28", "2024-03-01"))), ["2024-02-28", "2024-02-29", "2024-03-01"])
+        self.assertEqual(sorted(d for _, d in app["celle_assenze"](intervallo("2025-02-28", "2025-03-01"))), ["2025-02-28", "2025-03-01"])
+        v1 = {"anno": 2024, "mese": 2, "medici": {"Aisoni": [{"Data": "2024-02-28", "tipo_assenza": "Ferie"}, {"Data": "2024-02-29", "tipo_assenza": "Ferie"}]}}
+        self.assertEqual(app["codifica_assenze"](2024, 2, app["celle_assenze"](v1))["medici"]["Aisoni"], [{"start": "2024-02-28", "end": "2024-02-29", "tipo": "Ferie"}])
+
+
+class TestImportAssenze(unittest.TestCase):
+    """`righe_file_import` (CSV con delimitatore rilevato, XLSX) e `leggi_import_assenze` (validazione ed espansione per giorno)."""
+    MEDICI = ["Aisoni", "Lacavalla"]
+    def leggi(self, testo_o_byte, nome_file="import.csv"):
+        contenuto = testo_o_byte.encode("utf-8") if isinstance(testo_o_byte, str) else testo_o_byte
+        return app["leggi_import_assenze"](app["righe_file_import"](io.BytesIO(contenuto), nome_file), self.MEDICI)
+    def scarti(self, scarti): return list(zip(scarti["Riga"], scarti["Motivo"]))
+
+    def test_delimitatori(self):
+        righe = [["Medico", "Dal", "Al", "Tipo"], ["Aisoni", "2025-06-02", "2025-06-03", "Ferie"], ["Lacavalla", "2025-06-05", "", "malattia"]]
+        esiti = [self.leggi("\n".join(sep.join(r) for r in righe) + "\n") for sep in (";", ",", "\t")]
+        for celle, scarti in esiti:
+            self.assertEqual(celle, {"assenze_medici_2025_06.json": {("Aisoni", "2025-06-02"): "Ferie", ("Aisoni", "2025-06-03"): "Ferie", ("Lacavalla", "2025-06-05"): "Malattia"}})
+            self.assertTrue(scarti.empty)
+
+    def test_formati_di_data_misti(self):
+        celle, scarti = self.leggi("Nome;Data inizio;Data fine;Causale\nAisoni;2025-06-03;04/06/2025;Ferie\nLacavalla;05/06/2025;2025-06-05T00:00:00;Congresso\n aisoni ;7/6/2025;;Lezione\n")
+        self.assertTrue(scarti.empty, scarti)
+        self.assertEqual(celle["assenze_medici_2025_06.json"], {("Aisoni", "2025-06-03"): "Ferie", ("Aisoni", "2025-06-04"): "Ferie", ("Lacavalla", "2025-06-05"): "Congresso", ("Aisoni", "2025-06-07"): "Lezione"})
+
+    def test_righe_scartate(self):
+        celle, scarti = self.leggi("Medico;Dal;Al;Tipo\nRossi;2025-06-01;2025-06-02;Ferie\nAisoni;2025-06-10;2025-06-08;Ferie\nAisoni;31/02/2025;;Ferie\n"
+                                   "Aisoni;2025-06-01;2025-13-45;Ferie\nAisoni;2025-06-01;;Vacanza\nLacavalla;2025-06-20;2025-06-20;Altro\n")
+        self.assertEqual(self.scarti(scarti), [(2, "Medico non in elenco"), (3, "Data fine prima della data inizio"), (4, "Data inizio non valida"), (5, "Data fine non valida"), (6, "Tipo assenza non valido")])
+        self.assertEqual(celle, {"assenze_medici_2025_06.json": {("Lacavalla", "2025-06-20"): "Altro"}})
+
+    def test_intervallo_su_piu_mesi(self):
+        celle, scarti = self.leggi("Medico,Dal,Al,Tipo\nAisoni,2025-06-29,2025-07-02,Ferie\nLacavalla,2024-02-28,2024-03-01,Malattia\n")
+        self.assertTrue(scarti.empty)
+        self.assertEqual(celle, {"assenze_medici_2025_06.json": {("Aisoni", "2025-06-29"): "Ferie", ("Aisoni", "2025-06-30"): "Ferie"},
+                                 "assenze_medici_2025_07.json": {("Aisoni", "2025-07-01"): "Ferie", ("Aisoni", "2025-07-02"): "Ferie"},
+                                 "assenze_medici_2024_02.json": {("Lacavalla", "2024-02-28"): "Malattia", ("Lacavalla", "2024-02-29"): "Malattia"},
+                                 "assenze_medici_2024_03.json": {("Lacavalla", "2024-03-01"): "Malattia"}})
+
+    def test_solo_intestazione_e_file_vuoto(self):
+        celle, scarti = self.leggi("Medico;Dal;Al;Tipo\n"); self.assertEqual(celle, {}); self.assertTrue(scarti.empty)
+        with self.assertRaisesRegex(ValueError, "vuoto"): self.leggi("")
+        with self.assertRaisesRegex(ValueError, "Colonne mancanti: tipo"): self.leggi("Medico;Dal;Al\nAisoni;2025-06-01;2025-06-01\n")
+
+    def test_xlsx_in_memoria(self):
+        workbook = openpyxl.Workbook(); foglio = workbook.active
+        for riga in (["Medico", "Dal", "Al", "Tipo"], ["Aisoni", datetime(2025, 6, 30), datetime(2025, 7, 1), "Ferie"], ["Lacavalla", "02/06/2025", None, "Congresso"],
+                     [None, None, None, None], ["Bianchi", datetime(2025, 6, 1), None, "Ferie"]): foglio.append(riga)
+        buffer = io.BytesIO(); workbook.save(buffer)
+        celle, scarti = self.leggi(buffer.getvalue(), "import.xlsx")
+        self.assertEqual(celle, {"assenze_medici_2025_06.json": {("Aisoni", "2025-06-30"): "Ferie", ("Lacavalla", "2025-06-02"): "Congresso"},
+                                 "assenze_medici_2025_07.json": {("Aisoni", "2025-07-01"): "Ferie"}})
+        self.assertEqual(self.scarti(scarti), [(5, "Medico non in elenco")]) # La riga vuota è saltata ma conta nella numerazione
+
+
+class TestRegistroMedici(unittest.TestCase):
+    MEDICI = ["Aisoni", "Lacavalla", "Ferri", "Rossi Mario", "Della Valle Francesco"]
+    def setUp(self): self.registro = app["RegistroMedici"](self.MEDICI)
+
+    def test_simili(self):
+        casi = [("Rossi Maria", ["Rossi Mario"]), ("Feri", ["Ferri"]), ("Rossi", ["Rossi Mario"]), ("Aisoni M.", ["Aisoni"]), ("Lacavala", ["Lacavalla"]), ("LACAVALLA  ", ["Lacavalla"]),
+                ("Dela Vale Francesco", ["Della Valle Francesco"]), ("Dela Vale Franco", []), ("Bianchi", []), ("Verdi Anna", []), ("Lacavallo Anna", [])]
+        for nome, attesi in casi:
+            with self.subTest(nome): self.assertEqual(self.registro.simili(nome), attesi)
+
+    def test_valida(self):
+        self.assertEqual(self.registro.valida(" Verdi Anna "), (True, "Verdi Anna"))
+        self.assertFalse(self.registro.valida("rossi mario")[0]) # Duplicato esatto dopo la normalizzazione
+        valido, messaggio = self.registro.valida("Rossi Maria"); self.assertFalse(valido); self.assertIn("Rossi Mario", messaggio)
+        self.assertEqual(self.registro.valida("Rossi Maria", consenti_simili=True), (True, "Rossi Maria"))
+        for nome in ("", "A", "Rossi 2", "x" * 101): self.assertFalse(self.registro.valida(nome)[0], nome)
+
+    def test_con_modifiche(self):
+        nuovo, errori = self.registro.con_modifiche(["Verdi Anna", "Bianchi"], ["Ferri"])
+        self.assertEqual(errori, {}); self.assertEqual(nuovo.medici, ["Aisoni", "Bianchi", "Della Valle Francesco", "Lacavalla", "Rossi Mario", "Verdi Anna"])
+        self.assertEqual(self.registro.medici, sorted(self.MEDICI)); self.assertIsNone(self.registro.trova("Bianchi")) # Il registro di partenza non cambia
+        nuovo, errori = self.registro.con_modifiche(["Rossi Maria"], ["Rossi Mario"]) # Rimozioni prima delle aggiunte: il simile non c'è più
+        self.assertEqual(errori, {}); self.assertEqual(nuovo.trova("rossi maria"), "Rossi Maria")
+        nuovo, errori = self.registro.con_modifiche(["Verdi Anna", "Verdi Anne"], []) # Ogni nome è validato anche contro gli altri del blocco
+        self.assertEqual(list(errori), ["Verdi Anne"])
+
+    def test_blocco_con_un_errore(self):
+        _, errori = self.registro.con_modifiche(["Verdi Anna", "Aisoni", "Rossi Maria", "Neri 7"], ["Bianchi", "Lacavalla"])
+        self.assertEqual(sorted(errori), ["Aisoni", "Bianchi", "Neri 7", "Rossi Maria"])
+        self.assertEqual(self.registro.con_modifiche(["Rossi Maria"], [], consenti_simili=True)[1], {})
+        # Nell'app un solo errore fa rifiutare tutto il blocco: nessun salvataggio dell'elenco su GitHub
+        contenuto_prima = server.repo.leggi_file("medici.json"); chiave_invio = "FormSubmitter:form_medici_multipli-Applica con un solo salvataggio"
+        for _ in range(50): # Il form resta disabilitato finché l'elenco medici non è stato letto da GitHub in background
+            if not app_test.button(key=chiave_invio).disabled: break
+            time.sleep(0.1); app_test.run()
+        app_test.text_area(key="txt_medici_multipli").input("Verdi Anna\nAisoni M.")
+        app_test.button(key=chiave_invio).click().run()
+        self.assertTrue(any("Nessuna modifica applicata" in e.value and "Aisoni M." in e.value and "Verdi Anna" not in e.value for e in app_test.error), [e.value for e in app_test.error])
+        self.assertNotIn('salva_medici', app_test.session_state["operazioni_github"]); self.assertEqual(server.repo.leggi_file("medici.json"), contenuto_prima)
+
+
+class TestIndiceAssenze(unittest.TestCase):
+    """`IndiceAssenze` nuovo per ogni test, allineato ai file assenze del GitHub finto (formati v1 e v2, più mesi e anni)."""
+    FILE = {"assenze_medici_2025_06.json": {"anno": 2025, "mese": 6, "medici": {"Aisoni": [{"Data": "2025-06-29", "tipo_assenza": "Ferie"}, {"Data": "2025-06-30", "tipo_assenza": "Ferie"}],
+                                                                              "Lacavalla": [{"Data": "2025-06-30", "tipo_assenza": "Malattia"}]}},
+            "assenze_medici_2025_07.json": {"versione": 2, "anno": 2025, "mese": 7, "medici": {"Aisoni": [{"start": "2025-07-01", "end": "2025-07-03", "tipo": "Ferie"}],
+                                                                                            "Lacavalla": [{"start": "2025-07-01", "end": "2025-07-01", "tipo": "Congresso"}]}},
+            "assenze_medici_2025_12.json": {"versione": 2, "anno": 2025, "mese": 12, "medici": {"Aisoni": [{"start": "2025-12-31", "end": "2025-12-31", "tipo": "Lezione"}]}},
+            "assenze_medici_2026_01.json": {"versione": 2, "anno": 2026, "mese": 1, "medici": {"Aisoni": [{"start": "2026-01-01", "end": "2026-01-02", "tipo": "Ferie"}]}}}
+    def setUp(self):
+        for path, dati in self.FILE.items(): server.repo.scrivi_file(path, json.dumps(dati).encode())
+        self.indice = app["IndiceAssenze"](2)
+    def tearDown(self): self.indice.executor.shutdown()
+    def assenti(self, giorno): return dict(self.indice.assenti_il(giorno).itertuples(index=False))
+
+    def test_assenti_per_data(self):
+        self.assertEqual(self.indice.aggiorna(2025, 2026), 4); self.assertTrue(self.indice.copre(2025, 2026)); self.assertFalse(self.indice.copre(2024, 2025))
+        self.assertEqual(self.assenti(date(2025, 6, 30)), {"Aisoni": "Ferie", "Lacavalla": "Malattia"})
+        self.assertEqual(self.assenti(date(2025, 7, 1)), {"Aisoni": "Ferie", "Lacavalla": "Congresso"})
+        self.assertEqual(self.assenti(date(2025, 7, 4)), {}); self.assertEqual(self.assenti(date(2026, 1, 2)), {"Aisoni": "Ferie"})
+
+    def test_riepilogo_medico_su_piu_mesi(self):
+        self.indice.aggiorna(2025, 2026)
+        self.assertEqual(self.indice.giorni_per_tipo("Aisoni", 2025).to_dict(), {"Ferie": 5, "Malattia": 0, "Congresso": 0, "Lezione": 1, "Altro": 0})
+        self.assertEqual(self.indice.giorni_per_tipo("Aisoni", 2026)["Ferie"], 2); self.assertEqual(self.indice.giorni_per_tipo("Lacavalla", 2025).sum(), 2)
+        self.assertEqual(self.indice.giorni_per_tipo("Rossi", 2025).sum(), 0)
+
+    def test_giorni_sotto_organico_tra_mesi_e_anni(self):
+        self.indice.aggiorna(2025, 2026)
+        sotto = self.indice.giorni_sotto_organico(["Aisoni", "Lacavalla"], 2, date(2025, 6, 28), date(2025, 7, 4))
+        self.assertEqual(list(sotto[app["COL_DATA"]].dt.strftime("%Y-%m-%d")), ["2025-06-29", "2025-06-30", "2025-07-01", "2025-07-02", "2025-07-03"])
+        self.assertEqual(list(sotto["Presenti"]), [1, 0, 0, 1, 1])
+        sotto = self.indice.giorni_sotto_organico(["Aisoni"], 1, date(2025, 12, 30), date(2026, 1, 3))
+        self.assertEqual(list(sotto[app["COL_DATA"]].dt.strftime("%Y-%m-%d")), ["2025-12-31", "2026-01-01", "2026-01-02"])
+
+    def test_aggiornamento_rilegge_solo_i_file_cambiati(self):
+        self.indice.aggiorna(2025, 2025); self.assertFalse(self.indice.copre(2025, 2026)); self.assertEqual(self.assenti(date(2026, 1, 1)), {})
+        self.assertEqual(self.indice.aggiorna(2025, 2025), 0)
+        server.repo.scrivi_file("assenze_medici_2025_07.json", json.dumps({"versione": 2, "anno": 2025, "mese": 7, "medici": {}}).encode())
+        self.assertEqual(self.indice.aggiorna(2025, 2025), 1); self.assertEqual(self.assenti(date(2025, 7, 1)), {})
+        self.assertEqual(self.assenti(date(2025, 6, 29)), {"Aisoni": "Ferie"})
+
+
+class TestJournalAutosave(unittest.TestCase):
+    """Ripristino del journal di `AutosaveQueue` all'avvio e compattazione dopo un salvataggio riuscito."""
+    GIUGNO, LUGLIO = "assenze_medici_2025_06.json", "assenze_medici_2025_07.json"
+    def setUp(self): self.journal = os.path.join(cartella.name, f"journal_{self._testMethodName}.jsonl")
+    def scrivi_journal(self, righe):
+        with open(self.journal, "w", encoding="utf-8") as f: f.writelines(json.dumps(r) + "\n" for r in righe)
+    def modifica(self, seq, path, medico, data_iso, tipo):
+        anno, mese = int(data_iso[:4]), int(data_iso[5:7]); return {"seq": seq, "ts": 0, "path": path, "anno": anno, "mese": mese, "medico": medico, "data": data_iso, "tipo": tipo}
+
+    def test_ripristino_scarta_le_modifiche_gia_salvate(self):
+        self.scrivi_journal([self.modifica(1, self.GIUGNO, "Aisoni", "2025-06-01", "Ferie"), self.modifica(2, self.GIUGNO, "Aisoni", "2025-06-02", "Ferie"),
+                             self.modifica(3, self.LUGLIO, "Lacavalla", "2025-07-01", "Congresso"), {"flush": self.GIUGNO, "seq": 2},
+                             self.modifica(4, self.GIUGNO, "Aisoni", "2025-06-01", "Malattia"), {"flush": self.LUGLIO, "seq": 3}, {"flush": self.GIUGNO, "seq": 1}])
+        coda = app["AutosaveQueue"](self.journal, float("inf")) # Debounce infinito: il thread non salva durante il test
+        self.assertEqual(coda.modifiche_in_attesa(self.GIUGNO), {("Aisoni", "2025-06-01"): "Malattia"}) # seq <= 2 già salvate, vale il flush più alto
+        self.assertEqual(coda.modifiche_in_attesa(self.LUGLIO), {}); self.assertEqual(coda.in_attesa(), 1)
+        coda.accoda(self.GIUGNO, 2025, 6, "Aisoni", "2025-06-03", "Lezione")
+        with open(self.journal, encoding="utf-8") as f: self.assertEqual(json.loads(f.readlines()[-1])["seq"], 5) # La numerazione riprende dal journal
+
+    def test_journal_vuoto_o_illeggibile(self):
+        self.assertEqual(app["AutosaveQueue"](self.journal, float("inf")).in_attesa(), 0) # Journal inesistente
+        with open(self.journal, "w", encoding="utf-8") as f: f.write("{non json\n")
+        self.assertEqual(app["AutosaveQueue"](self.journal, float("inf")).in_attesa(), 0)
+
+    def test_salvataggio_compatta_il_journal(self):
+        server.repo.scrivi_file(self.GIUGNO, json.dumps({"versione": 2, "anno": 2025, "mese": 6, "medici": {"Lacavalla": [{"start": "2025-06-10", "end": "2025-06-10", "tipo": "Altro"}]}}).encode())
+        self.scrivi_journal([self.modifica(1, self.GIUGNO, "Aisoni", "2025-06-01", "Ferie"), self.modifica(2, self.GIUGNO, "Aisoni", "2025-06-02", "Ferie"), {"flush": self.GIUGNO, "seq": 1}])
+        coda = app["AutosaveQueue"](self.journal, 0)
+        scadenza = time.monotonic() + 15
+        while (coda.in_attesa() or os.path.getsize(self.journal)) and time.monotonic() < scadenza: time.sleep(0.1)
+        self.assertEqual(coda.in_attesa(), 0); self.assertEqual(os.path.getsize(self.journal), 0, "journal non compattato")
+        contenuto, sha = server.repo.leggi_file(self.GIUGNO); self.assertEqual(coda.sha_salvati[self.GIUGNO], sha)
+        self.assertEqual(app["celle_assenze"](json.loads(contenuto)), {("Aisoni", "2025-06-02"): "Ferie", ("Lacavalla", "2025-06-10"): "Altro"}) # La modifica con seq 1 era già salvata
+
+
+class TestAccessoDiagnostica(unittest.TestCase):
+    """La pagina ?pagina=diagnostica è negata senza DIAGNOSTICA_TOKEN configurato e senza il token giusto nell'indirizzo."""
+    def tearDown(self): app["app_config"].config['DIAGNOSTICA_TOKEN'] = None # La configurazione è condivisa dal processo (st.cache_resource)
+    def pagina(self, token_configurato, token=None):
+        app["app_config"].config['DIAGNOSTICA_TOKEN'] = token_configurato; at = nuovo_app_test(); at.query_params["pagina"] = "diagnostica"
+        if token is not None: at.query_params["token"] = token
+        at.run(); self.assertFalse(at.exception, [e.value for e in at.exception]); return at
+    def diagnostica_mostrata(self, at): return any("Diagnostica prestazioni" in t.value for t in at.title)
+
+    def test_accesso(self):
+        for descrizione, configurato, token, ammesso in (("token non configurato", None, None, False), ("token non configurato, token qualsiasi", None, "", False),
+                                                         ("token mancante", "segreto", None, False), ("token errato", "segreto", "segret", False), ("token giusto", "segreto", "segreto", True)):
+            with self.subTest(descrizione):
+                at = self.pagina(configurato, token); self.assertEqual(self.diagnostica_mostrata(at), ammesso)
+                if not ammesso: self.assertTrue(any("diagnostica" in e.value.lower() for e in at.error), [e.value for e in at.error])
+
+    def test_link_solo_con_token(self):
+        for configurato in (None, "segreto"):
+            with self.subTest(configurato=configurato):
+                app["app_config"].config['DIAGNOSTICA_TOKEN'] = configurato; at = nuovo_app_test(); at.run()
+                self.assertEqual(any("?pagina=diagnostica" in m.value for m in at.sidebar.markdown), configurato is not None)
+
+
+class TestPianificazioneInProcesso(unittest.TestCase):
+    """`pianifica_in_processo`: stesso risultato di `pianifica`, errori del figlio riportati e processo terminato al timeout."""
+    def setUp(self):
+        casuale = np.random.default_rng(0); self.assenti = casuale.random((30, 6)) < 0.1; self.festivi = np.arange(30) % 7 >= 5
+        self.regole = pianificatore_turni.RegolePianificazione(minimo_feriale=2, minimo_festivo=1, secondi_max=0.2)
+    def tearDown(self): app["app_config"].config['PIANIFICAZIONE_TIMEOUT_SECONDI'] = 60.0
+
+    def test_risultato_come_in_processo(self):
+        risultato = app["pianifica_in_processo"](self.assenti, self.festivi, self.regole, None)
+        atteso = pianificatore_turni.pianifica(self.assenti, self.festivi, self.regole)
+        np.testing.assert_array_equal(risultato["turni"], atteso["turni"]); np.testing.assert_array_equal(risultato["scoperture"], atteso["scoperture"])
+
+    def test_errore_nel_processo(self):
+        with self.assertRaisesRegex(RuntimeError, "incompatibile"): app["pianifica_in_processo"](self.assenti, self.festivi, self.regole, np.zeros((30, 7), dtype=bool))
+
+    def test_timeout(self):
+        app["app_config"].config['PIANIFICAZIONE_TIMEOUT_SECONDI'] = 0.01
+        with self.assertRaises(TimeoutError): app["pianifica_in_processo"](self.assenti, self.festivi, self.regole, None)
+
+
+if __name__ == "__main__":
+    unittest.main()